@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import argparse
+import sys
+from pathlib import Path
+
+from . import cases  # Registers the benchmarks
+from .runner import DEFAULT_REPEAT, DEFAULT_TOLERANCE, load_baseline, report, run, save_baseline
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'baseline.json'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmarks of the price parsing, price analysis, control decisions '
+                                                 'and inverter round trips.')
+    parser.add_argument('-k', '--pattern', default='*', help='Run only benchmarks matching the shell-style pattern.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Number of timed rounds.')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH, help='JSON file with the baseline.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Relative slowdown or memory growth reported as a regression.')
+    parser.add_argument('--save', action='store_true', help='Store the results as the new baseline.')
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    results = run(args.pattern, args.repeat)
+    if not results:
+        parser.error(f'No benchmark matches {args.pattern!r}.')
+    regressed = report(results, baseline, args.tolerance)
+    if args.save:
+        save_baseline(args.baseline, results, baseline)
+        print(f'Baseline stored to {args.baseline}.')
+    elif regressed:
+        print(f"{len(regressed)} benchmarks regressed: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import asyncio
+import collections
+import contextlib
+import csv
+import datetime
+import itertools
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from goodwe import OperationMode
+
+from components import ote
+from components.battery import BatteryController, plan_battery_charging
+from components.boiler import boiler_load
+from components.car import SurplusTracker
+from components.dispatcher import SurplusDispatcher
+from components.goodwe_utils import InverterClient, ModeWriter
+from .ote_stub import serve
+from .runner import benchmark
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+PRICE_DAY = '2024-10-20'  # Day of the OTE report pages in the fixtures
+OTE_PAGES = {15: f'ote_{PRICE_DAY}_15min.html', 60: f'ote_{PRICE_DAY}_60min.html'}
+TELEMETRY = 'telemetry_2024-06-20.csv'  # One day of inverter readings, one per minute
+
+# GeneralSettings defaults, with every controller enabled
+SETTINGS = {
+    'CHARGE_THRESHOLD_EUR': 20,
+    'BATTERY_UPPER_LEVEL': 80,
+    'CHARGE_HOURS': 4,
+    'LOCAL_EXTREME_HOURS_WINDOW': 3,
+    'BATTERY_CAPACITY_KWH': 10.,
+    'BATTERY_CHARGE_POWER_KW': 5.,
+    'BATTERY_MODE': 'buy_sell',
+    'SELL_THRESHOLD_EUR': 150,
+    'BATTERY_RESERVE_LEVEL': 30,
+    'BOJLER_CONSUMPTION': 2000,
+    'BOJLER_PRIORITY': 1,
+    'MIN_CURRENT_A': 6,
+    'MAX_CURRENT_A': 16,
+    'CAR_PRIORITY': 2,
+}
+
+TelemetryRow = collections.namedtuple('TelemetryRow', ('timestamp', 'ppv', 'house_consumption', 'battery_soc',
+                                                       'active_power'))
+
+
+def load_telemetry(name=TELEMETRY):
+    """
+    :param name: CSV file in the fixtures directory with the columns of TelemetryRow, timestamps in ISO format
+    :return: list of TelemetryRow
+    """
+    with open(FIXTURES / name, newline='') as f:
+        return [TelemetryRow(datetime.datetime.fromisoformat(row['timestamp']).timestamp(), float(row['ppv']),
+                             float(row['house_consumption']), float(row['battery_soc']), float(row['active_power']))
+                for row in csv.DictReader(f)]
+
+
+def replay(rows):
+    """
+    Endless replay of the telemetry, shifted by a day on every pass so the time keeps going forward.
+    """
+    for shift in itertools.count():
+        for row in rows:
+            yield row._replace(timestamp=row.timestamp + shift * 86400)
+
+
+def ote_page(resolution):
+    """
+    Serve the saved OTE page instead of downloading it.
+
+    :param resolution: Length of a price slot in minutes, 15 or 60
+    """
+    response = SimpleNamespace(text=(FIXTURES / OTE_PAGES[resolution]).read_text(encoding='utf-8'),
+                               raise_for_status=lambda: None)
+    return mock.patch('components.ote.requests.get', lambda url, timeout: response)
+
+
+def fixture_prices(resolution=15):
+    with ote_page(resolution):
+        return ote.get_prices(PRICE_DAY)
+
+
+def battery_steps(prices, rows):
+    """
+    Moments of the price day with the battery levels of the telemetry at the same time of the day.
+    """
+    start = ote.day_start(prices.day)
+    first = rows[0].timestamp
+    for row in rows:
+        moment = start + datetime.timedelta(seconds=row.timestamp - first)
+        if moment.strftime('%Y-%m-%d') == prices.day:
+            yield moment, row.battery_soc
+
+
+@benchmark('ote.get_prices[15min]')
+def get_prices_15min():
+    with ote_page(15):
+        yield lambda: ote.get_prices(PRICE_DAY)
+
+
+@benchmark('ote.get_prices[60min]')
+def get_prices_60min():
+    with ote_page(60):
+        yield lambda: ote.get_prices(PRICE_DAY)
+
+
+@benchmark('ote.parse_prices')
+def parse_prices():
+    page = (FIXTURES / OTE_PAGES[15]).read_text(encoding='utf-8')
+    yield lambda: ote.parse_prices(page)
+
+
+@benchmark('ote.backfill_prices[31 days]')
+def backfill_prices():
+    days = [(datetime.date(2024, 1, 1) + datetime.timedelta(days=i)).isoformat() for i in range(31)]
+    with tempfile.TemporaryDirectory() as directory, serve() as base_url:
+        with mock.patch.object(ote, '_price_store', ote.PriceStore(Path(directory) / 'prices.sqlite3')):
+            yield lambda: ote.backfill_prices(days, base_url=base_url, force=True)
+
+
+@benchmark('ote.analyse_prices')
+def analyse_prices():
+    prices = fixture_prices()
+    yield lambda: ote.analyse_prices(prices)
+
+
+@benchmark('ote.get_current_prices')
+def get_current_prices():
+    with tempfile.TemporaryDirectory() as directory:
+        store = ote.PriceStore(Path(directory) / 'prices.sqlite3')
+        store.put(fixture_prices())
+        with mock.patch.object(ote, '_price_store', store):
+            yield lambda: ote.get_current_prices(PRICE_DAY)
+
+
+@benchmark('battery.plan')
+def battery_plan():
+    prices = fixture_prices()
+    now = ote.day_start(PRICE_DAY)
+    yield lambda: plan_battery_charging([prices], now, 35, SETTINGS['BATTERY_UPPER_LEVEL'],
+                                        SETTINGS['BATTERY_CAPACITY_KWH'], SETTINGS['BATTERY_CHARGE_POWER_KW'])
+
+
+def battery_decide(strategy):
+    controller = BatteryController.from_settings(SETTINGS, strategy)
+    controller.update_prices(fixture_prices())
+    steps = itertools.cycle(list(battery_steps(controller.prices, load_telemetry())))
+
+    def step():
+        now, battery_level = next(steps)
+        return controller.decide(now, battery_level)
+    return step
+
+
+@benchmark('battery.decide[plan]')
+def battery_decide_plan():
+    yield battery_decide('plan')
+
+
+@benchmark('battery.decide[heuristic]')
+def battery_decide_heuristic():
+    yield battery_decide('heuristic')
+
+
+def dispatch(load):
+    dispatcher = SurplusDispatcher()
+    dispatcher.register(load)
+    rows = replay(load_telemetry())
+
+    def step():
+        row = next(rows)
+        return dispatcher.dispatch(row.timestamp, row.ppv, row.house_consumption, row.battery_soc, -row.active_power)
+    return step
+
+
+@benchmark('boiler.dispatch')
+def boiler_dispatch():
+    yield dispatch(boiler_load(SETTINGS['BOJLER_CONSUMPTION'], SETTINGS['BOJLER_PRIORITY']))
+
+
+@benchmark('car.dispatch')
+def car_dispatch():
+    yield dispatch(SurplusTracker(SETTINGS['MIN_CURRENT_A'], SETTINGS['MAX_CURRENT_A'], SETTINGS['CAR_PRIORITY']))
+
+
+class FakeInverter:
+    """
+    goodwe.Inverter answering from the recorded telemetry without any network I/O, so only the overhead of the
+    InverterClient is measured.
+    """
+
+    def __init__(self, rows):
+        self.rows = itertools.cycle(rows)
+        self.operation_mode = OperationMode.GENERAL
+
+    async def read_runtime_data(self):
+        row = next(self.rows)
+        return {'ppv': row.ppv, 'house_consumption': row.house_consumption, 'battery_soc': row.battery_soc,
+                'active_power': row.active_power}
+
+    async def get_operation_mode(self):
+        return self.operation_mode
+
+    async def set_operation_mode(self, operation_mode, eco_mode_power=100, eco_mode_soc=100):
+        self.operation_mode = operation_mode
+
+
+@contextlib.contextmanager
+def fake_client():
+    """
+    InverterClient connected to a FakeInverter, separate from the shared clients.
+    """
+    inverter = FakeInverter(load_telemetry())
+
+    async def connect(host):
+        return inverter
+
+    with mock.patch('goodwe.connect', connect):
+        client = InverterClient('fake-inverter')
+        try:
+            yield client
+        finally:
+            client.close()
+
+
+@benchmark('inverter.call')
+def inverter_call():
+    with fake_client() as client:
+        yield lambda: client.call(lambda inverter: inverter.read_runtime_data())
+
+
+@benchmark('inverter.request')
+def inverter_request():
+    loop = asyncio.new_event_loop()  # Stands for the event loop of a task, e.g. the task supervisor
+    try:
+        with fake_client() as client:
+            yield lambda: loop.run_until_complete(client.read_runtime_data())
+    finally:
+        loop.close()
+
+
+@benchmark('inverter.mode_write')
+def inverter_mode_write():
+    loop = asyncio.new_event_loop()
+    modes = itertools.cycle((OperationMode.ECO_CHARGE, OperationMode.GENERAL))
+    try:
+        with fake_client() as client:
+            writer = ModeWriter(client, min_dwell_seconds=0)
+            yield lambda: loop.run_until_complete(writer.submit('benchmark', next(modes)))
+    finally:
+        loop.close()
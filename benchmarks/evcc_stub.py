@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import argparse
+import contextlib
+import http.server
+import json
+import threading
+from urllib.parse import urlsplit
+
+
+class EvccState:
+    """
+    Loadpoints of the stub with the requests it received.
+    """
+
+    def __init__(self, loadpoints=1):
+        self.lock = threading.Lock()
+        self.loadpoints = [{'mode': 'off', 'maxCurrent': 16, 'chargePower': 0} for _ in range(loadpoints)]
+        self.requests = []  # (method, path) of every API request
+        self.fail = False  # Answer every request with 500, e.g. to test the error handling
+
+    def posts(self):
+        with self.lock:
+            return [path for method, path in self.requests if method == 'POST']
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers the part of the evcc REST API used by EvccClient with keep-alive connections, like evcc:
+    GET /api/state, POST /api/loadpoints/<n>/mode/<mode> and POST /api/loadpoints/<n>/maxcurrent/<amps>.
+    """
+    protocol_version = 'HTTP/1.1'
+    state = None  # EvccState, set by serve
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        with self.state.lock:
+            self.state.requests.append(('GET', path))
+            if self.state.fail or path != '/api/state':
+                self.answer(500 if self.state.fail else 404)
+                return
+            self.answer(200, {'result': {'loadpoints': [dict(loadpoint) for loadpoint in self.state.loadpoints]}})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        parts = path.strip('/').split('/')
+        with self.state.lock:
+            self.state.requests.append(('POST', path))
+            if self.state.fail:
+                self.answer(500)
+                return
+            try:
+                api, loadpoints, number, key, value = parts
+                assert (api, loadpoints) == ('api', 'loadpoints') and key in ('mode', 'maxcurrent')
+                loadpoint = self.state.loadpoints[int(number) - 1]
+                if key == 'mode':
+                    loadpoint['mode'] = value
+                else:
+                    loadpoint['maxCurrent'] = int(value)
+            except (AssertionError, ValueError, IndexError):
+                self.answer(404)
+                return
+            self.answer(200, {'result': value})
+
+    def answer(self, code, body=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve(port=0, loadpoints=1):
+    """
+    Run the stub server in a background thread.
+
+    :param port: TCP port, 0 picks a free one
+    :param loadpoints: Number of loadpoints
+    :return: tuple (base URL for EvccClient, EvccState of the server)
+    """
+    state = EvccState(loadpoints)
+    handler = type('Handler', (StubHandler,), {'state': state})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name='evcc-stub')
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}', state
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.evcc_stub',
+                                     description='Local stand-in of the evcc API, e.g. for the EVCC_URL setting.')
+    parser.add_argument('--port', type=int, default=7070)
+    args = parser.parse_args()
+    with serve(args.port) as (base_url, state):
+        print(f'Serving the evcc API at {base_url}, stop with Ctrl+C.')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import argparse
+import contextlib
+import http.server
+import threading
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+STUB_PAGE = 'ote_2024-10-20_15min.html'  # Served for every day
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the saved OTE report page for any `?date=` with keep-alive connections, like the OTE server.
+    """
+    protocol_version = 'HTTP/1.1'
+    page = (FIXTURES / STUB_PAGE).read_bytes()
+
+    def do_GET(self):
+        if not parse_qs(urlsplit(self.path).query).get('date'):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.page)))
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve(port=0):
+    """
+    Run the stub server in a background thread.
+
+    :param port: TCP port, 0 picks a free one
+    :return: Base URL for ote.get_prices and ote.backfill_prices, the date is appended to it
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True, name='ote-stub')
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}/?date='
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.ote_stub',
+                                     description='Local stand-in of the OTE report page, e.g. for '
+                                                 '`manage.py backfill_prices --base-url`.')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    with serve(args.port) as base_url:
+        print(f'Serving {STUB_PAGE} at {base_url}YYYY-MM-DD, stop with Ctrl+C.')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
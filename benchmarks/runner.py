@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import collections
+import contextlib
+import datetime
+import fnmatch
+import gc
+import json
+import logging
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+DEFAULT_REPEAT = 5  # Number of timed rounds of every benchmark, the median is reported
+DEFAULT_TOLERANCE = 0.25  # Relative slowdown or memory growth against the baseline reported as a regression
+MEMORY_SLACK_KIB = 1.  # Absolute memory growth (KiB) always tolerated, small peaks are noisy
+
+# Latency (microseconds per operation) and memory of one benchmark
+Result = collections.namedtuple('Result', ('name', 'number', 'median_us', 'min_us', 'peak_kib', 'blocks'))
+
+_benchmarks = {}  # Context manager factories keyed by the benchmark name, in the order of registration
+
+
+def benchmark(name):
+    """
+    Register a benchmark. The decorated function is a generator - it prepares the fixtures, yields the operation
+    (a callable without arguments) to measure and cleans up after the measurement.
+
+    :param name: Name of the benchmark, e.g. 'ote.get_prices[15min]'
+    """
+    def register(function):
+        _benchmarks[name] = contextlib.contextmanager(function)
+        return function
+    return register
+
+
+def measure(name, operation, repeat=DEFAULT_REPEAT):
+    """
+    Measure the latency and the memory of the operation.
+
+    The number of calls per round is calibrated by timeit to take at least 0.2 seconds. The memory is measured
+    separately, as tracemalloc slows down the allocations: the peak of the memory allocated during a single call
+    and the number of memory blocks left allocated per call, which shows caches and leaks.
+
+    :param name: Name of the benchmark
+    :param operation: Callable without arguments
+    :param repeat: Number of timed rounds
+    :return: Result
+    """
+    timer = timeit.Timer(operation)
+    number, _ = timer.autorange()
+    times = [elapsed / number * 1e6 for elapsed in timer.repeat(repeat, number)]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    for _ in range(number):
+        operation()
+    gc.collect()
+    blocks = (sys.getallocatedblocks() - blocks) / number
+    return Result(name, number, statistics.median(times), min(times), peak / 1024, blocks)
+
+
+def run(pattern='*', repeat=DEFAULT_REPEAT):
+    """
+    Run the registered benchmarks with the logging of the controllers silenced.
+
+    :param pattern: Shell-style pattern selecting the benchmarks by name
+    :param repeat: Number of timed rounds of every benchmark
+    :return: list of Result
+    """
+    results = []
+    level = logging.root.manager.disable
+    logging.disable(logging.INFO)
+    try:
+        for name, factory in _benchmarks.items():
+            if not fnmatch.fnmatchcase(name, pattern):
+                continue
+            with factory() as operation:
+                operation()  # Warm up caches and lazy imports
+                results.append(measure(name, operation, repeat))
+    finally:
+        logging.disable(level)
+    return results
+
+
+def environment():
+    """
+    :return: dict describing the machine the results were measured on
+    """
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'node': platform.node()}
+
+
+def load_baseline(path):
+    """
+    :param path: Path to the JSON file written by `save_baseline`
+    :return: dict with the environment and the results keyed by name, None if the file does not exist
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results, previous=None):
+    """
+    Store the results as the new baseline. Results of benchmarks which did not run are kept from `previous`.
+
+    :param path: Path to the JSON file
+    :param results: list of Result
+    :param previous: Baseline loaded by `load_baseline`, or None
+    """
+    stored = dict(previous['results']) if previous is not None else {}
+    stored.update({result.name: result._asdict() for result in results})
+    with open(path, 'w') as f:
+        json.dump({**environment(), 'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'results': stored}, f, indent=2, sort_keys=True)
+
+
+def compare(result, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare the result with its baseline.
+
+    :param result: Result
+    :param baseline: Baseline loaded by `load_baseline`, or None
+    :param tolerance: Relative growth of the latency or the memory peak reported as a regression
+    :return: tuple (relative change of the median latency or None, list of regressions)
+    """
+    reference = baseline['results'].get(result.name) if baseline is not None else None
+    if reference is None:
+        return None, []
+    regressions = []
+    if result.median_us > reference['median_us'] * (1 + tolerance):
+        regressions.append('latency')
+    if result.peak_kib > reference['peak_kib'] * (1 + tolerance) + MEMORY_SLACK_KIB:
+        regressions.append('memory')
+    return result.median_us / reference['median_us'] - 1, regressions
+
+
+def report(results, baseline=None, tolerance=DEFAULT_TOLERANCE, out=sys.stdout):
+    """
+    Print a table of the results with the changes against the baseline.
+
+    :return: Names of the benchmarks which regressed
+    """
+    regressed = []
+    if baseline is not None and {key: baseline.get(key) for key in environment()} != environment():
+        print(f"Baseline was measured with Python {baseline.get('python')} on {baseline.get('node')} "
+              f"({baseline.get('machine')}), the comparison may not be meaningful.", file=out)
+    width = max([len(result.name) for result in results] + [9])
+    print(f"{'benchmark':<{width}}  {'median us':>12}  {'min us':>12}  {'peak KiB':>9}  {'blocks':>7}  "
+          f"{'vs baseline':>11}", file=out)
+    for result in results:
+        change, regressions = compare(result, baseline, tolerance)
+        change = f'{change:+.1%}' if change is not None else '-'
+        print(f'{result.name:<{width}}  {result.median_us:>12.2f}  {result.min_us:>12.2f}  '
+              f'{result.peak_kib:>9.1f}  {result.blocks:>7.1f}  {change:>11}'
+              f"{'  REGRESSION (' + ', '.join(regressions) + ')' if regressions else ''}", file=out)
+        if regressions:
+            regressed.append(result.name)
+    return regressed
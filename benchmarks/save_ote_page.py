@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import argparse
+from pathlib import Path
+from types import SimpleNamespace
+
+import requests
+
+from components import ote
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+
+def save_page(day, session, base_url=ote.OTE_CR_PAGE):
+    """
+    Download the OTE report page of the day and save it as a fixture, once it parses.
+
+    :param day: Date string in format YYYY-MM-DD
+    :param session: requests.Session
+    :param base_url: URL of the report page without the date
+    :return: Path of the saved page
+    """
+    response = session.get(f'{base_url}{day}', timeout=ote.OTE_TIMEOUT)
+    response.raise_for_status()
+    page = SimpleNamespace(get=lambda url, timeout: response)  # Parse the downloaded page without a second request
+    series = ote.get_prices(day, [1] * 24, page, base_url)
+    path = FIXTURES / f'ote_{day}_{series.resolution}min.html'
+    path.write_text(response.text, encoding='utf-8')
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.save_ote_page',
+                                     description='Save OTE day-ahead report pages as fixtures of the benchmarks and '
+                                                 'tests, e.g. of the DST days 2024-03-31 and 2024-10-27.')
+    parser.add_argument('days', nargs='+', help='Days in format YYYY-MM-DD')
+    parser.add_argument('--base-url', default=ote.OTE_CR_PAGE, help='URL of the report page without the date')
+    args = parser.parse_args()
+    with requests.Session() as session:
+        for day in args.days:
+            print(f'{day}: saved {save_page(day, session, args.base_url)}')
+
+
+if __name__ == '__main__':
+    main()
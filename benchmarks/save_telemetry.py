@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import argparse
+import csv
+import datetime
+
+from components.ote import OTE_TIMEZONE
+from components.timeseries import TIMESERIES_PATH, TimeSeriesStore
+
+from .save_ote_page import FIXTURES
+
+TELEMETRY_FIELDS = ('ppv', 'house_consumption', 'battery_soc', 'active_power')  # Values of cases.TelemetryRow
+
+
+def save_telemetry(day, store):
+    """
+    Export the 1 minute telemetry of the local day from the time-series store as a fixture of the benchmarks and
+    the simulation. Minutes with a missing value are left out.
+
+    :param day: Date string in format YYYY-MM-DD
+    :param store: timeseries.TimeSeriesStore with the recorded history, the 1 minute rollups are kept for 30 days
+    :return: tuple (Path of the saved file, number of rows)
+    """
+    start = datetime.datetime.combine(datetime.date.fromisoformat(day), datetime.time(), OTE_TIMEZONE)
+    end = datetime.datetime.combine(start.date() + datetime.timedelta(days=1), datetime.time(), OTE_TIMEZONE)
+    rows = [row for row in store.query(start.timestamp(), end.timestamp(), 60)
+            if all(row[field] is not None for field in TELEMETRY_FIELDS)]
+    assert rows, f'No 1 minute telemetry of {day} in {store.path}'
+    path = FIXTURES / f'telemetry_{day}.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('timestamp',) + TELEMETRY_FIELDS)
+        for row in rows:
+            writer.writerow([datetime.datetime.fromtimestamp(row['ts'], OTE_TIMEZONE).isoformat()] +
+                            [f'{row[field]:g}' for field in TELEMETRY_FIELDS])
+    return path, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.save_telemetry',
+                                     description='Save days of the recorded inverter telemetry as fixtures of the '
+                                                 'benchmarks and the simulation.')
+    parser.add_argument('days', nargs='+', help='Days in format YYYY-MM-DD')
+    parser.add_argument('--path', default=TIMESERIES_PATH, help='SQLite database of the time-series store')
+    args = parser.parse_args()
+    store = TimeSeriesStore(args.path)
+    for day in args.days:
+        path, count = save_telemetry(day, store)
+        print(f'{day}: saved {count} minutes to {path}')
+
+
+if __name__ == '__main__':
+    main()
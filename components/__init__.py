@@ -4,3 +4,21 @@
 # Copyright (C) 2022
 # Author: Jan Profant <jan.profant@rev.com>
 # All Rights Reserved
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def setting_path(name, default):
+    """
+    Path from the Django settings, e.g. the location of a database the components write to.
+
+    :param name: Name of the setting
+    :param default: Path used when the setting is missing or Django is not configured (simulation, benchmarks)
+    :return: Path
+    """
+    try:
+        return Path(getattr(settings, name, default))
+    except ImproperlyConfigured:
+        return default
@@ -7,14 +7,22 @@
 
 import asyncio  # Library for running asynchronous operations
 import datetime  # Module to handle date and time
-import random  # Module to generate random numbers
-import time  # Module for time-related functions
 import logging  # Module for logging
+import time  # Module to measure the duration of the loop
 
 from goodwe import OperationMode  # Import OperationMode enum from goodwe library
 from energy_flow.task_control import sleep_routine
-from .goodwe_utils import set_operation_mode, get_battery_level  # Custom utilities to interact with GoodWe inverters
-from .ote import get_current_prices  # Custom utility to get current energy prices
+from .goodwe_utils import get_mode_writer  # Custom utilities to interact with GoodWe inverters
+from .telemetry import get_sampler  # Shared inverter telemetry
+from .timeseries import get_timeseries_store  # History of telemetry, device states and prices
+from .status import get_status  # Latest state for the dashboard
+from .metrics import observe_loop  # Loop duration metrics
+from .scheduler import AdaptiveScheduler  # Tick rate following the battery level and the price slots
+from .ote import (get_current_prices, get_price_store, prefetch_tomorrow, PricesUnavailableError,
+                  OTE_TIMEZONE)  # Custom utilities for prices
+from .planner import plan_charge_schedule, price_horizon  # Cost-optimal charge schedule
+from .forecast import get_forecaster  # PV and house load forecast from the history
+from .price_table import PriceDecisionTable  # Daily per-slot price analysis
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
@@ -32,75 +40,310 @@ CHARGE_HOURS = {
 
 OTE_ATTEMPTS = 10  # Number of attempts to retrieve OTE data
 LOG_INTERVAL = 3  # Interval for logging the status of the battery
-MODE = 'buy'  # Operation mode - 'buy' or 'sell'
+STRATEGY = 'plan'  # Charging strategy - 'plan' (cost-optimal schedule) or 'heuristic' (CHARGE_HOURS rules)
+MIN_TICK_SECONDS = 60  # Fastest tick of the battery loop, while the battery level changes
+MAX_TICK_SECONDS = 600  # Slowest tick of the battery loop, the loop also wakes up on every price slot boundary
+STABLE_LEVEL_CHANGE = 0  # Change of the battery level (%) per tick considered stable
+BUSY_LEVEL_CHANGE = 2  # Change of the battery level (%) per tick switching to the fastest tick
+
+# BatteryController parameters and the GeneralSettings fields they are configured from
+CONTROLLER_SETTINGS = {
+    'charge_threshold_eur': 'CHARGE_THRESHOLD_EUR',
+    'battery_upper_level': 'BATTERY_UPPER_LEVEL',
+    'max_charge_hours_key': 'CHARGE_HOURS',
+    'local_extreme_hours_window': 'LOCAL_EXTREME_HOURS_WINDOW',
+    'battery_capacity_kwh': 'BATTERY_CAPACITY_KWH',
+    'battery_charge_power_kw': 'BATTERY_CHARGE_POWER_KW',
+    'battery_mode': 'BATTERY_MODE',
+    'sell_threshold_eur': 'SELL_THRESHOLD_EUR',
+    'battery_reserve_level': 'BATTERY_RESERVE_LEVEL',
+}
 
 
-def battery_charging_task(stop_event,
-                          inverter_ip_address,
-                          charge_threshold_eur,
-                          battery_upper_level,
-                          max_charge_hours_key,
-                          gradient_threshold,
-                          local_extreme_hours_window):
+class BatteryController:
     """
-    This function manages the battery charging process based on the current battery level,
-    energy prices, and other parameters. It runs in a loop until the `stop_event` is set.
-
-    :param stop_event: threading.Event object used to signal stopping of the task
-    :param inverter_ip_address: IP address of the inverter
-    :param charge_threshold_eur: Price threshold below which charging should occur
-    :param battery_upper_level: Maximum battery level for charging to continue
-    :param max_charge_hours_key: Key from CHARGE_HOURS dict determining max charging hours
-    :param gradient_threshold: Threshold for price gradient to decide charging
-    :param local_extreme_hours_window: Time window to consider for local price minima
+    Decision logic of the battery task, separated from the I/O so it can be replayed by the simulation.
+    """
+
+    def __init__(self,
+                 charge_threshold_eur,
+                 battery_upper_level,
+                 max_charge_hours_key,
+                 local_extreme_hours_window,
+                 battery_capacity_kwh,
+                 battery_charge_power_kw,
+                 battery_mode,
+                 sell_threshold_eur,
+                 battery_reserve_level,
+                 strategy=STRATEGY):
+        """
+        See `battery_charging_task` for the description of the parameters.
+        """
+        self.charge_threshold_eur = charge_threshold_eur
+        self.battery_upper_level = battery_upper_level
+        self.max_charge_hours_key = max_charge_hours_key
+        self.local_extreme_hours_window = local_extreme_hours_window
+        self.battery_capacity_kwh = battery_capacity_kwh
+        self.battery_charge_power_kw = battery_charge_power_kw
+        self.battery_mode = battery_mode
+        self.sell_threshold_eur = sell_threshold_eur
+        self.battery_reserve_level = battery_reserve_level
+        self.strategy = strategy
+
+        self.prices, self.table = None, None  # Today's prices and their decision table
+        self.plan, self.plan_days = None, None  # Charge plan and the days of prices it was computed from
+        self.finished_sell_windows = set()  # (day, window) pairs in which the discharge already stopped
+        self.forecaster = None  # forecast.ProfileForecaster for the expected PV and house load, None ignores them
+
+    @classmethod
+    def from_settings(cls, settings, strategy=STRATEGY):
+        """
+        :param settings: Mapping with GeneralSettings field names and values
+        """
+        return cls(**{parameter: settings[field] for parameter, field in CONTROLLER_SETTINGS.items()},
+                   strategy=strategy)
+
+    def configure(self, settings):
+        """
+        Apply new settings, keeping the prices of the day. The decision table and the plan are recomputed.
+
+        :param settings: Mapping with GeneralSettings field names and values
+        """
+        changed = False
+        for parameter, field in CONTROLLER_SETTINGS.items():
+            if getattr(self, parameter) != settings[field]:
+                setattr(self, parameter, settings[field])
+                changed = True
+        if changed:
+            self.plan, self.plan_days = None, None
+            if self.prices is not None:
+                self.update_prices(self.prices)
+
+    def update_prices(self, prices):
+        """
+        Build the decision table for the prices of a new day.
+
+        :param prices: ote.PriceSeries of the day
+        """
+        self.prices = prices
+        self.table = PriceDecisionTable(prices, self.charge_threshold_eur, self.max_charge_hours_key,
+                                        self.local_extreme_hours_window, CHARGE_HOURS, prices.slots_per_hour,
+                                        self.sell_threshold_eur)  # Decisions for the whole day
+        logging.info(f'Discharge windows for {prices.day}: {self.table.sell_windows}')
+
+    def decide(self, now, battery_level, tomorrow=None):
+        """
+        Decide the operation mode of the inverter for the current moment.
+
+        :param now: Timezone aware current datetime within the day of `self.prices`
+        :param battery_level: Current battery level (%)
+        :param tomorrow: ote.PriceSeries of the next day if already published
+        :return: tuple (goodwe.OperationMode, eco mode SoC limit)
+        """
+        price_idx = self.prices.index_at(now)  # Get the current slot index for pricing
+
+        charge = False
+        if 'buy' in self.battery_mode and battery_level < self.battery_upper_level:
+            if self.strategy == 'plan':
+                # Prices known so far - today and tomorrow once published
+                series = [self.prices] + ([tomorrow] if tomorrow is not None else [])
+                days = [day.day for day in series]
+                # Follow the plan, recompute it only for new prices or when the battery drifted away from it
+                if (self.plan is None or self.plan_days != days or self.plan.index_at(now) is None or
+                        self.plan.drifted(now, battery_level)):
+                    self.plan = plan_battery_charging(series, now, battery_level, self.battery_upper_level,
+                                                      self.battery_capacity_kwh, self.battery_charge_power_kw,
+                                                      self.forecaster)
+                    self.plan_days = days
+                charge = bool(self.plan.charge[self.plan.index_at(now)] or self.table.below_threshold[price_idx])
+            else:
+                # Decide to charge based on current price, local minima and charge hours policy
+                charge = self.table.should_charge(price_idx, battery_level)
+
+        # Discharge once per window until the reserve is reached, the window is not entered again afterwards.
+        # The eco mode SoC does not stop the discharge on all inverters, see `battery_reserve_guard`.
+        sell_window = self.table.sell_window_at(price_idx) if 'sell' in self.battery_mode else None
+        if sell_window is not None and (self.prices.day, sell_window) not in self.finished_sell_windows:
+            if battery_level > self.battery_reserve_level:
+                return OperationMode.ECO_DISCHARGE, self.battery_reserve_level
+            self.finished_sell_windows.add((self.prices.day, sell_window))
+            logging.info(f'Battery level: {battery_level}%, reserve reached, selling will stop now.')
+
+        if charge:
+            return OperationMode.ECO_CHARGE, 100
+        return OperationMode.GENERAL, 100
+
+    def stop_selling(self, now):
+        """
+        Finish the discharge window of the moment, e.g. when the reserve was reached between two decisions.
+
+        :param now: Timezone aware current datetime
+        """
+        if self.table is None:
+            return
+        try:
+            sell_window = self.table.sell_window_at(self.prices.index_at(now))
+        except IndexError:  # The prices of the day are not loaded yet
+            return
+        if sell_window is not None:
+            self.finished_sell_windows.add((self.prices.day, sell_window))
+
+
+async def battery_charging_task(config):
+    """
+    This coroutine manages the battery charging process based on the current battery level,
+    energy prices, and other parameters. It runs in a loop until it is cancelled by the TaskSupervisor,
+    then it switches the inverter back to the general mode.
+
+    The settings are read from the live configuration on every iteration, changes are applied without
+    restarting the task. Used GeneralSettings fields:
+
+    - INVERTER_IP_ADDRESS: IP address of the inverter, read only at the start
+    - CHARGE_THRESHOLD_EUR: Price threshold below which charging should occur
+    - BATTERY_UPPER_LEVEL: Maximum battery level for charging to continue
+    - CHARGE_HOURS: Key from CHARGE_HOURS dict determining max charging hours
+    - LOCAL_EXTREME_HOURS_WINDOW: Time window to consider for local price minima
+    - BATTERY_CAPACITY_KWH: Usable battery capacity (kWh), used by the charge planner
+    - BATTERY_CHARGE_POWER_KW: Grid charging power of the inverter (kW), used by the charge planner
+    - BATTERY_MODE: 'buy' charges from the grid when cheap, 'sell' discharges to the grid on price peaks,
+      'buy_sell' does both
+    - SELL_THRESHOLD_EUR: Minimum price of a peak at which the battery is discharged to the grid
+    - BATTERY_RESERVE_LEVEL: Battery level (%) the battery is never discharged to the grid below
+
+    :param config: energy_flow.live_config.LiveConfig
     """
 
     logging.info("Battery subroutine in progress...")
 
-    # Initialize variables for daily operations
-    last_day, prices, local_minima, gradients = None, None, None, None
+    settings = config.snapshot()
+    inverter_ip_address = settings['INVERTER_IP_ADDRESS']
+    controller = BatteryController.from_settings(settings)
+    controller.forecaster = get_forecaster()
+    last_day = None
+    battery_level = None
     i = 0  # Counter for logging intervals
+    sampler = get_sampler(inverter_ip_address)  # Telemetry shared with the other tasks
+    sampler.subscribe()
+    mode_writer = get_mode_writer(inverter_ip_address)  # Skips writes of the mode the inverter already has
+    guard = asyncio.create_task(battery_reserve_guard(sampler, mode_writer, controller))
+    scheduler = AdaptiveScheduler('battery', MIN_TICK_SECONDS, MAX_TICK_SECONDS, STABLE_LEVEL_CHANGE,
+                                  BUSY_LEVEL_CHANGE)
+    timeseries = get_timeseries_store()
+    status = get_status()
 
-    while not stop_event.is_set():  # Main loop that runs until stop_event is set
-        today = datetime.date.today().strftime('%Y-%m-%d')  # Get today's date
-        if last_day != today:  # Check if prices need to be updated
-            prices, local_minima, local_maxima, gradients = get_current_prices(
-                today)  # Fetch today's prices and analysis
-            last_day = today  # Update the last processed day
-
-        battery_level = asyncio.run(get_battery_level(inverter_ip_address))  # Get current battery level asynchronously
-        price_idx = datetime.datetime.now().hour  # Get the current hour index for pricing
-        price_now = prices[price_idx]  # Get the current energy price
-        sorted_price_idx = sorted(prices).index(price_now)  # Determine the sorted index of the current price
-
-        if 'buy' in MODE:  # If the mode is set to 'buy'
-            if battery_level < battery_upper_level:  # Only charge if battery level is below the upper limit
-                # Check for local minima in prices and if it makes sense to charge
-                is_local_minima = price_idx in local_minima and price_now < min(
-                    prices[price_idx + 1:price_idx + local_extreme_hours_window + 1])
-
-                # Decide to charge based on current price, local minima, gradient, and charge hours policy
-                if ((price_now < charge_threshold_eur) or is_local_minima or
-                        (sorted_price_idx < max_charge_hours_key and battery_level > CHARGE_HOURS[sorted_price_idx])):
-                    asyncio.run(set_operation_mode(inverter_ip_address,
-                                                   OperationMode.ECO_CHARGE))  # Set inverter to charge mode
-                    if i % LOG_INTERVAL == 0:  # Log status every LOG_INTERVAL iterations
-                        logging.info(f'Battery level: {battery_level}%, current price {price_now}, will charge now.')
-                else:
-                    asyncio.run(
-                        set_operation_mode(inverter_ip_address, OperationMode.GENERAL))  # Set inverter to general mode
-                    if i % LOG_INTERVAL == 0:  # Log status every LOG_INTERVAL iterations
-                        logging.info(f'Battery level: {battery_level}%, current price {price_now}, will not charge.')
-            else:
-                asyncio.run(set_operation_mode(inverter_ip_address,
-                                               OperationMode.GENERAL))  # Stop charging if battery is above upper level
-        elif 'sell' in MODE:  # Placeholder for 'sell' mode
-            raise NotImplementedError  # Not yet implemented
-
-        i += 1  # Increment counter for logging
-
-        if not sleep_routine(stop_event):
-            asyncio.run(
-                set_operation_mode(inverter_ip_address, OperationMode.GENERAL))  # Set inverter to default mode
-            logging.info(f'Battery level: {battery_level}%, charging will stop now.')
-            return  # Exit function
\ No newline at end of file
+    try:
+        while True:  # Main loop that runs until the task is cancelled
+            started = time.perf_counter()
+            if config.snapshot().version != settings.version:  # Apply changed settings, the prices are kept
+                settings = config.snapshot()
+                controller.configure(settings)
+                scheduler.reset()
+
+            now = datetime.datetime.now(OTE_TIMEZONE)  # Current time in the timezone of the OTE trading day
+            today = now.strftime('%Y-%m-%d')  # Get today's date
+            if last_day != today:  # Check if prices need to be updated
+                try:
+                    prices, local_minima, local_maxima, gradients = await asyncio.to_thread(
+                        get_current_prices, today)  # Fetch today's prices and analysis
+                except PricesUnavailableError as e:  # No decisions without prices, the download is retried later
+                    logging.info(f'{e} The battery stays in the general mode.')
+                    await mode_writer.submit('battery', OperationMode.GENERAL)
+                    await sleep_routine(MIN_TICK_SECONDS)
+                    continue
+                controller.update_prices(prices)
+                await asyncio.to_thread(timeseries.put_prices, prices)  # Keep the prices with the telemetry history
+                if await asyncio.to_thread(controller.forecaster.refresh):  # Refit the forecast once per day
+                    controller.plan = None
+                last_day = today  # Update the last processed day
+
+            snapshot = await sampler.next_snapshot()  # Get current battery level from the shared telemetry
+            battery_level = snapshot.battery_soc
+            if snapshot.is_stale():  # An outdated level is as good as none, e.g. when the inverter stopped answering
+                logging.info(f'Latest telemetry is {time.time() - snapshot.timestamp:.0f} seconds old.')
+                battery_level = None
+            if battery_level is None:  # The sensor could not be read, keep the current mode until the next tick
+                logging.info('Battery level is not available, skipping this iteration.')
+                await sleep_routine(scheduler.update(None))
+                continue
+            price_now = controller.prices[controller.prices.index_at(now)]  # Get the current energy price
+            tomorrow = await asyncio.to_thread(
+                get_price_store().get, (now + datetime.timedelta(days=1)).strftime('%Y-%m-%d'))
+
+            operation_mode, eco_mode_soc = controller.decide(now, battery_level, tomorrow)
+            # The mode may be postponed by the minimum dwell time or overridden by a controller of higher priority
+            operation_mode = await mode_writer.submit('battery', operation_mode, eco_mode_soc=eco_mode_soc)
+            timeseries.record_state(operation_mode=int(operation_mode))
+            status.update('battery', operation_mode=operation_mode.name, eco_mode_soc=eco_mode_soc,
+                          battery_level=battery_level, price=float(price_now),
+                          prices=[{'start': controller.prices.slot_start(slot).timestamp(),
+                                   'price': float(controller.prices[slot])} for slot in range(len(controller.prices))],
+                          plan=controller.plan.as_rows() if controller.plan is not None else [])
+            if i % LOG_INTERVAL == 0:  # Log status every LOG_INTERVAL iterations
+                action = {OperationMode.ECO_CHARGE: 'will charge now',
+                          OperationMode.ECO_DISCHARGE: 'will sell now'}.get(operation_mode,
+                                                                            'will neither charge nor sell')
+                logging.info(f'Battery level: {battery_level}%, current price {price_now}, {action}.')
+
+            i += 1  # Increment counter for logging
+
+            await asyncio.to_thread(prefetch_tomorrow)  # Store tomorrow's prices as soon as they are published
+            observe_loop('battery', started)
+            # Tick often while the battery level moves, always right after a price slot boundary
+            await sleep_routine(scheduler.update(battery_level))
+    except asyncio.CancelledError:
+        operation_mode = await mode_writer.release('battery')  # Set inverter to default mode
+        timeseries.record_state(operation_mode=int(operation_mode))
+        logging.info(f'Battery level: {battery_level}%, charging will stop now.')
+        raise
+    finally:
+        guard.cancel()
+        status.clear('battery')
+        sampler.unsubscribe()
+
+
+async def battery_reserve_guard(sampler, mode_writer, controller):
+    """
+    Stop selling as soon as a telemetry sample shows the battery at the reserve level.
+
+    The GoodWe ET driver does not write the eco mode SoC of ECO_DISCHARGE, so the inverter keeps discharging below
+    the reserve until it is switched back to the general mode, and the battery task ticks up to MAX_TICK_SECONDS
+    apart. The guard follows every sample of the shared telemetry instead, like the peak limiter.
+
+    :param sampler: telemetry.TelemetrySampler of the inverter, subscribed by the battery task
+    :param mode_writer: goodwe_utils.ModeWriter of the inverter
+    :param controller: BatteryController with the reserve level and the discharge windows
+    """
+    last_seq = 0  # Sequence number of the last processed telemetry snapshot
+    while True:
+        snapshot = await sampler.next_snapshot(after_seq=last_seq)
+        last_seq = snapshot.seq
+        battery_level = snapshot.battery_soc
+        if mode_writer.operation_mode != OperationMode.ECO_DISCHARGE or battery_level is None or \
+                battery_level > controller.battery_reserve_level:
+            continue
+        logging.info(f'Battery level: {battery_level}%, reserve reached, selling will stop now.')
+        controller.stop_selling(datetime.datetime.now(OTE_TIMEZONE))
+        try:
+            await mode_writer.submit('battery', OperationMode.GENERAL, force=True)
+        except Exception as e:  # Tried again with the next sample
+            logging.info(f'Stopping the discharge failed: {e!r}')
+
+
+def plan_battery_charging(series, now, battery_level, battery_upper_level, battery_capacity_kwh,
+                          battery_charge_power_kw, forecaster=None):
+    """
+    Compute the cost-optimal charge plan from the current slot until the end of the known prices.
+
+    :param series: list of ote.PriceSeries, today and optionally tomorrow
+    :param now: Timezone aware current datetime
+    :param forecaster: forecast.ProfileForecaster, the expected PV surplus then charges the battery for free and
+                       less energy is bought from the grid on sunny days
+    :return: planner.ChargePlan
+    """
+    prices, slot_hours, starts = price_horizon(series, now)
+    net_load_kwh = forecaster.net_load_kwh(starts, slot_hours) if forecaster is not None else None
+    plan = plan_charge_schedule(prices, slot_hours, battery_level, battery_capacity_kwh, battery_charge_power_kw,
+                                battery_upper_level, net_load_kwh=net_load_kwh, starts=starts)
+    logging.info(f'Planned charging for {len(plan)} slots from battery level {battery_level}%: '
+                 f'{plan.charge.astype(int).tolist()}, expected cost {plan.cost:.2f} EUR.')
+    return plan
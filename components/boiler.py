@@ -6,70 +6,139 @@
 # All Rights Reserved
 
 import asyncio  # For running asynchronous operations
-import time  # For time-related functions
 import logging  # For logging
-from random import random  # Random number generator
+import time  # For measuring the time between plug state reads
 
-from components.goodwe_utils import get_pv_running_mean, get_battery_level  # Custom utilities for GoodWe inverters
-from components.tapo_utils import turn_on_off  # Utility to control Tapo devices
-from energy_flow.task_control import sleep_routine  # Utility for handling sleep routines
+from components.dispatcher import get_dispatcher, SwitchedLoad  # Surplus allocation shared with the car
+from components.telemetry import get_sampler  # Shared inverter telemetry
+from components.tapo_utils import get_plug_power, get_plug_state, set_plug_state, TapoError  # Tapo plug control
+from components.timeseries import get_timeseries_store  # History of telemetry and device states
+from components.status import get_status  # Latest state for the dashboard
+from components.metrics import observe_loop  # Loop duration metrics
 
 # Constants for controlling boiler behavior based on battery and PV levels
 BOJLER_ENABLE_BATTERY_LEVEL = 60  # Minimum battery level to consider turning on the boiler (%)
 BATTERY_ALMOST_FULL = 85  # Battery level considered almost full (%)
+BOJLER_PRIORITY = 1  # Priority of the boiler in the surplus dispatch, served before the car by default
+BOJLER_MIN_ON_SECONDS = 600  # Minimum time the boiler stays on once switched on
+BOJLER_MIN_OFF_SECONDS = 300  # Minimum time the boiler stays off once switched off
+PLUG_STATE_INTERVAL = 300  # Seconds between reads of the real plug state
+PLUG_POWER_INTERVAL = 60  # Seconds between reads of the power drawn by the boiler
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
 
-def boiler_task(stop_event, inverter_ip_address, tapo_ip_address, consumption):
+def boiler_load(consumption, priority=BOJLER_PRIORITY):
     """
-    Task to manage the operation of a boiler based on battery level and photovoltaic (PV) power generation.
-    This task runs continuously until `stop_event` is set.
+    The boiler as a load of the surplus dispatch. It runs when the surplus covers its consumption, when the surplus
+    covers half of it and the battery is above BOJLER_ENABLE_BATTERY_LEVEL, or when the battery is almost full.
 
-    :param stop_event: threading.Event object used to signal when to stop the task
-    :param inverter_ip_address: IP address of the inverter to get PV and battery data
-    :param tapo_ip_address: IP address of the Tapo device to control the boiler
     :param consumption: Power consumption of the boiler in watts
+    :param priority: Priority of the boiler in the surplus dispatch, lower is served first
+    :return: dispatcher.SwitchedLoad
+    """
+    return SwitchedLoad('boiler', priority, consumption, BOJLER_MIN_ON_SECONDS, BOJLER_MIN_OFF_SECONDS,
+                        assist_battery_level=BOJLER_ENABLE_BATTERY_LEVEL, force_battery_level=BATTERY_ALMOST_FULL)
+
+
+async def boiler_task(config):
+    """
+    Task to manage the operation of a boiler based on battery level and photovoltaic (PV) power generation.
+    This coroutine runs continuously until it is cancelled by the TaskSupervisor, then it turns the boiler off.
+
+    The settings are read from the live configuration, changes of the consumption and priority are applied with
+    the next telemetry snapshot. Used GeneralSettings fields:
+
+    - INVERTER_IP_ADDRESS: IP address of the inverter to get PV and battery data, read only at the start
+    - BOJLER_TAPO_IP_ADDRESS: IP address of the Tapo device to control the boiler, read only at the start
+    - BOJLER_CONSUMPTION: Power consumption of the boiler in watts
+    - BOJLER_PRIORITY: Priority of the boiler in the surplus dispatch, lower is served first
+
+    :param config: energy_flow.live_config.LiveConfig
     """
 
     # Log the start of the boiler subroutine
     logging.info("Boiler subroutine in progress...")
 
+    settings = config.snapshot()
+    inverter_ip_address, tapo_ip_address = settings['INVERTER_IP_ADDRESS'], settings['BOJLER_TAPO_IP_ADDRESS']
     last_bojler_state = None  # Variable to track the last state of the boiler (on/off)
-
-    while not stop_event.is_set():  # Loop until stop_event is triggered
-
-        # Fetch the current PV power (ppv) and house consumption asynchronously
-        ppv, house_consumption = asyncio.run(get_pv_running_mean(inverter_ip_address))
-
-        # Fetch the current battery level asynchronously
-        battery_level = asyncio.run(get_battery_level(inverter_ip_address))
-
-        # Log the current battery level, PV power, and house consumption
-        logging.info(f'Battery level: {battery_level}%, current ppv: {ppv}, house consumption: {house_consumption}.')
-
-        # Decision logic to turn the boiler on/off based on power conditions
-        if ((ppv - house_consumption > consumption) or
-                (ppv - house_consumption > consumption / 2 and battery_level > BOJLER_ENABLE_BATTERY_LEVEL) or
-                (battery_level > BATTERY_ALMOST_FULL)):
-
-            # Turn on the boiler if the conditions are met and it wasn't already on
-            if last_bojler_state is not True:
-                turn_on_off(True, ip_address=tapo_ip_address)  # Turn on the boiler
-            last_bojler_state = True  # Update the boiler state to "on"
-
-        else:
-            # Turn off the boiler if the conditions are not met and it wasn't already off
-            if last_bojler_state is not False:
-                turn_on_off(False, ip_address=tapo_ip_address)  # Turn off the boiler
-            last_bojler_state = False  # Update the boiler state to "off"
-
-        # Sleep for a random interval or until stop_event is set
-        if not sleep_routine(stop_event):
-            # Log stopping of the boiler task and turn off the boiler
-            logging.info(
-                f'Boiler will stop now. '
-                f'Battery level: {battery_level}%, current ppv: {ppv}, house consumption: {house_consumption}.')
-            turn_on_off(False, ip_address=tapo_ip_address)  # Ensure boiler is turned off
-            return  # Exit the task
\ No newline at end of file
+    checked_at = None  # Time of the last read of the real plug state
+    measured_at = None  # Time of the last read of the boiler power
+    ppv, house_consumption, battery_level = None, None, None
+    load = boiler_load(settings['BOJLER_CONSUMPTION'], settings['BOJLER_PRIORITY'])
+    dispatcher = get_dispatcher(inverter_ip_address)  # Surplus shared with the other loads
+    dispatcher.register(load)
+    sampler = get_sampler(inverter_ip_address)  # Telemetry shared with the other tasks
+    sampler.subscribe()
+    timeseries = get_timeseries_store()
+    status = get_status()
+    last_seq = 0  # Sequence number of the last processed telemetry snapshot
+
+    try:
+        while True:  # Loop until the task is cancelled
+
+            # Get the latest telemetry snapshot, the dispatcher decides all loads from the same snapshot
+            snapshot = await sampler.next_snapshot(after_seq=last_seq)
+            started = time.perf_counter()
+            if config.snapshot().version != settings.version:  # Apply changed settings
+                settings = config.snapshot()
+                load.power_w, load.priority = settings['BOJLER_CONSUMPTION'], settings['BOJLER_PRIORITY']
+            last_seq = snapshot.seq
+            ppv, house_consumption, battery_level = snapshot.ppv, snapshot.house_consumption, snapshot.battery_soc
+            should_run = dispatcher.allocate(snapshot).get(load.name, 0) > 0
+
+            if checked_at is None or time.monotonic() - checked_at > PLUG_STATE_INTERVAL:
+                try:
+                    # Read the real state of the plug, it may have been switched manually in the Tapo app
+                    last_bojler_state = await get_plug_state(tapo_ip_address)
+                    if not last_bojler_state:  # The power of a running boiler is recorded when it is measured
+                        timeseries.record_state(boiler=0)
+                    status.update('boiler', on=last_bojler_state)
+                except TapoError as e:
+                    logging.info(e)
+                checked_at = time.monotonic()
+
+            if measured_at is None or time.monotonic() - measured_at > PLUG_POWER_INTERVAL:
+                try:
+                    # The boiler draws nothing once the water is hot, the dispatcher counts with the real power
+                    power = await get_plug_power(tapo_ip_address)
+                    dispatcher.measure(load.name, power)
+                    timeseries.record_state(boiler=power)  # Kept out of the house load forecast
+                except TapoError as e:
+                    logging.info(e)
+                    dispatcher.measure(load.name, None)  # Fall back to the allocated power
+                measured_at = time.monotonic()
+
+            # Switch the boiler only if it is not in the desired state already
+            if last_bojler_state != should_run:
+                # Log the current battery level, PV power, and house consumption
+                logging.info(
+                    f'Battery level: {battery_level}%, current ppv: {ppv}, house consumption: {house_consumption}.')
+                try:
+                    await set_plug_state(tapo_ip_address, should_run)
+                    last_bojler_state = should_run  # Update the boiler state
+                    dispatcher.measure(load.name, None)  # The measured power is outdated, read it again
+                    measured_at = None
+                    timeseries.record_state(boiler=load.power_w if should_run else 0)  # Until it is measured
+                    status.update('boiler', on=should_run)
+                except TapoError as e:
+                    logging.info(e)
+                    last_bojler_state = None  # Unknown state, switch again with the next snapshot
+            observe_loop('boiler', started)
+    except asyncio.CancelledError:
+        # Log stopping of the boiler task and turn off the boiler
+        logging.info(
+            f'Boiler will stop now. '
+            f'Battery level: {battery_level}%, current ppv: {ppv}, house consumption: {house_consumption}.')
+        try:
+            await set_plug_state(tapo_ip_address, False)  # Ensure boiler is turned off
+            timeseries.record_state(boiler=0)
+        except TapoError as e:
+            logging.info(e)
+        raise
+    finally:
+        dispatcher.unregister(load.name)
+        status.clear('boiler')
+        sampler.unsubscribe()
@@ -5,68 +5,218 @@
 # Author: Jan Profant <jan@konversation.ai>
 # All Rights Reserved
 
-import subprocess  # Module to execute shell commands
-import time  # Module for time-related functions
 import asyncio  # Library for running asynchronous operations
 import logging  # Module for logging
+import time  # Module to measure the duration of the loop
 
-from components.goodwe_utils import get_pv_running_mean, get_battery_level  # Custom utilities for GoodWe inverters
-from energy_flow.task_control import sleep_routine  # Utility for sleep control based on external events
+import requests  # HTTP library used by the evcc client
+
+from components.dispatcher import get_dispatcher, Load  # Surplus allocation shared with the boiler
+from components.evcc import get_evcc_client  # Client of the evcc API
+from components.telemetry import get_sampler  # Shared inverter telemetry
+from components.timeseries import get_timeseries_store  # History of telemetry and device states
+from components.status import get_status  # Latest state for the dashboard
+from components.metrics import observe_loop  # Loop duration metrics
 
 # Constants for the task
 MIN_BATTERY_LEVEL = 80  # Minimum battery level required to allow car charging
+BATTERY_HYSTERESIS = 5  # Drop of the battery level (%) below MIN_BATTERY_LEVEL stopping the charging
+ONE_AMP = 240 * 3  # Power equivalent of 1 amp in watts (for 240V and 3 phases)
+START_MARGIN_W = 300  # Surplus above the minimum charging power required to start charging
+STOP_MARGIN_W = 700  # Deficit below the minimum charging power tolerated before charging stops
+START_DELAY_SECONDS = 60  # How long the surplus has to last before charging starts
+STOP_DELAY_SECONDS = 120  # How long the deficit has to last before charging stops
+RAMP_UP_A = 2  # Maximum increase of the charging current per update
+RAMP_DOWN_A = 4  # Maximum decrease of the charging current per update
+DEADBAND_A = 0.5  # Surplus above the next whole amp required to raise the current
+CAR_PRIORITY = 2  # Priority of the car in the surplus dispatch, the boiler goes first by default
+CAR_MIN_ON_SECONDS = 300  # Minimum charging time once started
+CAR_MIN_OFF_SECONDS = 300  # Minimum pause once stopped
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
 
-def car_charging_task(stop_event,
-                      inverter_ip_address,
-                      max_current_a,
-                      min_current_a):
+class SurplusTracker(Load):
     """
-    Task to manage car charging based on photovoltaic (PV) power generation and battery level.
-    This function will keep running until the `stop_event` is set.
+    Closed-loop controller of the car charging current following the PV surplus.
 
-    :param stop_event: threading.Event object to signal when to stop the task
-    :param inverter_ip_address: IP address of the inverter to get PV and battery data
-    :param max_current_a: Maximum charging current in amps
-    :param min_current_a: Minimum charging current in amps
+    Charging starts only when the surplus covers the minimum current with a margin for `start_delay` seconds and
+    stops only after a deficit lasting `stop_delay` seconds, never sooner than the minimum on/off time after the
+    last switch. The current follows the surplus with a deadband and limited steps and is clamped to
+    [min_current_a, max_current_a].
     """
 
-    # Convert charging current limits from amps to watts
-    one_amp = 240 * 3  # Power equivalent of 1 amp in watts (for 240V and 3 phases)
-    min_w = min_current_a * one_amp  # Minimum charging power (in watts), considering 240V and 3 phases
-    max_w = max_current_a * one_amp  # Maximum charging power (in watts)
+    def __init__(self, min_current_a, max_current_a, priority=CAR_PRIORITY, start_margin_w=START_MARGIN_W,
+                 stop_margin_w=STOP_MARGIN_W, start_delay=START_DELAY_SECONDS, stop_delay=STOP_DELAY_SECONDS,
+                 min_on_seconds=CAR_MIN_ON_SECONDS, min_off_seconds=CAR_MIN_OFF_SECONDS, ramp_up_a=RAMP_UP_A,
+                 ramp_down_a=RAMP_DOWN_A, deadband_a=DEADBAND_A, min_battery_level=MIN_BATTERY_LEVEL):
+        """
+        :param min_current_a: Minimum charging current in amps
+        :param max_current_a: Maximum charging current in amps
+        :param priority: Priority of the car in the surplus dispatch, lower is served first
+        :param start_margin_w: Surplus above the minimum charging power required to start charging (W)
+        :param stop_margin_w: Deficit below the minimum charging power tolerated while charging (W)
+        :param start_delay: Seconds the start condition has to hold before charging starts
+        :param stop_delay: Seconds the stop condition has to hold before charging stops
+        :param min_on_seconds: Minimum charging time once started
+        :param min_off_seconds: Minimum pause once stopped
+        :param ramp_up_a: Maximum increase of the current per update (A)
+        :param ramp_down_a: Maximum decrease of the current per update (A)
+        :param deadband_a: Surplus above the next whole amp required to raise the current (A)
+        :param min_battery_level: Battery level (%) required to start charging
+        """
+        super().__init__('car', priority)
+        self.min_current_a = min_current_a
+        self.max_current_a = max(min_current_a, max_current_a)
+        self.start_margin_w = start_margin_w
+        self.stop_margin_w = stop_margin_w
+        self.start_delay = start_delay
+        self.stop_delay = stop_delay
+        self.min_on_seconds = min_on_seconds
+        self.min_off_seconds = min_off_seconds
+        self.ramp_up_a = ramp_up_a
+        self.ramp_down_a = ramp_down_a
+        self.deadband_a = deadband_a
+        self.min_battery_level = min_battery_level
 
-    while not stop_event.is_set():  # Main loop, running until stop_event is triggered
-        logging.info("Car charging subroutine in progress...")
+        self.enabled = False
+        self.current = min_current_a
+        self.pending_since = None  # Timestamp since the start (or stop) condition holds
+        self.switched_at = None  # Timestamp of the last start or stop
 
-        # Fetch PV running mean (ppv) and house consumption values asynchronously
-        ppv, house_consumption = asyncio.run(get_pv_running_mean(inverter_ip_address))
+    def configure(self, min_current_a, max_current_a, priority):
+        """
+        Apply new current limits and priority, the current is clamped to the new limits with the next decision.
+        """
+        self.min_current_a = min_current_a
+        self.max_current_a = max(min_current_a, max_current_a)
+        self.priority = priority
 
-        # Get current battery level asynchronously
-        battery_level = asyncio.run(get_battery_level(inverter_ip_address))
+    def decide(self, timestamp, available, battery_level):
+        """
+        :param timestamp: Time of the measurement in seconds
+        :param available: Power available for the car including what it already takes (W)
+        :param battery_level: Battery level (%)
+        :return: Charging power (W)
+        """
+        min_w = self.min_current_a * ONE_AMP
 
-        logging.info(f'Battery level: {battery_level}%, current ppv: {ppv}, house consumption: {house_consumption}.')
+        if not self.enabled:
+            condition = available > min_w + self.start_margin_w and battery_level > self.min_battery_level
+        else:
+            condition = available < min_w - self.stop_margin_w or battery_level <= self.min_battery_level - \
+                BATTERY_HYSTERESIS
+        if not condition:
+            self.pending_since = None
+        elif self.pending_since is None:
+            self.pending_since = timestamp
+        hold = self.min_on_seconds if self.enabled else self.min_off_seconds
+        if condition and timestamp - self.pending_since >= (self.stop_delay if self.enabled else self.start_delay) \
+                and (self.switched_at is None or timestamp - self.switched_at >= hold):
+            self.enabled, self.pending_since, self.switched_at = not self.enabled, None, timestamp
+            self.current = self.min_current_a
+            logging.info(f'{"Starting" if self.enabled else "Stopping"} car charging, available power: {available} W.')
 
-        # Condition to enable car charging: PV power surplus and battery level above threshold
-        if ppv - house_consumption > min_w and battery_level > MIN_BATTERY_LEVEL:
-            # Calculate the number of charging amps based on available surplus power
-            charge_amps = (ppv - house_consumption) / one_amp
-            logging.info(f'Enabling car charging, charging amps: {charge_amps}')
+        if self.enabled:
+            target = available / ONE_AMP
+            if target >= self.current + 1 + self.deadband_a:
+                current = min(int(target - self.deadband_a), self.current + self.ramp_up_a)
+            elif target < self.current:
+                current = max(int(target), self.current - self.ramp_down_a)
+            else:
+                current = self.current
+            self.current = min(self.max_current_a, max(self.min_current_a, current))
+        return self.current * ONE_AMP if self.enabled else 0
 
-            # Set charging current and enable charging via EVCC
-            subprocess.check_call(f'evcc charger -i {int(charge_amps)}', shell=True)
-            subprocess.check_call(f'evcc charger -e', shell=True)
-        else:
-            # Disable car charging if conditions are not met
-            subprocess.check_call(f'evcc charger -d', shell=True)
+    def curtail(self, timestamp, power, limit):
+        """
+        Lower the current to fit the limit, or stop charging right away when even the minimum current does not fit.
+        """
+        if power <= limit:
+            return power
+        current = int(limit // ONE_AMP)
+        if current >= self.min_current_a:
+            self.current = min(self.current, current)
+            return self.current * ONE_AMP
+        if self.power > 0:
+            logging.info(f'Stopping car charging, the power limit is {limit} W.')
+        self.enabled, self.pending_since, self.switched_at = False, None, timestamp
+        self.current = self.min_current_a
+        return 0
+
+
+async def car_charging_task(config):
+    """
+    Task to manage car charging based on photovoltaic (PV) power generation and battery level.
+    This coroutine will keep running until it is cancelled by the TaskSupervisor, then it disables charging.
+
+    The settings are read from the live configuration, changes of the currents and priority are applied with the
+    next telemetry snapshot. Used GeneralSettings fields:
+
+    - INVERTER_IP_ADDRESS: IP address of the inverter to get PV and battery data, read only at the start
+    - EVCC_URL: Base URL of the evcc API controlling the wallbox, read only at the start
+    - MAX_CURRENT_A: Maximum charging current in amps
+    - MIN_CURRENT_A: Minimum charging current in amps
+    - CAR_PRIORITY: Priority of the car in the surplus dispatch, lower is served first
+
+    :param config: energy_flow.live_config.LiveConfig
+    """
+
+    settings = config.snapshot()
+    inverter_ip_address = settings['INVERTER_IP_ADDRESS']
+    evcc = get_evcc_client(settings['EVCC_URL'])
+    tracker = SurplusTracker(settings['MIN_CURRENT_A'], settings['MAX_CURRENT_A'], settings['CAR_PRIORITY'])
+    dispatcher = get_dispatcher(inverter_ip_address)  # Surplus shared with the other loads
+    dispatcher.register(tracker)
+    ppv, house_consumption, battery_level = None, None, None
+    sampler = get_sampler(inverter_ip_address)  # Telemetry shared with the other tasks
+    sampler.subscribe()
+    timeseries = get_timeseries_store()
+    status = get_status()
+    last_seq = 0  # Sequence number of the last processed telemetry snapshot
+    evcc_state = None  # Last (enabled, current) published to the dashboard
+
+    try:
+        while True:  # Main loop, running until the task is cancelled
+            # Follow every new telemetry sample, the dispatcher decides all loads from the exponentially weighted
+            # moving averages of PV power (ppv) and house consumption
+            snapshot = await sampler.next_snapshot(after_seq=last_seq)
+            started = time.perf_counter()
+            last_seq = snapshot.seq
+            if config.snapshot().version != settings.version:  # Apply changed settings
+                settings = config.snapshot()
+                tracker.configure(settings['MIN_CURRENT_A'], settings['MAX_CURRENT_A'], settings['CAR_PRIORITY'])
+            ppv, house_consumption, battery_level = snapshot.ppv, snapshot.house_consumption, snapshot.battery_soc
+            dispatcher.allocate(snapshot)
 
-    # If stop_event is set, stop car charging gracefully
-    if not sleep_routine(stop_event):
+            try:
+                # Set charging current and enable or disable charging via EVCC, unchanged values are not sent again
+                changed = await asyncio.to_thread(evcc.apply, tracker.enabled,
+                                                  tracker.current if tracker.enabled else None)
+                # The car may charge with less than allowed or not at all, the dispatcher counts with the real power.
+                # Right after a change the car is still ramping, the allocated power is used until the next sample.
+                dispatcher.measure(tracker.name, None if changed else await asyncio.to_thread(evcc.charge_power))
+                timeseries.record_state(car=tracker.power)  # Charging power
+                if evcc_state != (tracker.enabled, tracker.current):
+                    evcc_state = tracker.enabled, tracker.current
+                    status.update('car', enabled=tracker.enabled, current=tracker.current, power=tracker.power)
+            except requests.RequestException as e:
+                # The state is sent again with the next sample
+                logging.info(f'Controlling the wallbox through evcc failed: {e!r}')
+            observe_loop('car', started)
+    except asyncio.CancelledError:
+        # Stop car charging gracefully
         logging.info(
             f'Car charging will stop now. '
             f'Battery level: {battery_level}%, current ppv: {ppv}, house consumption: {house_consumption}.')
-        subprocess.check_call(f'evcc charger -d', shell=True)  # Disable car charging
-        return  # Exit the task
\ No newline at end of file
+        try:
+            await asyncio.to_thread(evcc.apply, False, force=True)  # Disable car charging, even if it looks disabled
+            timeseries.record_state(car=0)
+        except requests.RequestException as e:
+            logging.info(f'Disabling car charging through evcc failed: {e!r}')
+        raise
+    finally:
+        dispatcher.unregister(tracker.name)
+        status.clear('car')
+        sampler.unsubscribe()
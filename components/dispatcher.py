@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import logging
+import threading
+
+from .metrics import registry
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+IMPORT_MARGIN_W = 500  # Headroom below the grid import limit kept free when a load is switched on or ramped up
+
+LOAD_CURTAILMENTS = registry.counter('load_curtailments', 'Loads shed or throttled by the grid import limit.',
+                                     ('load',))
+
+_dispatchers = {}  # Shared dispatchers keyed by inverter IP address
+_dispatchers_lock = threading.Lock()
+
+
+class Load:
+    """
+    Base class of a controllable load taking part in the surplus dispatch.
+    """
+
+    def __init__(self, name, priority):
+        """
+        :param name: Unique name of the load
+        :param priority: Loads with a lower number are served first
+        """
+        self.name = name
+        self.priority = priority
+        self.power = 0  # Power (W) currently allocated to the load
+        self.measured = None  # Power (W) the load was measured to draw, None when no measurement is available
+
+    @property
+    def draw(self):
+        """
+        Power (W) the load takes from the house consumption, the measured one if available, the allocated otherwise.
+        The allocation may differ from the real draw, e.g. a boiler with hot water or a car that has finished charging.
+        """
+        return self.measured if self.measured is not None else self.power
+
+    def decide(self, timestamp, available, battery_level):
+        """
+        Decide the power of the load from what is left of the surplus after the loads with higher priority.
+
+        :param timestamp: Time of the measurement in seconds
+        :param available: Power available for the load including its own current draw (W)
+        :param battery_level: Battery level (%)
+        :return: Power allocated to the load (W)
+        """
+        raise NotImplementedError
+
+    def curtail(self, timestamp, power, limit):
+        """
+        Reduce the power of the load to at most `limit` right away, regardless of its minimum on/off times,
+        e.g. to keep the grid import under the limit.
+
+        :param timestamp: Time of the measurement in seconds
+        :param power: Power the load would take otherwise (W)
+        :param limit: Maximum power of the load (W)
+        :return: Power allocated to the load (W)
+        """
+        return min(power, limit)
+
+
+class SwitchedLoad(Load):
+    """
+    Load which is either off or on with a fixed power, e.g. a boiler switched by a smart plug.
+    """
+
+    def __init__(self, name, priority, power_w, min_on_seconds=0, min_off_seconds=0, assist_battery_level=None,
+                 force_battery_level=None):
+        """
+        :param power_w: Power of the load when on (W)
+        :param min_on_seconds: Minimum time the load stays on once switched on
+        :param min_off_seconds: Minimum time the load stays off once switched off
+        :param assist_battery_level: Battery level (%) above which half of the power may come from the battery
+        :param force_battery_level: Battery level (%) above which the load runs regardless of the surplus
+        """
+        super().__init__(name, priority)
+        self.power_w = power_w
+        self.min_on_seconds = min_on_seconds
+        self.min_off_seconds = min_off_seconds
+        self.assist_battery_level = assist_battery_level
+        self.force_battery_level = force_battery_level
+        self.switched_at = None  # Timestamp of the last switch
+
+    def decide(self, timestamp, available, battery_level):
+        on = self.power > 0
+        if self.force_battery_level is not None and battery_level > self.force_battery_level:
+            run = True
+        elif self.assist_battery_level is not None and battery_level > self.assist_battery_level:
+            run = available > self.power_w / 2
+        else:
+            run = available > self.power_w
+
+        # Keep the current state until the minimum on/off time elapses
+        if run != on and self.switched_at is not None and \
+                timestamp - self.switched_at < (self.min_on_seconds if on else self.min_off_seconds):
+            run = on
+        if run != on:
+            self.switched_at = timestamp
+        return self.power_w if run else 0
+
+    def curtail(self, timestamp, power, limit):
+        if power <= limit:
+            return power
+        if self.power > 0:
+            self.switched_at = timestamp  # Keep it off for the minimum off time
+        return 0
+
+
+class SurplusDispatcher:
+    """
+    Central allocation of the PV surplus across the registered loads.
+
+    All loads are decided from the same telemetry snapshot in the order of their priority, every load gets what is
+    left after the loads before it. The allocation is computed once per snapshot and shared by all tasks.
+
+    With a grid import limit set, loads are shed or throttled in the reverse order of their priority as soon as the
+    import exceeds the limit, and no load is switched on or ramped up beyond the remaining headroom.
+    """
+
+    def __init__(self, import_margin_w=IMPORT_MARGIN_W):
+        """
+        :param import_margin_w: Headroom below the import limit kept free when a load is switched on or ramped up
+        """
+        self.loads = {}  # Registered loads keyed by name
+        self.lock = threading.Lock()
+        self.seq = None  # Sequence number of the snapshot of the last allocation
+        self.allocation = {}
+        self.import_limit_w = None  # Maximum grid import (W), None for no limit
+        self.import_margin_w = import_margin_w
+        self.headroom = None  # Import below the limit (W) after the last allocation, negative when still exceeded
+
+    def set_import_limit(self, limit_w):
+        """
+        :param limit_w: Maximum grid import (W), None removes the limit
+        """
+        with self.lock:
+            self.import_limit_w = limit_w
+            self.seq, self.headroom = None, None
+
+    def register(self, load):
+        with self.lock:
+            self.loads[load.name] = load
+            self.seq = None
+
+    def unregister(self, name):
+        with self.lock:
+            self.loads.pop(name, None)
+            self.seq = None
+
+    def measure(self, name, power):
+        """
+        Report the power the load really draws, e.g. read from the smart plug or the wallbox.
+
+        :param name: Name of the load
+        :param power: Measured power (W), None when it is not known, e.g. right after the load was switched
+        """
+        with self.lock:
+            load = self.loads.get(name)
+            if load is not None:
+                load.measured = power
+
+    def dispatch(self, timestamp, ppv, house_consumption, battery_level, grid_import=None):
+        """
+        Allocate the surplus to the loads.
+
+        :param timestamp: Time of the measurement in seconds
+        :param ppv: PV power (W)
+        :param house_consumption: House consumption including the registered loads (W)
+        :param battery_level: Battery level (%)
+        :param grid_import: Power imported from the grid (W), negative for export, None if unknown
+        :return: dict mapping load name to the allocated power (W)
+        """
+        with self.lock:
+            return self._dispatch(timestamp, ppv, house_consumption, battery_level, grid_import)
+
+    def _dispatch(self, timestamp, ppv, house_consumption, battery_level, grid_import=None):
+        loads = sorted(self.loads.values(), key=lambda load: (load.priority, load.name))
+        # The house consumption contains the power the loads draw, it is available for them again
+        available = ppv - house_consumption + sum(load.draw for load in loads)
+
+        headroom = None
+        if self.import_limit_w is not None and grid_import is not None:
+            headroom = self.import_limit_w - grid_import
+            for load in reversed(loads):  # Shed the loads with the lowest priority first
+                if headroom >= 0:
+                    break
+                if load.power > 0:
+                    power = load.curtail(timestamp, load.power, max(0, load.power + headroom))
+                    logging.info(f'Grid import {grid_import} W over the limit {self.import_limit_w} W, '
+                                 f'reducing {load.name} from {load.power} W to {power} W.')
+                    LOAD_CURTAILMENTS.inc(load=load.name)
+                    headroom += load.power - power
+                    load.power = power
+
+        allocation = {}
+        for load in loads:
+            power = load.decide(timestamp, available, battery_level)
+            if headroom is not None and power - load.power > max(0, headroom - self.import_margin_w):
+                power = load.curtail(timestamp, power, load.power + max(0, headroom - self.import_margin_w))
+            if power != load.power:
+                logging.info(f'Dispatching {power} W to {load.name}, available power: {available} W.')
+            if headroom is not None:
+                headroom -= power - load.power
+            load.power = allocation[load.name] = power
+            available -= power
+        self.allocation = allocation
+        self.headroom = headroom
+        return allocation
+
+    def allocate(self, snapshot):
+        """
+        Allocation for the telemetry snapshot, computed only by the first task asking for it.
+
+        :param snapshot: telemetry.TelemetrySnapshot
+        :return: dict mapping load name to the allocated power (W)
+        """
+        with self.lock:
+            if snapshot.seq != self.seq:
+                ppv = snapshot.statistic('ppv', 'ewma')
+                house_consumption = snapshot.statistic('house_consumption', 'ewma')
+                # The latest sample instead of the average, so the import limit is enforced right away
+                active_power = snapshot.latest.active_power  # Positive for export
+                grid_import = -active_power if active_power is not None else None
+                if ppv is not None and house_consumption is not None and snapshot.battery_soc is not None:
+                    self._dispatch(snapshot.timestamp, ppv, house_consumption, snapshot.battery_soc, grid_import)
+                self.seq = snapshot.seq
+            return self.allocation
+
+
+def get_dispatcher(inverter_ip_address):
+    """
+    Return the shared dispatcher of the loads powered by the inverter, creating it on first use.
+
+    :param inverter_ip_address: IP address of the inverter
+    :return: SurplusDispatcher instance
+    """
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(inverter_ip_address)
+        if dispatcher is None:
+            dispatcher = SurplusDispatcher()
+            _dispatchers[inverter_ip_address] = dispatcher
+        return dispatcher
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import logging
+import threading
+
+import requests
+
+from .metrics import EVCC_FAILURES, EVCC_REQUEST_SECONDS
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+EVCC_URL = 'http://localhost:7070'  # evcc running on the same machine by default
+EVCC_LOADPOINT = 1  # Loadpoint of the wallbox, numbered from 1
+EVCC_TIMEOUT = 10  # Timeout of a request to the evcc API in seconds
+EVCC_ENABLED_MODE = 'now'  # Loadpoint mode charging with the set current regardless of the PV surplus of evcc
+EVCC_DISABLED_MODE = 'off'
+
+_clients = {}  # Shared clients keyed by (url, loadpoint)
+_clients_lock = threading.Lock()
+
+
+class EvccClient:
+    """
+    Client of the evcc REST API controlling a single loadpoint over a persistent HTTP session.
+
+    The last applied current and enabled state are cached, so only changes are sent to evcc. The cache is
+    dropped on any error and the next `apply` sends the full state again.
+    """
+
+    def __init__(self, url=EVCC_URL, loadpoint=EVCC_LOADPOINT, timeout=EVCC_TIMEOUT):
+        """
+        :param url: Base URL of evcc, e.g. http://localhost:7070
+        :param loadpoint: Loadpoint number
+        :param timeout: Timeout of a request in seconds
+        """
+        self.url = url.rstrip('/')
+        self.loadpoint = loadpoint
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()  # Serializes the requests and updates of the cached state
+        self.enabled = None  # Last applied state, None when unknown
+        self.current = None
+
+    def _request(self, method, path, endpoint):
+        try:
+            with EVCC_REQUEST_SECONDS.time(endpoint=endpoint):
+                response = self.session.request(method, f'{self.url}/api/{path}', timeout=self.timeout)
+                response.raise_for_status()
+        except requests.RequestException:
+            EVCC_FAILURES.inc()
+            raise
+        return response
+
+    def _loadpoint(self):
+        state = self._request('GET', 'state', 'state').json()
+        state = state.get('result', state)  # Older evcc versions wrap the state in result
+        return state['loadpoints'][self.loadpoint - 1]
+
+    def _post(self, path):
+        return self._request('POST', f'loadpoints/{self.loadpoint}/{path}', path.split('/')[0])
+
+    def apply(self, enabled, current=None, force=False):
+        """
+        Bring the loadpoint to the requested state, sending only what differs from the last applied state.
+        The current is set before enabling, so the charging never starts with the previous current.
+
+        :param enabled: True to charge, False to stop charging
+        :param current: Maximum charging current in amps, None keeps the current one
+        :param force: Send the state even if it equals the last applied one, e.g. when stopping the charging for good
+        :return: True if anything was sent to evcc
+        """
+        current = int(current) if current is not None else None
+        with self.lock:
+            if force:
+                self.enabled, self.current = None, None
+            changed = False
+            try:
+                if current is not None and current != self.current:
+                    self.current = None
+                    self._post(f'maxcurrent/{current}')
+                    self.current, changed = current, True
+                if enabled != self.enabled:
+                    self.enabled = None
+                    self._post(f'mode/{EVCC_ENABLED_MODE if enabled else EVCC_DISABLED_MODE}')
+                    self.enabled, changed = enabled, True
+            except requests.RequestException:
+                self.enabled, self.current = None, None
+                raise
+            if changed:
+                logging.info(f'evcc loadpoint {self.loadpoint}: enabled {enabled}, current {self.current} A')
+            return changed
+
+    def refresh(self):
+        """
+        Read the real state of the loadpoint from evcc into the cache, e.g. after it was changed in the evcc UI.
+
+        :return: tuple (enabled, current)
+        """
+        with self.lock:
+            loadpoint = self._loadpoint()
+            self.enabled = loadpoint.get('mode') not in (None, EVCC_DISABLED_MODE)
+            self.current = int(loadpoint['maxCurrent']) if loadpoint.get('maxCurrent') is not None else None
+            return self.enabled, self.current
+
+    def charge_power(self):
+        """
+        Read the power the loadpoint is charging with from evcc.
+
+        :return: Charging power in watts, 0 when the car is not charging
+        """
+        with self.lock:
+            return float(self._loadpoint().get('chargePower') or 0)
+
+    def close(self):
+        self.session.close()
+
+
+def get_evcc_client(url=EVCC_URL, loadpoint=EVCC_LOADPOINT):
+    """
+    Return the shared client of the loadpoint, creating it on first use.
+
+    :param url: Base URL of evcc
+    :param loadpoint: Loadpoint number
+    :return: EvccClient instance
+    """
+    with _clients_lock:
+        client = _clients.get((url, loadpoint))
+        if client is None:
+            client = EvccClient(url, loadpoint)
+            _clients[(url, loadpoint)] = client
+        return client
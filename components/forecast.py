@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import datetime
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .ote import OTE_TIMEZONE
+from .timeseries import get_timeseries_store
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+FORECAST_SLOT_SECONDS = 900  # Resolution of the profiles, the 15 minute rollups of the time-series store
+FORECAST_SLOTS = 86400 // FORECAST_SLOT_SECONDS  # Number of profile slots per day
+FORECAST_HISTORY_DAYS = 28  # Days of history the profiles are fitted from
+FORECAST_HALF_LIFE_DAYS = 7  # Age of a day (days) at which its weight is halved, follows the seasons
+FORECAST_MIN_DAYS = 3  # Minimum number of days with data required for a forecast
+
+_forecaster = None
+_forecaster_lock = threading.Lock()
+
+
+def _utc_offsets(timestamps):
+    """
+    UTC offsets (seconds) of OTE_TIMEZONE, computed once per UTC day. The offset at noon is used for the whole day,
+    so only the few slots between midnight and the DST change at night are shifted by an hour.
+    """
+    days = np.asarray(timestamps, dtype=np.int64) // 86400
+    unique_days, inverse = np.unique(days, return_inverse=True)
+    offsets = np.array([datetime.datetime.fromtimestamp(day * 86400 + 43200, OTE_TIMEZONE).utcoffset().total_seconds()
+                        for day in unique_days.tolist()], dtype=np.int64)
+    return offsets[inverse]
+
+
+def _is_weekend(local_days):
+    return (np.asarray(local_days) + 3) % 7 >= 5  # 1970-01-01 was a Thursday
+
+
+def _weighted_profile(matrix, weights):
+    """
+    :param matrix: days x slots array, NaN for missing values
+    :param weights: Weight of every day
+    :return: Weighted mean of every slot, NaN for slots without data
+    """
+    present = ~np.isnan(matrix)
+    weights = weights[:, None] * present
+    total = weights.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, (np.nan_to_num(matrix) * weights).sum(axis=0) / total, np.nan)
+
+
+class ProfileForecaster:
+    """
+    PV generation and house load forecast from the recorded inverter history, without weather data.
+
+    Every 15 minute slot of the local day gets its own profile - a recency weighted mean of the same slot over the
+    last FORECAST_HISTORY_DAYS days, so the profiles follow the seasons. The house load has separate profiles for
+    working days and weekends. Fitting is vectorized and takes milliseconds, so it can run every night, and a
+    forecast is only a lookup into the profiles.
+    """
+
+    def __init__(self, history_days=FORECAST_HISTORY_DAYS, half_life_days=FORECAST_HALF_LIFE_DAYS,
+                 min_days=FORECAST_MIN_DAYS):
+        """
+        :param history_days: Days of history the profiles are fitted from
+        :param half_life_days: Age of a day (days) at which its weight is halved
+        :param min_days: Minimum number of days with data required for a forecast
+        """
+        self.history_days = history_days
+        self.half_life_days = half_life_days
+        self.min_days = min_days
+        self.ppv = None  # PV profile (W) per slot, None until fitted
+        self.load = None  # House load profiles (W), rows for working days and weekends
+        self.fitted_day = None  # Local date of the last fit
+
+    @property
+    def ready(self):
+        return self.ppv is not None
+
+    def fit(self, timestamps, ppv, house_consumption, controlled=None, now=None):
+        """
+        Fit the profiles from the 15 minute history.
+
+        :param timestamps: UNIX times of the beginning of the 15 minute buckets
+        :param ppv: Mean PV power (W) of every bucket, NaN when missing
+        :param house_consumption: Mean house consumption (W) of every bucket, NaN when missing
+        :param controlled: Mean power (W) of the loads switched on the surplus (the boiler and the car), excluded
+                           from the load, the dispatcher schedules them on its own
+        :param now: UNIX time the day ages are counted from, defaults to now
+        :return: self
+        """
+        now = time.time() if now is None else now
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        load = np.asarray(house_consumption, dtype=float)
+        if controlled is not None:
+            load = load - np.nan_to_num(np.asarray(controlled, dtype=float))
+        self.ppv, self.load = None, None
+        if len(timestamps) == 0:
+            return self
+
+        local = timestamps + _utc_offsets(timestamps)
+        days, slots = local // 86400, (local % 86400) // FORECAST_SLOT_SECONDS
+        first_day = days.min()
+        n_days = int(days.max() - first_day) + 1
+        matrices = {}
+        for name, values in (('ppv', ppv), ('load', load)):
+            matrix = np.full((n_days, FORECAST_SLOTS), np.nan)
+            matrix[days - first_day, slots] = np.asarray(values, dtype=float)
+            matrices[name] = matrix
+
+        covered = ~np.isnan(matrices['ppv']).all(axis=1) & ~np.isnan(matrices['load']).all(axis=1)
+        if covered.sum() < self.min_days:
+            logging.info(f'Not enough history for a forecast: {covered.sum()} days, {self.min_days} required.')
+            return self
+        day_numbers = first_day + np.arange(n_days)
+        now_day = (now + _utc_offsets([now])[0]) // 86400
+        weights = 0.5 ** ((now_day - day_numbers) / self.half_life_days)
+
+        self.ppv = np.nan_to_num(_weighted_profile(matrices['ppv'], weights))  # No data means no PV
+        overall = _weighted_profile(matrices['load'], weights)
+        overall = np.where(np.isnan(overall), np.nanmean(overall), overall)
+        weekend = _is_weekend(day_numbers)
+        self.load = np.stack([_weighted_profile(matrices['load'], weights * ~weekend),
+                              _weighted_profile(matrices['load'], weights * weekend)])
+        self.load = np.where(np.isnan(self.load), overall, self.load)  # Fall back to all days
+        logging.info(f'Fitted forecast profiles from {covered.sum()} days, expected PV today '
+                     f'{self.ppv.sum() * FORECAST_SLOT_SECONDS / 3600 / 1000:.1f} kWh.')
+        return self
+
+    def fit_store(self, store=None, now=None):
+        """
+        Fit the profiles from the 15 minute rollups of the time-series store.
+
+        :param store: timeseries.TimeSeriesStore, the shared one by default
+        :param now: UNIX time, defaults to now
+        :return: self
+        """
+        store = store or get_timeseries_store()
+        now = time.time() if now is None else now
+        rows = store.query(now - self.history_days * 86400, now, FORECAST_SLOT_SECONDS)
+
+        def column(name):
+            return np.array([row[name] for row in rows], dtype=float)  # None becomes NaN
+
+        controlled = np.nan_to_num(column('boiler')) + np.nan_to_num(column('car'))
+        return self.fit([row['ts'] for row in rows], column('ppv'), column('house_consumption'), controlled, now)
+
+    def forecast(self, starts, slot_minutes):
+        """
+        Expected mean PV power and house load of every slot.
+
+        :param starts: UNIX times of the slot beginnings, e.g. from planner.price_horizon
+        :param slot_minutes: Length of every slot in minutes (multiple of 15), scalar or array
+        :return: tuple (ppv, load) of numpy arrays in W, None when not fitted
+        """
+        if not self.ready:
+            return None
+        starts = np.asarray(starts, dtype=np.int64)
+        counts = np.broadcast_to(np.asarray(slot_minutes, dtype=np.int64) * 60 // FORECAST_SLOT_SECONDS,
+                                 starts.shape)
+        local = starts + _utc_offsets(starts)
+        first = (local % 86400) // FORECAST_SLOT_SECONDS
+        steps = np.arange(max(1, int(counts.max(initial=1))))
+        mask = steps[None, :] < counts[:, None]
+        index = (first[:, None] + steps[None, :]) % FORECAST_SLOTS
+        weekend = _is_weekend(local // 86400).astype(int)
+        ppv = (self.ppv[index] * mask).sum(axis=1) / np.maximum(counts, 1)
+        load = (self.load[weekend[:, None], index] * mask).sum(axis=1) / np.maximum(counts, 1)
+        return ppv, load
+
+    def net_load_kwh(self, starts, slot_hours):
+        """
+        Expected house load minus PV generation per slot, the input of planner.plan_charge_schedule.
+
+        :param starts: UNIX times of the slot beginnings
+        :param slot_hours: numpy array with the length of every slot in hours
+        :return: numpy array in kWh, negative for PV surplus, None when not fitted
+        """
+        slot_hours = np.asarray(slot_hours, dtype=float)
+        forecast = self.forecast(starts, np.rint(slot_hours * 60))
+        if forecast is None:
+            return None
+        ppv, load = forecast
+        return (load - ppv) * slot_hours / 1000
+
+    def refresh(self, now=None):
+        """
+        Refit from the time-series store once per local day.
+
+        :param now: UNIX time, defaults to now
+        :return: True if the profiles were refitted
+        """
+        now = time.time() if now is None else now
+        if self.fitted_day == datetime.datetime.fromtimestamp(now, OTE_TIMEZONE).date():
+            return False
+        self.fit_store(now=now)
+        self.fitted_day = datetime.datetime.fromtimestamp(now, OTE_TIMEZONE).date()  # Also without enough history
+        return True
+
+
+def get_forecaster():
+    """
+    Return the process-wide ProfileForecaster, creating it on first use.
+    """
+    global _forecaster
+    with _forecaster_lock:
+        if _forecaster is None:
+            _forecaster = ProfileForecaster()
+        return _forecaster
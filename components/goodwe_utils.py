@@ -5,56 +5,404 @@
 # Author: Jan Profant <jan@konversation.ai>
 # All Rights Reserved
 
+import asyncio
+import collections
+import concurrent.futures
 import logging
+import threading
 import time
 
 import goodwe
-import numpy as np
 from goodwe import OperationMode
 
+from .metrics import (INVERTER_MODE_SWITCHES, INVERTER_MODE_WRITES_DEFERRED, INVERTER_MODE_WRITES_SKIPPED,
+                      INVERTER_RECONNECTS, INVERTER_REQUEST_SECONDS, INVERTER_RETRIES)
+from .running_stats import WindowedStatistics
+
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
+INVERTER_QUEUE_SIZE = 16  # Maximum number of pending requests per inverter
+INVERTER_REQUEST_TIMEOUT = 30  # Timeout for a single request to the inverter (seconds)
+INVERTER_RECONNECT_ATTEMPTS = 3  # Number of reconnects before the request is considered failed
+MODE_MIN_DWELL_SECONDS = 300  # Minimum time an operation mode is kept before it is changed again
+MODE_VERIFY_INTERVAL = 3600  # Seconds after which the known mode is read from the inverter again
+MODE_DEFAULT_PRIORITY = 10  # Priority of mode requests, lower wins
+
+_clients = {}  # Shared inverter clients keyed by IP address
+_clients_lock = threading.Lock()
+_mode_writers = {}  # Shared mode writers keyed by IP address
+_mode_writers_lock = threading.Lock()
+
+ModeRequest = collections.namedtuple('ModeRequest', ['priority', 'seq', 'setting'])
+
+
+class InverterClient:
+    """
+    Long-lived connection to a single GoodWe inverter shared by all control tasks.
+
+    The client owns one event loop running in a background thread. Requests are put into a bounded queue
+    and executed one by one over a single connection, so the inverter never sees concurrent handshakes.
+    When a request fails, the connection is dropped and re-established on the next attempt.
+    """
+
+    def __init__(self, inverter_ip_address, queue_size=INVERTER_QUEUE_SIZE):
+        """
+        Initialize the client and start its event loop thread.
+
+        :param inverter_ip_address: IP address of the inverter
+        :param queue_size: Maximum number of requests waiting for the inverter
+        """
+        self.inverter_ip_address = inverter_ip_address
+        self.inverter = None  # goodwe.Inverter instance, None until connected
+        self.loop = asyncio.new_event_loop()
+        self.queue = None  # Created inside the loop thread
+        self.queue_size = queue_size
+        self.worker = None  # asyncio.Task executing the queued requests
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self._run_loop, daemon=True, name=f'inverter-{inverter_ip_address}')
+        self.thread.start()
+        self.ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.worker = self.loop.create_task(self._worker())
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _worker(self):
+        """
+        Execute queued requests sequentially over the shared connection.
+        """
+        while True:
+            request, future, operation = await self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue  # Caller is no longer interested in the result
+            try:
+                result = await self._execute(request, operation)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    async def _execute(self, request, operation):
+        last_error = None
+        started = time.perf_counter()
+        try:
+            for attempt in range(INVERTER_RECONNECT_ATTEMPTS):
+                try:
+                    if self.inverter is None:
+                        logging.info(f'Connecting to inverter {self.inverter_ip_address}.')
+                        INVERTER_RECONNECTS.inc()
+                        with INVERTER_REQUEST_SECONDS.time(operation='connect'):
+                            self.inverter = await goodwe.connect(self.inverter_ip_address)
+                    return await asyncio.wait_for(request(self.inverter), INVERTER_REQUEST_TIMEOUT)
+                except (goodwe.InverterError, asyncio.TimeoutError, OSError) as e:
+                    logging.info(f'Request to inverter {self.inverter_ip_address} failed ({e!r}), '
+                                 f'attempt {attempt + 1}/{INVERTER_RECONNECT_ATTEMPTS}.')
+                    INVERTER_RETRIES.inc(operation=operation)
+                    self.inverter = None  # Force a new handshake on the next attempt
+                    last_error = e
+            raise last_error
+        finally:
+            # Includes the reconnects and retries, i.e. the time the caller waited for the inverter
+            INVERTER_REQUEST_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+    @staticmethod
+    def _operation(request, operation):
+        return operation or getattr(request, '__name__', 'request').strip('_')
+
+    def submit(self, request, operation=None):
+        """
+        Queue a request for the inverter. Blocks while the queue is full.
+
+        :param request: Coroutine function accepting the connected goodwe.Inverter
+        :param operation: Name of the request in the metrics, defaults to the name of the function
+        :return: concurrent.futures.Future with the result of the request
+        """
+        if threading.current_thread() is self.thread:
+            raise RuntimeError('Use `await client.request(...)` from the inverter event loop.')
+        future = concurrent.futures.Future()
+        item = (request, future, self._operation(request, operation))
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+        return future
+
+    def call(self, request, timeout=None, operation=None):
+        """
+        Synchronous variant of `request`, for callers running outside of any event loop.
+        """
+        return self.submit(request, operation).result(timeout)
+
+    async def request(self, request, operation=None):
+        """
+        Queue a request for the inverter and await its result. Can be awaited from any event loop.
+
+        :param request: Coroutine function accepting the connected goodwe.Inverter
+        :param operation: Name of the request in the metrics, defaults to the name of the function
+        :return: Result of the request
+        """
+        future = concurrent.futures.Future()
+        item = (request, future, self._operation(request, operation))
+        if asyncio.get_running_loop() is self.loop:
+            await self.queue.put(item)
+        else:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop))
+        return await asyncio.wrap_future(future)
+
+    async def read_runtime_data(self):
+        return await self.request(lambda inverter: inverter.read_runtime_data(), 'read_runtime_data')
+
+    def close(self):
+        """
+        Stop the worker and the event loop thread. The client can not be used afterwards.
+        """
+        async def _stop_worker():
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+
+        asyncio.run_coroutine_threadsafe(_stop_worker(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def get_inverter_client(inverter_ip_address):
+    """
+    Return the shared client for the given inverter, creating it on first use.
+
+    :param inverter_ip_address: IP address of the inverter
+    :return: InverterClient instance
+    """
+    with _clients_lock:
+        client = _clients.get(inverter_ip_address)
+        if client is None:
+            client = InverterClient(inverter_ip_address)
+            _clients[inverter_ip_address] = client
+        return client
+
 
-async def get_pv_running_mean(inverter_ip_address, running_mean_values=5, running_mean_sleep_seconds=3):
-    logging.info(f'Computing pv running mean, it will take {running_mean_values * running_mean_sleep_seconds} seconds')
-    ppv_mean, house_consumption_mean = [], []
-    inverter = await goodwe.connect(inverter_ip_address)
-    for _ in range(running_mean_values):
-        runtime_data = await inverter.read_runtime_data()
+async def get_pv_running_mean(inverter_ip_address, running_mean_values=5, running_mean_sleep_seconds=3,
+                              statistic='mean'):
+    """
+    Sample PV power and house consumption and return their windowed statistic. The waits between samples
+    do not block the event loop, so several readers can run side by side.
 
-        for sensor in inverter.sensors():
-            if sensor.id_ in runtime_data:
-                if sensor.id_ == 'ppv':
-                    ppv_mean.append(runtime_data[sensor.id_])
-                elif sensor.id_ == 'house_consumption':
-                    house_consumption_mean.append(runtime_data[sensor.id_])
-        time.sleep(running_mean_sleep_seconds)
-    return np.mean(ppv_mean), np.mean(house_consumption_mean)
+    :param inverter_ip_address: IP address of the inverter
+    :param running_mean_values: Number of samples
+    :param running_mean_sleep_seconds: Seconds between two samples
+    :param statistic: Statistic of the window - 'mean', 'ewma', 'median', 'min', 'max' or a percentile like 'p90'
+    :return: tuple (ppv, house_consumption)
+    """
+    logging.info(f'Computing pv running {statistic}, '
+                 f'it will take {(running_mean_values - 1) * running_mean_sleep_seconds} seconds')
+    ppv_stats = WindowedStatistics(running_mean_values)
+    house_consumption_stats = WindowedStatistics(running_mean_values)
+    client = get_inverter_client(inverter_ip_address)
+    for i in range(running_mean_values):
+        runtime_data = await client.read_runtime_data()
+        ppv_stats.push(runtime_data.get('ppv'))
+        house_consumption_stats.push(runtime_data.get('house_consumption'))
+        if i < running_mean_values - 1:
+            await asyncio.sleep(running_mean_sleep_seconds)
+    return ppv_stats.get(statistic), house_consumption_stats.get(statistic)
 
 
 async def get_battery_level(inverter_ip_address):
-    inverter = await goodwe.connect(inverter_ip_address)
-    runtime_data = await inverter.read_runtime_data()
+    runtime_data = await get_inverter_client(inverter_ip_address).read_runtime_data()
+    return runtime_data.get('battery_soc')
+
+
+class ModeWriter:
+    """
+    Write-coalescing layer for the operation mode of a single inverter.
+
+    Controllers (e.g. the battery task) submit the mode they want under their own name and priority, the request
+    with the lowest priority number wins, the newest one on a tie. The mode last written to the inverter is
+    tracked locally, so requests for the current mode are answered without a request to the inverter; the mode
+    is read only at the start and every MODE_VERIFY_INTERVAL seconds, in case it was changed in the GoodWe app.
+    Changes into ECO_CHARGE/ECO_DISCHARGE within `min_dwell_seconds` after the previous one are postponed, which
+    limits flapping and the wear of the inverter memory. Returning to the general mode is never postponed, it is the
+    stop of charging or discharging, e.g. at the battery reserve or the upper level. Writes are executed by the worker of the InverterClient, so they never overlap.
+    """
+
+    def __init__(self, client, min_dwell_seconds=MODE_MIN_DWELL_SECONDS, verify_interval=MODE_VERIFY_INTERVAL):
+        """
+        :param client: InverterClient of the inverter
+        :param min_dwell_seconds: Minimum time a mode is kept before it is changed again
+        :param verify_interval: Seconds after which the known mode is read from the inverter again
+        """
+        self.client = client
+        self.min_dwell_seconds = min_dwell_seconds
+        self.verify_interval = verify_interval
+        self.lock = threading.Lock()
+        self.requests = {}  # ModeRequest keyed by the name of the requesting controller
+        self.seq = 0  # Incremented with every request, orders requests of the same priority
+        self.setting = None  # Last known (mode, eco_mode_power, eco_mode_soc), None when unknown
+        self.verified_at = None  # time.monotonic() of the last read or write of the mode
+        self.changed_at = None  # time.monotonic() of the last mode change
+        self.retry = None  # asyncio.TimerHandle of the postponed write
+
+    @property
+    def operation_mode(self):
+        """
+        :return: Last known goodwe.OperationMode of the inverter, None when unknown
+        """
+        with self.lock:
+            return self.setting[0] if self.setting is not None else None
+
+    @staticmethod
+    def _setting(operation_mode, eco_mode_power=100, eco_mode_soc=100):
+        if operation_mode in (OperationMode.ECO_CHARGE, OperationMode.ECO_DISCHARGE):
+            return operation_mode, eco_mode_power, eco_mode_soc
+        return operation_mode, None, None  # The eco parameters do not apply to the other modes
+
+    def _target(self):
+        if not self.requests:
+            return self._setting(OperationMode.GENERAL)
+        return min(self.requests.values(), key=lambda request: (request.priority, -request.seq)).setting
+
+    def _known(self):
+        if self.verified_at is None or time.monotonic() - self.verified_at > self.verify_interval:
+            return None
+        return self.setting
+
+    async def submit(self, source, operation_mode: OperationMode, priority=MODE_DEFAULT_PRIORITY, eco_mode_power=100,
+                     eco_mode_soc=100, force=False):
+        """
+        Request the operation mode on behalf of a controller, replacing its previous request.
+
+        :param source: Name of the requesting controller, e.g. 'battery'
+        :param operation_mode: goodwe.OperationMode to set
+        :param priority: Priority of the request, lower wins over the requests of the other controllers
+        :param eco_mode_power: Charge/discharge power in % of the nominal power, only for ECO_CHARGE/ECO_DISCHARGE
+        :param eco_mode_soc: SoC (%) at which ECO_CHARGE/ECO_DISCHARGE stops charging/discharging
+        :param force: Write immediately, ignoring the minimum dwell time
+        :return: goodwe.OperationMode active on the inverter
+        """
+        with self.lock:
+            self.seq += 1
+            self.requests[source] = ModeRequest(priority, self.seq,
+                                                self._setting(operation_mode, eco_mode_power, eco_mode_soc))
+        return await self.flush(force)
+
+    async def release(self, source, force=True):
+        """
+        Withdraw the request of the controller, e.g. when its task stops. The inverter returns to the mode of the
+        next request, or to the general mode if there is none.
+
+        :param source: Name of the controller
+        :param force: Write immediately, ignoring the minimum dwell time
+        :return: goodwe.OperationMode active on the inverter
+        """
+        with self.lock:
+            self.requests.pop(source, None)
+        return await self.flush(force)
+
+    async def flush(self, force=False):
+        """
+        Bring the inverter to the mode of the winning request.
+
+        :param force: Write immediately, ignoring the minimum dwell time
+        :return: goodwe.OperationMode active on the inverter
+        """
+        with self.lock:
+            known = self._known()
+            if known is not None and known == self._target():
+                INVERTER_MODE_WRITES_SKIPPED.inc()
+                return known[0]
+
+        async def _set_operation_mode(inverter):
+            return await self._apply(inverter, force)
+
+        return await self.client.request(_set_operation_mode)
+
+    async def _apply(self, inverter, force):
+        # Runs in the worker of the inverter client, one write at a time
+        with self.lock:
+            target, known = self._target(), self._known()
+        if known is None:
+            operation_mode = await inverter.get_operation_mode()
+            with self.lock:
+                # Keep the eco parameters of the last write, they can not be read back
+                if self.setting is None or self.setting[0] != operation_mode:
+                    self.setting = self._setting(operation_mode, None, None)
+                self.verified_at = time.monotonic()
+                known = self.setting
+        if known == target:
+            return known[0]
+
+        # Only moves into an active mode are rate limited, stopping it must not wait
+        remaining = 0 if force or self.changed_at is None or target[0] == OperationMode.GENERAL else \
+            self.changed_at + self.min_dwell_seconds - time.monotonic()
+        if remaining > 0:
+            INVERTER_MODE_WRITES_DEFERRED.inc()
+            if self.retry is None:
+                logging.info(f'Operation mode {target[0]} postponed by {remaining:.0f} seconds, '
+                             f'keeping {known[0]}.')
+                self.retry = asyncio.get_running_loop().call_later(remaining, self._schedule_retry)
+            return known[0]
+
+        logging.info(f'Setting operation mode {target[0]} from {known[0]}')
+        with self.lock:
+            self.setting = None  # Unknown until the write succeeds
+        await inverter.set_operation_mode(target[0], *(value for value in target[1:] if value is not None))
+        INVERTER_MODE_SWITCHES.inc(mode=target[0].name)
+        with self.lock:
+            self.setting, self.verified_at, self.changed_at = target, time.monotonic(), time.monotonic()
+        return target[0]
+
+    def _schedule_retry(self):
+        self.retry = None
+        self.client.loop.create_task(self._retry())
+
+    async def _retry(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.info(f'Postponed operation mode change failed: {e!r}')
+
+
+def get_mode_writer(inverter_ip_address):
+    """
+    Return the shared mode writer of the inverter, creating it on first use.
 
-    for sensor in inverter.sensors():
-        if sensor.id_ in runtime_data and sensor.id_ == 'battery_soc':
-            return runtime_data[sensor.id_]
+    :param inverter_ip_address: IP address of the inverter
+    :return: ModeWriter instance
+    """
+    with _mode_writers_lock:
+        writer = _mode_writers.get(inverter_ip_address)
+        if writer is None:
+            writer = ModeWriter(get_inverter_client(inverter_ip_address))
+            _mode_writers[inverter_ip_address] = writer
+        return writer
 
 
-async def set_operation_mode(inverter_ip_address, operation_mode: OperationMode):
-    inverter = await goodwe.connect(inverter_ip_address)
+async def set_operation_mode(inverter_ip_address, operation_mode: OperationMode, eco_mode_power=100, eco_mode_soc=100,
+                             source='default', priority=MODE_DEFAULT_PRIORITY, force=False):
+    """
+    Request the operation mode through the shared ModeWriter, see ModeWriter.submit.
 
-    curr_operation_mode = await inverter.get_operation_mode()
-    if operation_mode != curr_operation_mode:
-        logging.info(f'Setting operation mode {operation_mode} from {curr_operation_mode}')
-        await inverter.set_operation_mode(operation_mode)
+    :param inverter_ip_address: IP address of the inverter
+    :param operation_mode: goodwe.OperationMode to set
+    :param eco_mode_power: Charge/discharge power in % of the nominal power, only for ECO_CHARGE/ECO_DISCHARGE
+    :param eco_mode_soc: SoC (%) at which ECO_CHARGE/ECO_DISCHARGE stops charging/discharging
+    :param source: Name of the requesting controller
+    :param priority: Priority of the request, lower wins
+    :param force: Write immediately, ignoring the minimum dwell time
+    :return: goodwe.OperationMode active on the inverter
+    """
+    return await get_mode_writer(inverter_ip_address).submit(source, operation_mode, priority, eco_mode_power,
+                                                             eco_mode_soc, force)
 
 
 async def example(inverter_ip_address):
-    inverter = await goodwe.connect(inverter_ip_address)
-    runtime_data = await inverter.read_runtime_data()
+    client = get_inverter_client(inverter_ip_address)
+    runtime_data = await client.read_runtime_data()
 
-    for sensor in inverter.sensors():
+    for sensor in client.inverter.sensors():
         if sensor.id_ in runtime_data:
             logging.info(f"{sensor.id_}: \t\t {sensor.name} = {runtime_data[sensor.id_]} {sensor.unit}")
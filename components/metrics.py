@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+# Upper bounds (seconds) of the latency histogram buckets, from fast local requests to slow retried ones
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    """
+    Base class of a metric with optional labels, every combination of label values is a separate series.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        :param name: Metric name, e.g. inverter_request_seconds
+        :param documentation: Help text
+        :param labels: Names of the labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {}  # Values keyed by the tuple of label values
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def samples(self):
+        """
+        :return: list of (name, label string, value) tuples
+        """
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(f'{self.name}_total', self._format_labels(key), value) for key, value in self.series.items()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[self._key(labels)] = value
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, self._format_labels(key), value) for key, value in self.series.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: Sorted upper bounds of the buckets, +Inf is added automatically
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0., 0]  # bucket counts, sum, count
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the block, also when it raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    samples.append((f'{self.name}_bucket', self._format_labels(key, [('le', _format_value(bound))]),
+                                    cumulative))
+                samples.append((f'{self.name}_sum', self._format_labels(key), total))
+                samples.append((f'{self.name}_count', self._format_labels(key), count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Process-wide collection of metrics rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} is already registered as {metric.type}.')
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+registry = MetricsRegistry()
+
+# Metrics of the I/O with the devices and services
+INVERTER_REQUEST_SECONDS = registry.histogram('inverter_request_seconds', 'Duration of requests to the inverter.',
+                                              ('operation',))
+INVERTER_RECONNECTS = registry.counter('inverter_reconnects', 'Connections (goodwe.connect) to the inverter.')
+INVERTER_RETRIES = registry.counter('inverter_retries', 'Failed attempts of inverter requests.', ('operation',))
+INVERTER_MODE_SWITCHES = registry.counter('inverter_mode_switches', 'Changes of the inverter operation mode.',
+                                          ('mode',))
+INVERTER_MODE_WRITES_SKIPPED = registry.counter('inverter_mode_writes_skipped',
+                                                'Mode requests matching the known mode, not sent to the inverter.')
+INVERTER_MODE_WRITES_DEFERRED = registry.counter('inverter_mode_writes_deferred',
+                                                 'Mode changes postponed by the minimum dwell time.')
+OTE_REQUEST_SECONDS = registry.histogram('ote_request_seconds', 'Duration of downloading and parsing OTE prices.')
+OTE_FAILURES = registry.counter('ote_failures', 'Failed downloads of OTE prices.')
+TAPO_REQUEST_SECONDS = registry.histogram('tapo_request_seconds', 'Duration of Tapo plug operations.',
+                                          ('operation',))
+TAPO_LOGINS = registry.counter('tapo_logins', 'Handshakes and logins to Tapo plugs.')
+TAPO_RETRIES = registry.counter('tapo_retries', 'Failed attempts of Tapo plug operations.', ('operation',))
+EVCC_REQUEST_SECONDS = registry.histogram('evcc_request_seconds', 'Duration of requests to the evcc API.',
+                                          ('endpoint',))
+EVCC_FAILURES = registry.counter('evcc_failures', 'Failed requests to the evcc API.')
+
+# Metrics of the control loops
+TASK_LOOP_SECONDS = registry.gauge('task_loop_seconds', 'Duration of the last iteration of the task without waiting.',
+                                   ('task',))
+TASK_ITERATIONS = registry.counter('task_iterations', 'Iterations of the task loops.', ('task',))
+
+
+def observe_loop(task, started):
+    """
+    Record an iteration of the task loop.
+
+    :param task: Name of the task, e.g. 'battery'
+    :param started: time.perf_counter() at the beginning of the iteration
+    """
+    TASK_LOOP_SECONDS.set(time.perf_counter() - started, task=task)
+    TASK_ITERATIONS.inc(task=task)
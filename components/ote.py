@@ -5,49 +5,400 @@
 # Author: Jan Profant <jan@konversation.ai>
 # All Rights Reserved
 
+import concurrent.futures
+import contextlib
+import datetime
+import html
+import json
 import logging
-import sys
+import re
+import sqlite3
+import threading
 import time
+from pathlib import Path
+from zoneinfo import ZoneInfo
 
-import lxml.html
 import requests
+from requests.adapters import HTTPAdapter
 
 import numpy as np
 from scipy.signal import argrelmin, argrelmax
 
+from . import setting_path
+from .metrics import OTE_FAILURES, OTE_REQUEST_SECONDS
+
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
 OTE_CR_PAGE = 'https://www.ote-cr.cz/cs/kratkodobe-trhy/elektrina/denni-trh?date='
-OTE_ATTEMPTS = 10
-
-def get_prices(day, weights=(1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0.9, 0.8, 0.75, 0.75, 0.8, 0.95, 1, 1, 1, 1, 1, 1, 1)):
-    url = f'{OTE_CR_PAGE}{day}'
-    response = requests.get(url)
-    tree = lxml.html.fromstring(response.text)
-    table = tree.cssselect('table.report_table')
-    assert len(table) == 2
-    table = table[1]
-    rows = table.cssselect('tbody > tr')
-    assert len(rows) == 26 or len(rows) == 25, len(rows)
-    rows = rows[:24]
-    for idx, row in enumerate(rows):
-        cols = row.cssselect('td')
-        if len(cols) == 5:
-            yield float(cols[0].text_content().replace(' ', '').replace(',', '.')) * weights[idx]
+OTE_RETRY_SECONDS = 60  # Wait before the next attempt to download the prices of the current day
+OTE_TIMEOUT = 30  # Timeout of a single request to OTE (seconds)
+OTE_PUBLISH_HOUR = 14  # Local hour after which OTE usually publishes the prices for the next day
+PRICE_STORE_PATH = Path(__file__).resolve().parent.parent / 'ote_prices.sqlite3'
+OTE_TIMEZONE = ZoneInfo('Europe/Prague')  # OTE trading days follow the Czech local time
+RESOLUTIONS = (60, 15)  # Supported lengths of a price slot in minutes
+PRICE_COLUMNS = 5  # Cells of a price row of the report table - price, volume, balance, export and import
+SUMMARY_ROWS = (1, 2)  # Possible numbers of the summary rows following the price rows
+PREFETCH_RETRY_SECONDS = 600  # Wait before the next attempt to prefetch prices which were not published yet
+BACKFILL_WORKERS = 4  # Concurrent downloads of the backfill, OTE is a public service
+REPORT_TABLE = re.compile(r'<table\b[^>]*\bclass=["\'][^"\']*\breport_table\b[^>]*>', re.IGNORECASE)
+HTML_TAG = re.compile(r'<[^>]*>')
+# Errors of a failed download or of a page without the expected prices
+OTE_ERRORS = (AssertionError, ValueError, requests.RequestException)
+DEFAULT_WEIGHTS = (1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0.9, 0.8, 0.75, 0.75, 0.8, 0.95, 1, 1, 1, 1, 1, 1, 1)
+
+
+class PriceSeries:
+    """
+    Day-ahead prices of a single trading day as timestamped slots of 60 or 15 minutes.
+
+    The number of slots follows the real length of the day, i.e. DST days have 23 or 25 hours.
+    """
+
+    def __init__(self, day, prices, resolution=None):
+        """
+        :param day: Date string in format YYYY-MM-DD
+        :param prices: Price of every slot of the day
+        :param resolution: Length of a slot in minutes, inferred from the number of prices when None
+        """
+        self.day = day
+        self.prices = np.asarray(prices, dtype=float)
+        self.hours = day_length_hours(day)
+        if resolution is None:
+            resolution = next((r for r in RESOLUTIONS if len(self.prices) == self.hours * 60 // r), None)
+        if resolution not in RESOLUTIONS or len(self.prices) != self.hours * 60 // resolution:
+            raise ValueError(f'{len(self.prices)} prices do not match a {self.hours} hours long day {day}.')
+        self.resolution = resolution
+        self.start = day_start(day)
+        self.slot = datetime.timedelta(minutes=resolution)
+
+    @property
+    def slots_per_hour(self):
+        return 60 // self.resolution
+
+    def __len__(self):
+        return len(self.prices)
+
+    def __getitem__(self, item):
+        return self.prices[item]
+
+    def __iter__(self):
+        return iter(self.prices.tolist())
+
+    def __array__(self, dtype=None):
+        return self.prices if dtype is None else self.prices.astype(dtype)
+
+    def __repr__(self):
+        return f'PriceSeries({self.day}, {self.resolution} min, {self.prices.tolist()})'
+
+    def slot_start(self, slot):
+        """
+        :return: Timezone aware local datetime of the beginning of the slot
+        """
+        return (self.start.astimezone(datetime.timezone.utc) + slot * self.slot).astimezone(OTE_TIMEZONE)
+
+    def index_at(self, moment=None):
+        """
+        Index of the slot containing the moment.
+
+        :param moment: datetime, naive values are considered system local time, defaults to now
+        :return: Slot index
+        """
+        moment = (moment or datetime.datetime.now()).astimezone(datetime.timezone.utc)
+        slot = int((moment - self.start.astimezone(datetime.timezone.utc)) // self.slot)
+        if not 0 <= slot < len(self):
+            raise IndexError(f'{moment} is outside of the trading day {self.day}.')
+        return slot
+
+    def local_hours(self):
+        """
+        :return: numpy array with the local clock hour (0-23) of the beginning of every slot
+        """
+        return np.array([self.slot_start(slot).hour for slot in range(len(self))])
+
+    def to_dict(self):
+        return {'day': self.day, 'resolution': self.resolution, 'prices': self.prices.tolist()}
+
+
+def day_start(day):
+    """
+    :param day: Date string in format YYYY-MM-DD
+    :return: Timezone aware local midnight of the day
+    """
+    return datetime.datetime.combine(datetime.date.fromisoformat(day), datetime.time(), tzinfo=OTE_TIMEZONE)
+
+
+def day_length_hours(day):
+    """
+    :param day: Date string in format YYYY-MM-DD
+    :return: Number of hours of the local day, 23 or 25 on DST changes, 24 otherwise
+    """
+    start = day_start(day)
+    end = datetime.datetime.combine(start.date() + datetime.timedelta(days=1), datetime.time(), tzinfo=OTE_TIMEZONE)
+    # Aware datetimes sharing a tzinfo are subtracted as wall times, compare them in UTC
+    utc = datetime.timezone.utc
+    return int((end.astimezone(utc) - start.astimezone(utc)).total_seconds() // 3600)
+
+
+class PricesUnavailableError(Exception):
+    """
+    Raised when the prices can not be obtained from the cache nor from OTE.
+    """
+
+
+class PriceStore:
+    """
+    Local SQLite store of OTE day-ahead prices keyed by date, so the prices are downloaded only once per day.
+    """
+
+    def __init__(self, path=PRICE_STORE_PATH):
+        """
+        :param path: Path to the SQLite database file
+        """
+        self.path = path
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS prices '
+                               '(day TEXT PRIMARY KEY, prices TEXT NOT NULL, fetched_at REAL NOT NULL)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Commits or rolls back the transaction and closes the connection, sqlite3 alone only does the former
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as connection, connection:
+            yield connection
+
+    def get(self, day):
+        """
+        :param day: Date string in format YYYY-MM-DD
+        :return: PriceSeries or None if the day is not stored
+        """
+        with self._connect() as connection:
+            row = connection.execute('SELECT prices FROM prices WHERE day = ?', (day,)).fetchone()
+        if row is None:
+            return None
+        stored = json.loads(row[0])
+        if isinstance(stored, list):  # Hourly prices stored before the resolution was recorded
+            return PriceSeries(day, stored, 60)
+        return PriceSeries(day, stored['prices'], stored['resolution'])
+
+    def put(self, series):
+        """
+        :param series: PriceSeries to store, replaces the stored prices of the same day
+        """
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO prices (day, prices, fetched_at) VALUES (?, ?, ?)',
+                               (series.day, json.dumps(series.to_dict()), time.time()))
+
+    def __contains__(self, day):
+        with self._connect() as connection:
+            return connection.execute('SELECT 1 FROM prices WHERE day = ?', (day,)).fetchone() is not None
+
+
+_price_store = None
+_price_store_lock = threading.Lock()
+_prefetch_retry_at = {}  # Days whose prefetch failed or runs, mapped to the time.monotonic() of the next attempt
+_prefetch_lock = threading.Lock()  # Guards _prefetch_retry_at, used by the tasks and the backfill threads
+
+
+def get_price_store():
+    """
+    Return the process-wide PriceStore, creating it on first use.
+    """
+    global _price_store
+    with _price_store_lock:
+        if _price_store is None:
+            _price_store = PriceStore(setting_path('PRICE_STORE_PATH', PRICE_STORE_PATH))
+        return _price_store
+
+
+def _cell_text(cell):
+    """
+    :param cell: HTML of a table cell from the end of its opening tag on
+    :return: Text of the cell without tags, entities and spaces
+    """
+    text = cell[cell.find('>') + 1:].split('</t', 1)[0]
+    if '<' in text:
+        text = HTML_TAG.sub('', text)
+    if '&' in text:
+        text = html.unescape(text)
+    return text.replace(' ', '').replace('\xa0', '').strip()
+
+
+def parse_prices(page):
+    """
+    Read the prices from the OTE day-ahead report page in a single pass over the price table.
+
+    The page has two report tables, the summary of the day and the results of every slot. Only the body of the second
+    one is scanned, its rows and cells are split on the tags without building a document tree. Every row is labelled
+    in its header cell, rows with PRICE_COLUMNS cells hold the price in the first one.
+
+    :param page: HTML of the report page
+    :return: tuple (list of row labels, list of prices) of all rows of the table body, the price is None in rows
+             with a different number of cells
+    """
+    starts = [match.end() for match in REPORT_TABLE.finditer(page)]
+    assert len(starts) == 2, f'Expected 2 report tables, found {len(starts)}'
+    end = page.find('</table>', starts[1])
+    table = page[starts[1]:end if end >= 0 else len(page)]
+    body = table.find('<tbody')
+    assert body >= 0, 'The price table has no body'
+    labels, prices = [], []
+    for row in table[body:].split('<tr')[1:]:
+        cells = row.split('<td')
+        header = cells[0].find('<th')
+        labels.append(_cell_text(cells[0][header:]) if header >= 0 else '')
+        prices.append(float(_cell_text(cells[1]).replace(',', '.')) if len(cells) == PRICE_COLUMNS + 1 else None)
+    return labels, prices
+
+
+def get_prices(day, weights=DEFAULT_WEIGHTS, session=None, base_url=OTE_CR_PAGE):
+    """
+    Download and parse the day-ahead prices of the day from OTE.
+
+    :param day: Date string in format YYYY-MM-DD
+    :param weights: Price multiplier for every local clock hour (0-23)
+    :param session: requests.Session reusing the connections, e.g. for downloads of many days
+    :param base_url: URL of the report page without the date, e.g. of a local mirror
+    :return: PriceSeries with hourly or 15 minute slots, depending on what OTE publishes
+    :raises AssertionError: When the page does not hold the prices of every slot of the day
+    """
+    url = f'{base_url}{day}'
+    response = (session or requests).get(url, timeout=OTE_TIMEOUT)
+    response.raise_for_status()
+    labels, prices = parse_prices(response.text)
+
+    # The price rows of all slots of the day are followed by the summary rows. The slots are labelled by their number
+    # or time interval, only counted here, the summary rows are labelled by words, e.g. Celkem
+    hours = day_length_hours(day)
+    slots = next((row for row, label in enumerate(labels) if not any(char.isdigit() for char in label)), len(labels))
+    assert slots in [hours * 60 // r for r in RESOLUTIONS] and len(labels) - slots in SUMMARY_ROWS, \
+        f'Expected {hours} hourly or {hours * 4} 15 minute slots followed by ' \
+        f'{" or ".join(map(str, SUMMARY_ROWS))} summary rows for {day}, got {slots} slots and ' \
+        f'{len(labels) - slots} other rows'
+    assert None not in prices[:slots], f'Missing price of slot {prices.index(None) + 1} for {day}'
+    series = PriceSeries(day, prices[:slots], hours * 60 // slots)
+    series.prices *= np.asarray(weights)[series.local_hours()]
+    return series
+
+
+def fetch_prices(day, session=None, base_url=OTE_CR_PAGE):
+    """
+    Download the prices of the day from OTE and store them in the local price store.
+
+    :param day: Date string in format YYYY-MM-DD
+    :param session: requests.Session reusing the connections
+    :param base_url: URL of the report page without the date
+    :return: PriceSeries
+    """
+    try:
+        with OTE_REQUEST_SECONDS.time():
+            series = get_prices(day, [1 for x in range(24)], session, base_url)
+    except Exception:
+        OTE_FAILURES.inc()
+        raise
+    get_price_store().put(series)
+    return series
+
+
+def backfill_prices(days, workers=BACKFILL_WORKERS, base_url=OTE_CR_PAGE, force=False):
+    """
+    Download the prices of many days concurrently and store them, e.g. the history for the simulation.
+    At most `workers` requests run at once, over connections kept alive by a shared session.
+
+    :param days: Iterable of date strings in format YYYY-MM-DD
+    :param workers: Number of concurrent downloads
+    :param base_url: URL of the report page without the date, e.g. of a local mirror
+    :param force: Download also the days which are already stored
+    :return: tuple (list of the stored days, dict mapping the failed days to their errors)
+    """
+    store = get_price_store()
+    days = [day for day in days if force or day not in store]
+    stored, failed = [], {}
+    if not days:
+        return stored, failed
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    with requests.Session() as session, \
+            concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='ote-backfill') as executor:
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        futures = {executor.submit(fetch_prices, day, session, base_url): day for day in days}
+        for future in concurrent.futures.as_completed(futures):
+            day = futures[future]
+            try:
+                future.result()
+            except OTE_ERRORS as e:
+                logging.info(f'Prices for {day} could not be downloaded: {e!r}')
+                failed[day] = e
+            else:
+                stored.append(day)
+    logging.info(f'Backfilled prices of {len(stored)} days, {len(failed)} failed.')
+    return sorted(stored), failed
+
+
+def prefetch_prices(day, now=None, retry_seconds=PREFETCH_RETRY_SECONDS):
+    """
+    Download the prices of the day unless they are already stored. Makes only a single attempt, the prices
+    for tomorrow might not be published yet, and after a failure waits `retry_seconds` before the next one.
+
+    :param day: Date string in format YYYY-MM-DD
+    :param now: Current time in seconds (time.monotonic), for the retry wait
+    :param retry_seconds: Wait after a failed attempt
+    :return: True if the prices are available in the store
+    """
+    if day in get_price_store():
+        return True
+    now = now if now is not None else time.monotonic()
+    with _prefetch_lock:
+        if now < _prefetch_retry_at.get(day, now):
+            return False
+        _prefetch_retry_at[day] = now + retry_seconds  # Concurrent callers do not download the day again
+    try:
+        fetch_prices(day)
+    except OTE_ERRORS as e:
+        logging.info(f'Prices for {day} are not available yet: {e!r}')
+        return False
+    with _prefetch_lock:
+        _prefetch_retry_at.pop(day, None)
+    logging.info(f'Prefetched prices for {day}.')
+    return True
+
+
+def prefetch_tomorrow(now=None):
+    """
+    Prefetch the prices for tomorrow once OTE is expected to have published them.
+
+    :param now: Current datetime, defaults to the current time in the OTE time zone
+    :return: True if tomorrow's prices are available in the store
+    """
+    now = now.astimezone(OTE_TIMEZONE) if now is not None else datetime.datetime.now(OTE_TIMEZONE)
+    if now.hour < OTE_PUBLISH_HOUR:
+        return False
+    return prefetch_prices((now.date() + datetime.timedelta(days=1)).strftime('%Y-%m-%d'))
+
+
+def analyse_prices(prices):
+    local_minima = list(argrelmin(np.asarray(prices))[0])
+    local_maxima = list(argrelmax(np.asarray(prices))[0])
+    gradients = np.gradient(prices)
+    return local_minima, local_maxima, gradients
+
 
 def get_current_prices(today):
-    for i in range(OTE_ATTEMPTS):
-        try:
-            prices = list(get_prices(today, [1 for x in range(24)]))
-            local_minima = list(argrelmin(np.array(prices))[0])
-            local_maxima = list(argrelmax(np.array(prices))[0])
-            gradients = np.gradient(prices)
-            logging.info(f'Prices for {today}: {prices} with local minima {local_minima} and local maxima {local_maxima}')
-            return prices, local_minima, local_maxima, gradients
-        except AssertionError as e:
-            logging.info(e)
-            time.sleep(60)
-    logging.info(f'Failed to get prices from OTE for {OTE_ATTEMPTS} attempts, probably an error occured.')
-    sys.exit(1)
\ No newline at end of file
+    """
+    Prices of the day with their local extrema and gradients, read from the price store or downloaded from OTE.
+    Never waits for OTE - a failed download is attempted again at the earliest OTE_RETRY_SECONDS later.
+
+    :param today: Date string in format YYYY-MM-DD
+    :return: tuple (PriceSeries, local minima indices, local maxima indices, gradients)
+    :raises PricesUnavailableError: When the prices are not stored and could not be downloaded
+    """
+    prices = get_price_store().get(today)
+    if prices is None and prefetch_prices(today, retry_seconds=OTE_RETRY_SECONDS):
+        prices = get_price_store().get(today)
+    if prices is None:
+        raise PricesUnavailableError(f'Prices for {today} are not available.')
+
+    local_minima, local_maxima, gradients = analyse_prices(prices)
+    logging.info(f'Prices for {today}: {prices} with local minima {local_minima} and local maxima {local_maxima}')
+    return prices, local_minima, local_maxima, gradients
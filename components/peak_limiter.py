@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import asyncio  # Library for running asynchronous operations
+import logging  # Module for logging
+import time  # Module to measure the duration of the loop
+
+from goodwe import OperationMode  # Import OperationMode enum from goodwe library
+from components.dispatcher import get_dispatcher  # Loads shed by the import limit
+from components.goodwe_utils import get_mode_writer  # Operation mode requests shared with the battery task
+from components.telemetry import get_sampler  # Shared inverter telemetry
+from components.status import get_status  # Latest state for the dashboard
+from components.metrics import observe_loop  # Loop duration metrics
+
+PEAK_LIMITER_MODE_PRIORITY = 1  # Priority of the operation mode requests, overrides the battery task
+NEAR_LIMIT_W = 2000  # Headroom below the limit (W) in which the telemetry is sampled at the fastest rate
+BATTERY_RELEASE_DELAY_SECONDS = 60  # How long the headroom has to cover the battery charging before it resumes
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+
+async def peak_limiter_task(config):
+    """
+    Task keeping the grid import under the limit, e.g. the main breaker or the contracted capacity.
+
+    The task follows every telemetry sample. The limit is enforced by the surplus dispatcher, which sheds or
+    throttles the loads in the reverse order of their priority (the car before the boiler by default) on the same
+    sample, the boiler and car tasks then switch them through Tapo and evcc. When the import stays over the limit
+    with the loads shed, the battery charging from the grid (ECO_CHARGE) is stopped until the headroom covers the
+    charging power again. Near the limit the telemetry is sampled at the fastest rate.
+
+    The settings are read from the live configuration. Used GeneralSettings fields:
+
+    - INVERTER_IP_ADDRESS: IP address of the inverter, read only at the start
+    - GRID_IMPORT_LIMIT_W: Maximum power imported from the grid in watts
+    - BATTERY_CHARGE_POWER_KW: Grid charging power of the inverter (kW), required headroom to resume charging
+
+    :param config: energy_flow.live_config.LiveConfig
+    """
+
+    logging.info("Peak limiter subroutine in progress...")
+
+    settings = config.snapshot()
+    inverter_ip_address = settings['INVERTER_IP_ADDRESS']
+    dispatcher = get_dispatcher(inverter_ip_address)  # Loads shared with the boiler and car tasks
+    dispatcher.set_import_limit(settings['GRID_IMPORT_LIMIT_W'])
+    sampler = get_sampler(inverter_ip_address)  # Telemetry shared with the other tasks
+    sampler.subscribe()
+    mode_writer = get_mode_writer(inverter_ip_address)
+    status = get_status()
+    last_seq = 0  # Sequence number of the last processed telemetry snapshot
+    battery_stopped = False  # True while the battery charging is stopped by the limiter
+    clear_since = None  # Timestamp since the headroom covers the battery charging
+
+    try:
+        while True:  # Main loop, running until the task is cancelled
+            snapshot = await sampler.next_snapshot(after_seq=last_seq)
+            started = time.perf_counter()
+            last_seq = snapshot.seq
+            if config.snapshot().version != settings.version:  # Apply changed settings
+                settings = config.snapshot()
+                dispatcher.set_import_limit(settings['GRID_IMPORT_LIMIT_W'])
+
+            dispatcher.allocate(snapshot)  # Sheds the loads over the limit, shared with the boiler and car tasks
+            headroom = dispatcher.headroom
+            if headroom is None:  # Grid power not available in this sample
+                continue
+            if headroom < NEAR_LIMIT_W:
+                sampler.scheduler.reset()  # Keep sampling at the fastest rate
+
+            if headroom < 0 and not battery_stopped and mode_writer.operation_mode == OperationMode.ECO_CHARGE:
+                logging.info(f'Grid import {settings["GRID_IMPORT_LIMIT_W"] - headroom} W over the limit, '
+                             f'stopping the battery charging.')
+                await mode_writer.submit('peak_limiter', OperationMode.GENERAL, PEAK_LIMITER_MODE_PRIORITY, force=True)
+                battery_stopped, clear_since = True, None
+            elif battery_stopped:
+                if headroom > settings['BATTERY_CHARGE_POWER_KW'] * 1000 + dispatcher.import_margin_w:
+                    clear_since = clear_since or snapshot.timestamp
+                    if snapshot.timestamp - clear_since >= BATTERY_RELEASE_DELAY_SECONDS:
+                        logging.info('Grid import is under the limit, the battery charging may resume.')
+                        await mode_writer.release('peak_limiter', force=False)
+                        battery_stopped = False
+                else:
+                    clear_since = None
+
+            status.update('peak_limiter', limit=settings['GRID_IMPORT_LIMIT_W'], headroom=headroom,
+                          battery_stopped=battery_stopped)
+            observe_loop('peak_limiter', started)
+    except asyncio.CancelledError:
+        logging.info('Peak limiter will stop now.')
+        if battery_stopped:
+            await mode_writer.release('peak_limiter', force=False)
+        raise
+    finally:
+        dispatcher.set_import_limit(None)
+        status.clear('peak_limiter')
+        sampler.unsubscribe()
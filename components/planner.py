@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import numpy as np
+
+PLAN_MIN_LEVEL = 10  # Battery level (%) the house load is never allowed to discharge the battery below
+PLAN_DRIFT_TOLERANCE = 5  # Difference (%) between the planned and real battery level triggering a new plan
+
+
+class ChargePlan:
+    """
+    Minimum-cost charge/idle schedule of the battery over the price horizon.
+    """
+
+    def __init__(self, starts, end, charge, levels, cost):
+        """
+        :param starts: numpy array with the UTC timestamps of the beginning of every slot
+        :param end: UTC timestamp of the end of the last slot
+        :param charge: numpy bool array, True for the slots in which the battery charges from the grid
+        :param levels: numpy array with the planned battery level (%) at the beginning of every slot and at the end
+        :param cost: Expected cost of the grid energy over the horizon (EUR)
+        """
+        self.starts = starts
+        self.end = end
+        self.charge = charge
+        self.levels = levels
+        self.cost = cost
+
+    def __len__(self):
+        return len(self.charge)
+
+    def index_at(self, moment):
+        """
+        :param moment: Timezone aware datetime
+        :return: Index of the slot containing the moment or None when it is outside of the plan
+        """
+        timestamp = moment.timestamp()
+        slot = int(np.searchsorted(self.starts, timestamp, side='right')) - 1
+        return slot if 0 <= slot < len(self) and timestamp < self.end else None
+
+    def expected_level(self, moment):
+        """
+        Planned battery level at the moment, interpolated within the slot.
+
+        :param moment: Timezone aware datetime inside of the plan
+        """
+        slot = self.index_at(moment)
+        end = self.starts[slot + 1] if slot + 1 < len(self) else self.end
+        progress = (moment.timestamp() - self.starts[slot]) / (end - self.starts[slot])
+        return self.levels[slot] + (self.levels[slot + 1] - self.levels[slot]) * progress
+
+    def as_rows(self):
+        """
+        :return: list of dicts, one per slot, e.g. for displaying the plan in the UI
+        """
+        return [{'start': float(self.starts[slot]),
+                 'charge': bool(self.charge[slot]),
+                 'level': float(self.levels[slot])}
+                for slot in range(len(self))]
+
+    def drifted(self, moment, battery_level, tolerance=PLAN_DRIFT_TOLERANCE):
+        """
+        :return: True if the real battery level differs from the planned one more than the tolerance
+        """
+        return abs(battery_level - self.expected_level(moment)) > tolerance
+
+
+def price_horizon(series, moment):
+    """
+    Concatenate consecutive PriceSeries into a single horizon starting with the slot containing the moment.
+
+    :param series: list of ote.PriceSeries ordered by day, e.g. today and tomorrow
+    :param moment: Timezone aware datetime
+    :return: tuple (prices, slot hours, slot start timestamps) as numpy arrays
+    """
+    prices, slot_hours, starts = [], [], []
+    for i, day in enumerate(series):
+        first = day.index_at(moment) if i == 0 else 0
+        for slot in range(first, len(day)):
+            prices.append(day[slot])
+            slot_hours.append(day.resolution / 60)
+            starts.append(day.slot_start(slot).timestamp())
+    return np.array(prices), np.array(slot_hours), np.array(starts)
+
+
+def plan_charge_schedule(prices, slot_hours, battery_level, capacity_kwh, charge_power_kw, upper_level,
+                         min_level=PLAN_MIN_LEVEL, net_load_kwh=None, terminal_price=None, starts=None):
+    """
+    Compute the minimum-cost charge/idle schedule by dynamic programming over the battery level in 1% steps.
+
+    In every slot the battery either idles or charges from the grid with `charge_power_kw` up to `upper_level`.
+    The net house load (consumption minus PV) is served from the battery down to `min_level`, the rest is
+    bought from the grid, while PV surplus charges the battery for free. Energy left in the battery at the end
+    of the horizon is valued at `terminal_price`, so the plan only buys energy cheaper than its later use.
+
+    :param prices: numpy array of prices (EUR/MWh) per slot
+    :param slot_hours: numpy array with the length of every slot in hours
+    :param battery_level: Current battery level (%)
+    :param capacity_kwh: Usable battery capacity (kWh)
+    :param charge_power_kw: Grid charging power of the inverter (kW)
+    :param upper_level: Battery level (%) above which the battery is not charged from the grid
+    :param min_level: Battery level (%) the house load does not discharge the battery below
+    :param net_load_kwh: numpy array with the expected consumption minus PV per slot (kWh), zeros by default
+    :param terminal_price: Value (EUR/MWh) of the energy left at the end, mean price of the horizon by default
+    :param starts: numpy array with the UTC timestamps of the slot beginnings, hourly from 0 by default
+    :return: ChargePlan
+    """
+    prices = np.asarray(prices, dtype=float) / 1000  # EUR/kWh
+    slot_hours = np.asarray(slot_hours, dtype=float)
+    n = len(prices)
+    net_load_kwh = np.zeros(n) if net_load_kwh is None else np.asarray(net_load_kwh, dtype=float)
+    terminal_price = np.mean(prices) if terminal_price is None else terminal_price / 1000
+    kwh_per_level = capacity_kwh / 100
+
+    levels = np.arange(101)
+    upper_level = int(min(100, max(0, upper_level)))
+    min_level = int(min(100, max(0, min_level)))
+
+    # Net load in whole battery levels, negative for PV surplus. The remainders are carried forward, so the slots
+    # below 1% of the capacity add up over the horizon instead of being dropped one by one.
+    level_loads = np.diff(np.rint(np.concatenate([[0.], np.cumsum(net_load_kwh / kwh_per_level)]))).astype(int)
+
+    # value[s] is the minimum cost from the slot to the end of the horizon starting with battery level s
+    value = -terminal_price * kwh_per_level * levels
+    next_levels = np.zeros((n, 2, 101), dtype=int)  # Battery level after the slot for idle (0) and charge (1)
+    grid_costs = np.zeros((n, 2, 101))  # Cost of the grid energy bought in the slot
+    best = np.zeros((n, 101), dtype=int)  # Optimal action per slot and battery level
+    for t in range(n - 1, -1, -1):
+        step = max(1, int(round(charge_power_kw * slot_hours[t] / kwh_per_level)))
+        load = level_loads[t]
+        for action in (0, 1):
+            charged = np.maximum(levels, np.minimum(levels + step * action, upper_level))
+            grid = (charged - levels) * kwh_per_level
+            if load >= 0:
+                drawn = np.minimum(np.maximum(charged - min_level, 0), load)
+                after = charged - drawn
+                grid = grid + (load - drawn) * kwh_per_level
+            else:
+                after = np.minimum(100, charged - load)
+            next_levels[t, action] = after
+            grid_costs[t, action] = prices[t] * grid
+        costs = grid_costs[t] + value[next_levels[t]]
+        best[t] = np.argmin(costs, axis=0)  # Prefers idling when both actions cost the same
+        value = costs[best[t], levels]
+
+    charge = np.zeros(n, dtype=bool)
+    planned = np.zeros(n + 1)
+    cost = 0.
+    level = int(round(min(100, max(0, battery_level))))
+    for t in range(n):
+        planned[t] = level
+        action = best[t, level]
+        charge[t] = action == 1
+        cost += grid_costs[t, action, level]
+        level = next_levels[t, action, level]
+    planned[n] = level
+    if starts is None:
+        starts = np.concatenate([[0.], np.cumsum(slot_hours[:-1] * 3600)])
+    starts = np.asarray(starts, dtype=float)
+    return ChargePlan(starts, starts[-1] + slot_hours[-1] * 3600, charge, planned, cost)
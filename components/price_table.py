@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import argrelmin, argrelmax
+
+
+class PriceDecisionTable:
+    """
+    Per-slot analysis of the day-ahead prices computed once per day.
+
+    Holds the price ranks, local extrema flags, forward-window minima and threshold masks, so the charging
+    decision for a slot is a constant time lookup. The table is also suitable for displaying in the UI.
+    """
+
+    def __init__(self, prices, charge_threshold_eur, max_charge_hours_key, local_extreme_hours_window, charge_hours,
+                 slots_per_hour=1, sell_threshold_eur=np.inf):
+        """
+        :param prices: Prices of the day, one per slot (list or ote.PriceSeries)
+        :param charge_threshold_eur: Price threshold below which charging should occur
+        :param max_charge_hours_key: Number of the cheapest hours considered for the charge hours policy
+        :param local_extreme_hours_window: Number of following hours the local minimum has to be cheaper than
+        :param charge_hours: dict mapping the price rank in hours to the battery level above which the battery charges
+        :param slots_per_hour: Number of price slots per hour, 1 for hourly and 4 for 15 minute prices
+        :param sell_threshold_eur: Minimum price at which the battery is discharged to the grid
+        """
+        self.prices = np.asarray(prices, dtype=float)
+        self.slots_per_hour = slots_per_hour
+        n = len(self.prices)
+        local_extreme_window = local_extreme_hours_window * slots_per_hour
+
+        # Rank of each price among the prices of the day, equal prices share the lowest rank
+        self.ranks = np.searchsorted(np.sort(self.prices), self.prices, side='left')
+
+        self.local_minima = np.zeros(n, dtype=bool)
+        self.local_minima[argrelmin(self.prices)[0]] = True
+        self.local_maxima = np.zeros(n, dtype=bool)
+        self.local_maxima[argrelmax(self.prices)[0]] = True
+        self.gradients = np.gradient(self.prices) if n > 1 else np.zeros(n)
+
+        # Minimum of the prices in the following window, inf when there are none
+        if local_extreme_window > 0:
+            padded = np.concatenate([self.prices[1:], np.full(local_extreme_window, np.inf)])
+            self.forward_minima = sliding_window_view(padded, local_extreme_window)[:n].min(axis=1)
+        else:
+            self.forward_minima = np.full(n, np.inf)
+
+        self.below_threshold = self.prices < charge_threshold_eur
+        self.local_minimum_charge = self.local_minima & (self.prices < self.forward_minima)
+
+        # Battery level which has to be exceeded to charge by the charge hours policy, inf disables it
+        hour_ranks = self.ranks // slots_per_hour
+        rank_levels = np.array([charge_hours.get(rank, np.inf) for rank in range(n)], dtype=float)
+        self.required_battery_level = np.where(hour_ranks < max_charge_hours_key, rank_levels[hour_ranks], np.inf)
+
+        # Slots where charging does not depend on the battery level
+        self.always_charge = self.below_threshold | self.local_minimum_charge
+
+        # Discharge windows - contiguous runs of slots above the sell threshold containing a local maximum
+        self.above_sell_threshold = self.prices >= sell_threshold_eur
+        self.sell_windows = []
+        self.sell_window_index = np.full(n, -1)  # Index into sell_windows for every slot, -1 outside of windows
+        for peak in np.flatnonzero(self.local_maxima & self.above_sell_threshold):
+            if self.sell_window_index[peak] >= 0:
+                continue  # Several maxima can share the same window
+            start, end = peak, peak + 1
+            while start > 0 and self.above_sell_threshold[start - 1]:
+                start -= 1
+            while end < n and self.above_sell_threshold[end]:
+                end += 1
+            self.sell_window_index[start:end] = len(self.sell_windows)
+            self.sell_windows.append((int(start), int(end)))
+
+    def __len__(self):
+        return len(self.prices)
+
+    def should_charge(self, slot, battery_level):
+        """
+        :param slot: Index of the price slot
+        :param battery_level: Current battery level (%)
+        :return: True if the battery should be charged from the grid in the slot
+        """
+        return bool(self.always_charge[slot] or battery_level > self.required_battery_level[slot])
+
+    def sell_window_at(self, slot):
+        """
+        :param slot: Index of the price slot
+        :return: Index of the discharge window containing the slot or None
+        """
+        window = self.sell_window_index[slot]
+        return int(window) if window >= 0 else None
+
+    def as_rows(self):
+        """
+        :return: list of dicts, one per slot, e.g. for displaying the table in the UI
+        """
+        return [{'slot': slot,
+                 'price': float(self.prices[slot]),
+                 'rank': int(self.ranks[slot]),
+                 'local_minimum': bool(self.local_minima[slot]),
+                 'local_maximum': bool(self.local_maxima[slot]),
+                 'gradient': float(self.gradients[slot]),
+                 'forward_minimum': float(self.forward_minima[slot]),
+                 'below_threshold': bool(self.below_threshold[slot]),
+                 'required_battery_level': float(self.required_battery_level[slot]),
+                 'sell_window': self.sell_window_at(slot)}
+                for slot in range(len(self))]
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import bisect
+import collections
+import math
+
+EWMA_ALPHA = 0.3  # Default smoothing factor of the exponentially weighted moving average
+STATISTICS = ('mean', 'ewma', 'median', 'min', 'max')  # Named statistics, percentiles are written as 'p90' etc.
+
+
+class WindowedStatistics:
+    """
+    Incrementally updated statistics over a sliding window of the latest values.
+
+    Pushing a value costs O(window) in the worst case (sorted insert/remove), every statistic is then
+    available in O(1), so several readers can query the window without recomputing it.
+    """
+
+    def __init__(self, window, alpha=EWMA_ALPHA):
+        """
+        :param window: Number of latest values kept in the window
+        :param alpha: Smoothing factor of the EWMA, 0 < alpha <= 1
+        """
+        assert window > 0 and 0 < alpha <= 1
+        self.window = window
+        self.alpha = alpha
+        self.values = collections.deque()  # Values in arrival order
+        self.sorted_values = []  # The same values kept sorted, for median and percentiles
+        self.total = 0.
+        self.ewma = None
+
+    def push(self, value):
+        """
+        Add a new value, dropping the oldest one when the window is full. None values are ignored.
+        """
+        if value is None:
+            return
+        value = float(value)
+        if len(self.values) == self.window:
+            oldest = self.values.popleft()
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, oldest)]
+            self.total -= oldest
+        self.values.append(value)
+        bisect.insort(self.sorted_values, value)
+        self.total += value
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def mean(self):
+        return self.total / len(self.values) if self.values else None
+
+    @property
+    def median(self):
+        return self.percentile(50)
+
+    @property
+    def min(self):
+        return self.sorted_values[0] if self.sorted_values else None
+
+    @property
+    def max(self):
+        return self.sorted_values[-1] if self.sorted_values else None
+
+    def percentile(self, q):
+        """
+        Percentile of the window with linear interpolation (same as numpy.percentile default).
+
+        :param q: Percentile in range 0-100
+        """
+        if not self.sorted_values:
+            return None
+        position = (len(self.sorted_values) - 1) * q / 100
+        lower, upper = math.floor(position), math.ceil(position)
+        return self.sorted_values[lower] + (self.sorted_values[upper] - self.sorted_values[lower]) * (position - lower)
+
+    def get(self, statistic):
+        """
+        Value of a statistic given by its name, e.g. 'mean', 'ewma', 'median' or 'p90'.
+        """
+        if statistic.startswith('p') and statistic[1:].isdigit():
+            return self.percentile(int(statistic[1:]))
+        if statistic not in STATISTICS:
+            raise ValueError(f'Unknown statistic {statistic}, use one of {STATISTICS} or a percentile like p90.')
+        return getattr(self, statistic)
+
+    def summary(self):
+        """
+        :return: dict with all named statistics of the window
+        """
+        return {statistic: self.get(statistic) for statistic in STATISTICS}
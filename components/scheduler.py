@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import logging
+import time
+
+from .metrics import registry
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+SLOT_MINUTES = 15  # Length of a price slot, hourly slots start on the same boundaries
+BOUNDARY_WINDOW_SECONDS = 60  # Time before a slot boundary in which the controllers tick at the fastest rate
+BOUNDARY_DELAY_SECONDS = 1  # Wake up this long after the slot boundary, so the new slot is already active
+BACKOFF_FACTOR = 1.5  # Growth of the interval per tick with stable inputs
+
+TICK_INTERVAL_SECONDS = registry.gauge('tick_interval_seconds', 'Current tick interval of the controller.', ('task',))
+
+
+def seconds_to_boundary(timestamp, slot_minutes=SLOT_MINUTES):
+    """
+    Seconds until the beginning of the next price slot. The slots start at multiples of `slot_minutes` of the
+    local time, which equal multiples of the UTC time for whole-hour UTC offsets.
+
+    :param timestamp: Unix timestamp
+    :param slot_minutes: Length of a slot in minutes
+    :return: Seconds in (0, slot_minutes * 60]
+    """
+    slot_seconds = slot_minutes * 60
+    return slot_seconds - timestamp % slot_seconds
+
+
+class AdaptiveScheduler:
+    """
+    Tick rate of a controller derived from how fast its input changes.
+
+    A change of the input above `busy_change` switches to `min_interval` right away, while stable inputs (below
+    `stable_change`) grow the interval by BACKOFF_FACTOR per tick up to `max_interval`. Shortly before a price slot
+    boundary the controller ticks at the fastest rate, and a tick never skips a boundary - the controller wakes
+    up right after it.
+    """
+
+    def __init__(self, name, min_interval, max_interval, stable_change, busy_change, slot_minutes=SLOT_MINUTES):
+        """
+        :param name: Name of the controller in the metrics, e.g. 'battery'
+        :param min_interval: Fastest tick interval in seconds
+        :param max_interval: Slowest tick interval in seconds
+        :param stable_change: Change of the input per tick considered stable, in units of the input
+        :param busy_change: Change of the input per tick considered fast, in units of the input
+        :param slot_minutes: Length of a price slot in minutes, None ignores the slot boundaries
+        """
+        assert 0 < min_interval <= max_interval and stable_change <= busy_change
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stable_change = stable_change
+        self.busy_change = busy_change
+        self.slot_minutes = slot_minutes
+        self.interval = min_interval
+        self.last_value = None
+
+    def update(self, value, timestamp=None):
+        """
+        Feed the latest value of the input and get the time to the next tick.
+
+        :param value: Latest value of the input, e.g. the PV surplus in W, None if it could not be read
+        :param timestamp: Unix timestamp of the value, defaults to now
+        :return: Seconds to sleep before the next tick
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if value is None or self.last_value is None:
+            change = None  # Unknown, keep the current rate
+        else:
+            change = abs(value - self.last_value)
+        if value is not None:
+            self.last_value = value
+
+        if change is not None and change >= self.busy_change:
+            self.interval = self.min_interval
+        elif change is not None and change <= self.stable_change:
+            self.interval = min(self.interval * BACKOFF_FACTOR, self.max_interval)
+
+        sleep_for = self.interval
+        if self.slot_minutes is not None:
+            to_boundary = seconds_to_boundary(timestamp, self.slot_minutes)
+            if to_boundary <= BOUNDARY_WINDOW_SECONDS:
+                sleep_for = min(sleep_for, self.min_interval)
+            sleep_for = min(sleep_for, to_boundary + BOUNDARY_DELAY_SECONDS)
+        TICK_INTERVAL_SECONDS.set(sleep_for, task=self.name)
+        return sleep_for
+
+    def reset(self):
+        """
+        Return to the fastest rate, e.g. after the settings changed.
+        """
+        self.interval = self.min_interval
+        self.last_value = None
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import csv
+import datetime
+import logging
+
+import numpy as np
+from goodwe import OperationMode
+
+from .battery import BatteryController
+from .boiler import boiler_load
+from .car import SurplusTracker, ONE_AMP
+from .dispatcher import SurplusDispatcher
+from .goodwe_utils import MODE_MIN_DWELL_SECONDS  # Same dwell time as the ModeWriter
+from .ote import PriceSeries, day_length_hours, get_price_store, OTE_PUBLISH_HOUR, OTE_TIMEZONE
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+STEP_MINUTES = 5  # Default length of a simulation step
+BATTERY_MIN_LEVEL = 10  # Battery level (%) the inverter never discharges below, its depth of discharge
+
+
+class SimulatedInverter:
+    """
+    Inverter with a battery, following the GoodWe operation modes used by the controllers.
+    """
+
+    def __init__(self, capacity_kwh, charge_power_kw, battery_level=50., min_level=BATTERY_MIN_LEVEL,
+                 min_dwell_seconds=MODE_MIN_DWELL_SECONDS):
+        """
+        :param capacity_kwh: Usable battery capacity (kWh)
+        :param charge_power_kw: Maximum charge/discharge power of the battery (kW)
+        :param battery_level: Initial battery level (%)
+        :param min_level: Battery level (%) the battery is never discharged below
+        :param min_dwell_seconds: Minimum time an operation mode is kept before it is changed again
+        """
+        self.capacity_kwh = capacity_kwh
+        self.charge_power_kw = charge_power_kw
+        self.battery_level = battery_level
+        self.min_level = min_level
+        self.min_dwell_seconds = min_dwell_seconds
+        self.operation_mode = OperationMode.GENERAL
+        self.eco_mode_soc = 100
+        self.changed_at = None  # Timestamp of the last mode change
+        self.mode_switches = 0
+        self.mode_changes_deferred = 0  # Mode changes postponed by the minimum dwell time
+
+    def set_operation_mode(self, operation_mode, eco_mode_soc=100, timestamp=None):
+        """
+        Change the operation mode. A change into ECO_CHARGE/ECO_DISCHARGE within `min_dwell_seconds` after the
+        previous one is postponed - the current mode is kept and the controller asks again on its next step. Like
+        in the ModeWriter, returning to the general mode is never postponed.
+
+        :param timestamp: UNIX time of the request, None ignores the dwell time
+        :return: goodwe.OperationMode in effect
+        """
+        if operation_mode != self.operation_mode:
+            if timestamp is not None and self.changed_at is not None and operation_mode != OperationMode.GENERAL \
+                    and timestamp - self.changed_at < self.min_dwell_seconds:
+                self.mode_changes_deferred += 1
+                return self.operation_mode
+            self.mode_switches += 1
+            self.changed_at = timestamp
+        self.operation_mode = operation_mode
+        self.eco_mode_soc = eco_mode_soc
+        return self.operation_mode
+
+    def step(self, hours, ppv, load):
+        """
+        Advance the battery by one step.
+
+        :param hours: Length of the step in hours
+        :param ppv: PV power (W)
+        :param load: House consumption including the controlled devices (W)
+        :return: Grid power (W), positive for import and negative for export
+        """
+        stored = self.battery_level / 100 * self.capacity_kwh
+        room = (self.capacity_kwh - stored) / hours * 1000  # Maximum charge power to fill the battery (W)
+        reserve = self.min_level / 100 * self.capacity_kwh
+        available = max(0., stored - reserve) / hours * 1000  # Maximum discharge power down to the minimum level (W)
+        power = self.charge_power_kw * 1000
+
+        if self.operation_mode == OperationMode.ECO_CHARGE:
+            limit = max(0., (self.eco_mode_soc / 100 * self.capacity_kwh - stored) / hours * 1000)
+            battery = min(power, room, limit)
+        elif self.operation_mode == OperationMode.ECO_DISCHARGE:
+            # The goodwe driver does not write the eco mode SoC of the discharge, only the next decision stops it
+            battery = -min(power, available)
+        elif ppv >= load:
+            battery = min(ppv - load, power, room)  # Self use - store the surplus
+        else:
+            battery = -min(load - ppv, power, available)  # Self use - cover the deficit
+
+        self.battery_level = min(100., max(0., self.battery_level + battery * hours / 1000 / self.capacity_kwh * 100))
+        return load - ppv + battery
+
+
+class SimulatedPlug:
+    """
+    Tapo plug switching the boiler.
+    """
+
+    def __init__(self):
+        self.on = False
+        self.switches = 0
+
+    def turn_on_off(self, on):
+        if on != self.on:
+            self.switches += 1
+        self.on = on
+
+
+class SimulatedEvcc:
+    """
+    Wallbox controlled through EVCC, the car is assumed to be plugged in and accepting any current.
+    """
+
+    def __init__(self, min_current_a, max_current_a):
+        self.min_current_a = min_current_a
+        self.max_current_a = max_current_a
+        self.enabled = False
+        self.current = min_current_a
+        self.switches = 0  # Number of enable/disable transitions
+        self.current_changes = 0
+
+    def apply(self, enabled, current=None):
+        if enabled != self.enabled:
+            self.switches += 1
+        self.enabled = enabled
+        if current is not None:
+            current = min(self.max_current_a, max(self.min_current_a, int(current)))
+            if current != self.current:
+                self.current_changes += 1
+            self.current = current
+
+    @property
+    def power(self):
+        return self.current * ONE_AMP if self.enabled else 0
+
+
+class Simulation:
+    """
+    Replay of price series and PV/consumption traces through the controllers' decision logic with simulated time.
+
+    The battery controller decides once per step. The battery task stops selling at the reserve on every telemetry
+    sample, steps longer than the sampling therefore discharge up to one step of energy below the reserve.
+    """
+
+    def __init__(self, timestamps, ppv, house_consumption, prices, settings, battery_level=50.,
+                 export_price_factor=0.):
+        """
+        :param timestamps: numpy array of UTC timestamps of equally long steps
+        :param ppv: numpy array of PV power per step (W)
+        :param house_consumption: numpy array of house consumption without boiler and car per step (W)
+        :param prices: dict mapping day (YYYY-MM-DD) to ote.PriceSeries
+        :param settings: dict with GeneralSettings field names and values, e.g. from django.forms.model_to_dict
+        :param battery_level: Initial battery level (%)
+        :param export_price_factor: Share of the spot price paid for exported energy
+        """
+        self.timestamps = np.asarray(timestamps, dtype=float)
+        self.ppv = np.asarray(ppv, dtype=float)
+        self.house_consumption = np.asarray(house_consumption, dtype=float)
+        self.prices = prices
+        self.settings = settings
+        self.export_price_factor = export_price_factor
+        self.step_hours = (self.timestamps[1] - self.timestamps[0]) / 3600 if len(self.timestamps) > 1 else 1.
+
+        self.inverter = SimulatedInverter(settings['BATTERY_CAPACITY_KWH'], settings['BATTERY_CHARGE_POWER_KW'],
+                                          battery_level)
+        self.plug = SimulatedPlug()
+        self.evcc = SimulatedEvcc(settings['MIN_CURRENT_A'], settings['MAX_CURRENT_A'])
+        self.dispatcher = SurplusDispatcher()
+        self.boiler = boiler_load(settings['BOJLER_CONSUMPTION'], settings['BOJLER_PRIORITY'])
+        self.car = SurplusTracker(settings['MIN_CURRENT_A'], settings['MAX_CURRENT_A'], settings['CAR_PRIORITY'])
+        if settings['BOJLER_ENABLED']:
+            self.dispatcher.register(self.boiler)
+        if settings['CAR_ENABLED']:
+            self.dispatcher.register(self.car)
+        self.battery = None
+        if settings['BATTERY_ENABLED']:
+            self.battery = BatteryController.from_settings(settings)
+
+    def run(self):
+        """
+        :return: dict with the energy cost and flows, self-consumption and device switching counts
+        """
+        settings = self.settings
+        grid_import, grid_export, cost = 0., 0., 0.
+        boiler_kwh, car_kwh = 0., 0.
+        last_day, series = None, None
+
+        for timestamp, ppv, base_load in zip(self.timestamps, self.ppv, self.house_consumption):
+            now = datetime.datetime.fromtimestamp(timestamp, OTE_TIMEZONE)
+            day = now.strftime('%Y-%m-%d')
+            if day != last_day:
+                series = self.prices[day]
+                if self.battery is not None:
+                    self.battery.update_prices(series)
+                last_day = day
+
+            # The controllers see the house consumption including the devices they control
+            load = base_load + (settings['BOJLER_CONSUMPTION'] if self.plug.on else 0) + self.evcc.power
+            battery_level = self.inverter.battery_level
+
+            if self.battery is not None:
+                tomorrow = None  # Tomorrow's prices are only known after they are published
+                if now.hour >= OTE_PUBLISH_HOUR:
+                    tomorrow = self.prices.get((now + datetime.timedelta(days=1)).strftime('%Y-%m-%d'))
+                self.inverter.set_operation_mode(*self.battery.decide(now, battery_level, tomorrow), timestamp)
+            allocation = self.dispatcher.dispatch(timestamp, ppv, load, battery_level)
+            if settings['BOJLER_ENABLED']:
+                self.plug.turn_on_off(allocation[self.boiler.name] > 0)
+            if settings['CAR_ENABLED']:
+                self.evcc.apply(self.car.enabled, self.car.current if self.car.enabled else None)
+
+            boiler = settings['BOJLER_CONSUMPTION'] if self.plug.on else 0
+            car = self.evcc.power
+            grid = self.inverter.step(self.step_hours, ppv, base_load + boiler + car)
+            price = series[series.index_at(now)] / 1000  # EUR/kWh
+            energy = grid * self.step_hours / 1000
+            if energy > 0:
+                grid_import += energy
+                cost += energy * price
+            else:
+                grid_export -= energy
+                cost += energy * price * self.export_price_factor
+            boiler_kwh += boiler * self.step_hours / 1000
+            car_kwh += car * self.step_hours / 1000
+
+        pv_kwh = float(self.ppv.sum() * self.step_hours / 1000)
+        return {
+            'steps': len(self.timestamps),
+            'cost_eur': cost,
+            'grid_import_kwh': grid_import,
+            'grid_export_kwh': grid_export,
+            'pv_kwh': pv_kwh,
+            'self_consumption': (pv_kwh - grid_export) / pv_kwh if pv_kwh else 0.,
+            'boiler_kwh': boiler_kwh,
+            'car_kwh': car_kwh,
+            'battery_level': self.inverter.battery_level,
+            'battery_mode_switches': self.inverter.mode_switches,
+            'battery_mode_changes_deferred': self.inverter.mode_changes_deferred,
+            'boiler_switches': self.plug.switches,
+            'car_switches': self.evcc.switches,
+            'car_current_changes': self.evcc.current_changes,
+        }
+
+
+def synthetic_traces(start_day, days, step_minutes=STEP_MINUTES, pv_peak_w=8000, base_load_w=400, seed=0):
+    """
+    Generate PV and house consumption traces with a seasonal PV profile, random cloudiness and evening load peaks.
+
+    :param start_day: datetime.date of the first day
+    :param days: Number of days
+    :param step_minutes: Length of a step in minutes
+    :param pv_peak_w: PV power at noon of a clear summer day (W)
+    :param base_load_w: Base house consumption (W)
+    :param seed: Seed of the random generator
+    :return: tuple (timestamps, ppv, house_consumption) as numpy arrays
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime.combine(start_day, datetime.time(), tzinfo=OTE_TIMEZONE).timestamp()
+    end = datetime.datetime.combine(start_day + datetime.timedelta(days=days), datetime.time(),
+                                    tzinfo=OTE_TIMEZONE).timestamp()
+    timestamps = np.arange(start, end, step_minutes * 60.)
+
+    day_of_year = (timestamps - start) / 86400 + start_day.timetuple().tm_yday
+    local = [datetime.datetime.fromtimestamp(t, OTE_TIMEZONE) for t in timestamps]
+    hour = np.array([moment.hour + moment.minute / 60 for moment in local])
+    season = 0.55 + 0.45 * np.cos(2 * np.pi * (day_of_year - 172) / 365)  # 1.0 at the summer solstice
+    day_length = 8 + 8 * season  # Hours of daylight
+    sun = np.clip(np.cos(np.pi * (hour - 12.5) / day_length), 0, None) * (np.abs(hour - 12.5) < day_length / 2)
+    clouds = np.repeat(rng.uniform(0.2, 1.0, days + 1), int(1440 / step_minutes))[:len(timestamps)]
+    ppv = pv_peak_w * season * sun * clouds * rng.uniform(0.85, 1.0, len(timestamps))
+
+    evening = np.exp(-((hour - 19) ** 2) / 4) * 1200 + np.exp(-((hour - 7) ** 2) / 2) * 600
+    house_consumption = base_load_w + evening + rng.exponential(150, len(timestamps))
+    return timestamps, ppv, house_consumption
+
+
+def synthetic_prices(day, seed=0):
+    """
+    Generate hourly day-ahead prices with morning and evening peaks and a midday dip.
+
+    :param day: Date string in format YYYY-MM-DD
+    :param seed: Seed of the random generator, combined with the date
+    :return: ote.PriceSeries
+    """
+    rng = np.random.default_rng([seed, datetime.date.fromisoformat(day).toordinal()])
+    hours = np.arange(day_length_hours(day))
+    shape = 90 + 50 * np.exp(-((hours - 8) ** 2) / 4) + 70 * np.exp(-((hours - 19) ** 2) / 4) \
+        - 40 * np.exp(-((hours - 13) ** 2) / 6)
+    return PriceSeries(day, shape * rng.uniform(0.7, 1.3) + rng.normal(0, 10, len(hours)))
+
+
+def load_prices(days, seed=0):
+    """
+    Prices for the days from the local price store, synthetic prices for the days missing there.
+
+    :param days: Iterable of date strings in format YYYY-MM-DD
+    :return: dict mapping day to ote.PriceSeries
+    """
+    store = get_price_store()
+    prices = {}
+    for day in days:
+        prices[day] = store.get(day) or synthetic_prices(day, seed)
+    return prices
+
+
+def load_traces(path):
+    """
+    Read recorded traces from a CSV file with columns timestamp (ISO format or UNIX time), ppv and
+    house_consumption in watts.
+
+    :return: tuple (timestamps, ppv, house_consumption) as numpy arrays
+    """
+    timestamps, ppv, house_consumption = [], [], []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            timestamp = row['timestamp']
+            try:
+                timestamps.append(float(timestamp))
+            except ValueError:
+                moment = datetime.datetime.fromisoformat(timestamp)
+                if moment.tzinfo is None:
+                    moment = moment.replace(tzinfo=OTE_TIMEZONE)
+                timestamps.append(moment.timestamp())
+            ppv.append(float(row['ppv']))
+            house_consumption.append(float(row['house_consumption']))
+    return np.array(timestamps), np.array(ppv), np.array(house_consumption)
+
+
+def simulate(timestamps, ppv, house_consumption, settings, prices=None, battery_level=50., export_price_factor=0.):
+    """
+    Run the simulation with logging of the controllers silenced.
+
+    :param prices: dict mapping day to ote.PriceSeries, loaded by `load_prices` when None
+    :return: Simulation report, see `Simulation.run`
+    """
+    if prices is None:
+        days = sorted({datetime.datetime.fromtimestamp(t, OTE_TIMEZONE).strftime('%Y-%m-%d') for t in timestamps})
+        last = datetime.date.fromisoformat(days[-1]) + datetime.timedelta(days=1)
+        prices = load_prices(days + [last.strftime('%Y-%m-%d')])
+    level = logging.root.manager.disable
+    logging.disable(logging.INFO)
+    try:
+        return Simulation(timestamps, ppv, house_consumption, prices, settings, battery_level,
+                          export_price_factor).run()
+    finally:
+        logging.disable(level)
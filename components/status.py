@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import asyncio
+import logging
+import threading
+import time
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+_status = None
+_status_lock = threading.Lock()
+
+
+class StatusCache:
+    """
+    In-memory cache of the latest state of the controllers for the dashboard.
+
+    The tasks publish what they already know (telemetry, operation mode, charge plan, device states) and any number
+    of dashboard clients read it, so the clients never cause additional requests to the devices.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # Notified with every update, for the waiting threads
+        self.sections = {}  # Latest values keyed by section name, e.g. 'telemetry' or 'boiler'
+        self.version = 0  # Incremented with every update
+        self.waiters = []  # (event loop, asyncio.Future) pairs of coroutines waiting for an update
+
+    def update(self, section, **values):
+        """
+        Merge the values into the section and wake up the waiting clients.
+
+        :param section: Name of the section, e.g. 'battery'
+        :param values: JSON serializable values
+        """
+        with self.lock:
+            self.sections.setdefault(section, {}).update(values, updated_at=time.time())
+            self._notify()
+
+    def clear(self, section):
+        """
+        Remove the section, e.g. when its task stops.
+        """
+        with self.lock:
+            if self.sections.pop(section, None) is not None:
+                self._notify()
+
+    def _notify(self):
+        self.version += 1
+        wake_waiters(self.waiters)
+        self.waiters = []
+        self.changed.notify_all()
+
+    def get(self):
+        """
+        :return: tuple (version, dict section -> values)
+        """
+        with self.lock:
+            return self.version, {section: dict(values) for section, values in self.sections.items()}
+
+    async def wait(self, after_version, timeout=None):
+        """
+        Wait until the version is newer than `after_version`.
+
+        :param after_version: Version of the last state seen by the caller
+        :param timeout: Maximum time to wait in seconds, None waits forever
+        :return: tuple (version, dict section -> values), the current one on timeout
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.version > after_version:
+                return self.version, {section: dict(values) for section, values in self.sections.items()}
+            waiter = loop.create_future()
+            self.waiters.append((loop, waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.lock:
+                discard_waiter(self.waiters, loop, waiter)
+        return self.get()
+
+    def wait_blocking(self, after_version, timeout=None):
+        """
+        Wait in the calling thread until the version is newer than `after_version`, e.g. in a WSGI worker.
+
+        :param after_version: Version of the last state seen by the caller
+        :param timeout: Maximum time to wait in seconds, None waits forever
+        :return: tuple (version, dict section -> values), the current one on timeout
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.version > after_version, timeout)
+            return self.version, {section: dict(values) for section, values in self.sections.items()}
+
+
+def _wake_waiter(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def wake_waiters(waiters):
+    """
+    Wake up coroutines waiting on other event loops, skipping the loops which were closed meanwhile.
+
+    :param waiters: Iterable of (event loop, asyncio.Future) pairs
+    """
+    for loop, waiter in waiters:
+        if loop.is_closed():
+            continue
+        try:
+            loop.call_soon_threadsafe(_wake_waiter, waiter)
+        except RuntimeError:  # Closed after the check
+            pass
+
+
+def discard_waiter(waiters, loop, waiter):
+    """
+    Remove the waiter when its wait ends without a wake up, e.g. on a timeout or cancellation.
+    """
+    try:
+        waiters.remove((loop, waiter))
+    except ValueError:  # Already woken up
+        pass
+
+
+def get_status():
+    """
+    Return the process-wide StatusCache, creating it on first use.
+    """
+    global _status
+    with _status_lock:
+        if _status is None:
+            _status = StatusCache()
+        return _status
@@ -5,32 +5,168 @@
 # Author: Jan Profant <jan@konversation.ai>
 # All Rights Reserved
 
+import asyncio
 import logging
+import threading
 import time
 
-from PyP100 import PyP110
+from .metrics import TAPO_LOGINS, TAPO_REQUEST_SECONDS, TAPO_RETRIES
 
 username = "YOUR_USERNAME"
 password = "YOUR_PASSWORD"
 
+TAPO_SESSION_TTL = 1800  # Seconds an authenticated session is reused before logging in again
+TAPO_ATTEMPTS = 4  # Number of attempts of a single operation
+TAPO_INITIAL_BACKOFF = 2  # Seconds to wait after the first failed attempt, doubled after every next one
+TAPO_MAX_BACKOFF = 30  # Maximum wait between two attempts in seconds
+
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
-def turn_on_off(on=True, ip_address=None):
-    for i in range(10):
-        try:
-            p110 = PyP110.P110(ip_address, username, password)  # Creating a P110 plug object
+_sessions = {}  # Shared sessions keyed by plug IP address
+_sessions_lock = threading.Lock()
+
+
+class TapoError(Exception):
+    pass
+
+
+class TapoSession:
+    """
+    Authenticated session with a Tapo P110 plug.
+
+    The handshake and login (key exchange) are done once and the session is reused until it expires or a request
+    fails. Failed operations are retried with a bounded exponential backoff.
+    """
+
+    def __init__(self, ip_address, username=username, password=password, ttl=TAPO_SESSION_TTL):
+        """
+        :param ip_address: IP address of the plug
+        :param username: Tapo account username
+        :param password: Tapo account password
+        :param ttl: Seconds the session is reused
+        """
+        self.ip_address = ip_address
+        self.username = username
+        self.password = password
+        self.ttl = ttl
+        self.lock = threading.Lock()  # The plug handles one request at a time
+        self.p110 = None
+        self.logged_in_at = None
 
+    def _plug(self):
+        if self.p110 is None or time.monotonic() - self.logged_in_at > self.ttl:
+            from PyP100 import PyP110  # Needed only with a plug, the tests and the simulation run without it
+            TAPO_LOGINS.inc()
+            p110 = PyP110.P110(self.ip_address, self.username, self.password)  # Creating a P110 plug object
             p110.handshake()  # Creates the cookies required for further methods
             p110.login()  # Sends credentials to the plug and creates AES Key and IV for further methods
+            self.p110, self.logged_in_at = p110, time.monotonic()
+        return self.p110
 
+    def _call(self, operation):
+        """
+        Run the operation with the logged in plug, logging in again and retrying when it fails.
+
+        :param operation: Function taking the P110 object
+        :raises TapoError: When all attempts failed
+        """
+        backoff = TAPO_INITIAL_BACKOFF
+        name = operation.__name__.strip('_')
+        with self.lock, TAPO_REQUEST_SECONDS.time(operation=name):
+            for attempt in range(1, TAPO_ATTEMPTS + 1):
+                try:
+                    return operation(self._plug())
+                except Exception as e:
+                    self.p110 = None  # The session may have expired, log in again
+                    TAPO_RETRIES.inc(operation=name)
+                    logging.info(f'Connecting to {self.ip_address} was not successfull ({attempt}/{TAPO_ATTEMPTS}): '
+                                 f'{e!r}')
+                    if attempt < TAPO_ATTEMPTS:
+                        time.sleep(backoff)
+                        backoff = min(backoff * 2, TAPO_MAX_BACKOFF)
+        raise TapoError(f'Tapo plug {self.ip_address} is not reachable.')
+
+    def set_state(self, on):
+        """
+        :param on: True to turn the plug on, False to turn it off
+        """
+        def _set_state(p110):
             if on:
-                p110.turnOn() # Sends the turn on request
+                p110.turnOn()  # Sends the turn on request
                 logging.info(f'Turning on.')
             else:
                 p110.turnOff()  # Sends the turn off request
                 logging.info(f'Turning off.')
-            break
-        except:
-            logging.info(f'Connecting to {ip_address} was not successfull.')
-            time.sleep(60)
\ No newline at end of file
+
+        self._call(_set_state)
+
+    def get_state(self):
+        """
+        :return: True if the plug is on
+        """
+        def _get_state(p110):
+            info = p110.getDeviceInfo()
+            info = info.get('result', info)  # Older PyP100 versions return the raw response
+            return bool(info['device_on'])
+
+        return self._call(_get_state)
+
+    def get_power(self):
+        """
+        :return: Power drawn through the plug in watts, measured by the P110
+        """
+        def _get_power(p110):
+            usage = p110.getEnergyUsage()
+            usage = usage.get('result', usage)  # Older PyP100 versions return the raw response
+            return usage['current_power'] / 1000  # Reported in milliwatts
+
+        return self._call(_get_power)
+
+
+def get_tapo_session(ip_address):
+    """
+    Return the shared session of the plug, creating it on first use.
+
+    :param ip_address: IP address of the plug
+    :return: TapoSession instance
+    """
+    with _sessions_lock:
+        session = _sessions.get(ip_address)
+        if session is None:
+            session = TapoSession(ip_address)
+            _sessions[ip_address] = session
+        return session
+
+
+def turn_on_off(on=True, ip_address=None):
+    get_tapo_session(ip_address).set_state(on)
+
+
+def get_state(ip_address):
+    return get_tapo_session(ip_address).get_state()
+
+
+def get_power(ip_address):
+    return get_tapo_session(ip_address).get_power()
+
+
+async def set_plug_state(ip_address, on):
+    """
+    Turn the plug on or off in a worker thread without blocking the event loop.
+    """
+    await asyncio.to_thread(turn_on_off, on, ip_address)
+
+
+async def get_plug_state(ip_address):
+    """
+    Read whether the plug is on in a worker thread without blocking the event loop.
+    """
+    return await asyncio.to_thread(get_state, ip_address)
+
+
+async def get_plug_power(ip_address):
+    """
+    Read the power drawn through the plug in a worker thread without blocking the event loop.
+    """
+    return await asyncio.to_thread(get_power, ip_address)
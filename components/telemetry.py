@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import asyncio
+import collections
+import logging
+import sqlite3
+import threading
+import time
+
+from .goodwe_utils import get_inverter_client
+from .running_stats import WindowedStatistics
+from .scheduler import AdaptiveScheduler
+from .status import get_status, wake_waiters, discard_waiter
+from .timeseries import get_timeseries_store
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+SAMPLE_INTERVAL_SECONDS = 3  # How often the runtime data are read from the inverter while the surplus changes
+MAX_SAMPLE_INTERVAL_SECONDS = 30  # How often the runtime data are read when the surplus is stable
+STABLE_SURPLUS_CHANGE_W = 50  # Change of the PV surplus between two samples considered stable
+BUSY_SURPLUS_CHANGE_W = 300  # Change of the PV surplus between two samples switching to the fastest sampling
+STALE_SNAPSHOT_SECONDS = 3 * MAX_SAMPLE_INTERVAL_SECONDS  # Age of the latest sample after which it is outdated
+SAMPLE_BUFFER_SIZE = 200  # Number of samples kept in the ring buffer (10 minutes at 3 s)
+RUNNING_MEAN_WINDOW = 5  # Number of latest samples used for the rolling means
+SAMPLED_SENSORS = ('ppv', 'house_consumption', 'battery_soc', 'active_power')
+AGGREGATED_SENSORS = ('ppv', 'house_consumption', 'active_power')  # Sensors with incrementally updated statistics
+
+TelemetrySample = collections.namedtuple('TelemetrySample', ('timestamp',) + SAMPLED_SENSORS)
+
+_samplers = {}  # Shared samplers keyed by inverter IP address
+_samplers_lock = threading.Lock()
+
+
+class TelemetrySnapshot:
+    """
+    Consistent view of the latest inverter readings. All values come from the same set of samples.
+    """
+
+    def __init__(self, seq, samples, statistics):
+        """
+        :param seq: Sequence number of the latest sample
+        :param samples: Tuple of TelemetrySample, oldest first
+        :param statistics: dict sensor -> summary of its WindowedStatistics over the latest samples
+        """
+        self.seq = seq
+        self.samples = samples
+        self.statistics = statistics
+        self.latest = samples[-1]
+        self.timestamp = self.latest.timestamp
+        self.battery_soc = self.latest.battery_soc
+        self.ppv = self.statistic('ppv')
+        self.house_consumption = self.statistic('house_consumption')
+
+    def statistic(self, sensor, statistic='mean'):
+        """
+        Windowed statistic of the sensor over the last RUNNING_MEAN_WINDOW samples.
+
+        :param sensor: One of AGGREGATED_SENSORS
+        :param statistic: One of running_stats.STATISTICS
+        """
+        return self.statistics[sensor][statistic]
+
+    def is_stale(self, now=None):
+        """
+        :param now: UNIX time, defaults to now
+        :return: True if the latest sample is older than STALE_SNAPSHOT_SECONDS, e.g. when the sampling stalled
+        """
+        return (now if now is not None else time.time()) - self.timestamp > STALE_SNAPSHOT_SECONDS
+
+    @property
+    def surplus(self):
+        """
+        :return: PV power minus house consumption (W), None if any of them is missing
+        """
+        if self.ppv is None or self.house_consumption is None:
+            return None
+        return self.ppv - self.house_consumption
+
+
+class TelemetrySampler:
+    """
+    Background sampler reading the inverter runtime data once per tick and sharing them with all tasks.
+
+    The sampler runs on the event loop of the shared InverterClient. Tasks subscribe to it, read consistent
+    snapshots and can block until a new sample arrives. The tick rate follows the PV surplus - every few seconds
+    while it changes or a price slot boundary is near, backing off when the readings are stable. The boiler and
+    car tasks follow the samples, so they are paced by the sampler too.
+    """
+
+    def __init__(self, inverter_ip_address, interval=SAMPLE_INTERVAL_SECONDS, buffer_size=SAMPLE_BUFFER_SIZE,
+                 window=RUNNING_MEAN_WINDOW, max_interval=MAX_SAMPLE_INTERVAL_SECONDS):
+        """
+        :param inverter_ip_address: IP address of the inverter
+        :param interval: Seconds between two samples while the surplus changes
+        :param buffer_size: Number of samples kept in the ring buffer
+        :param window: Number of latest samples used for the rolling statistics
+        :param max_interval: Seconds between two samples when the surplus is stable
+        """
+        self.inverter_ip_address = inverter_ip_address
+        self.scheduler = AdaptiveScheduler('telemetry', interval, max(interval, max_interval),
+                                           STABLE_SURPLUS_CHANGE_W, BUSY_SURPLUS_CHANGE_W)
+        self.wakeup = None  # asyncio.Event interrupting the sleep between two samples
+        self.samples = collections.deque(maxlen=buffer_size)
+        self.statistics = {sensor: WindowedStatistics(window) for sensor in AGGREGATED_SENSORS}
+        self.seq = 0  # Sequence number of the latest sample
+        self.condition = threading.Condition()  # Notifies subscribers about new samples
+        self.waiters = []  # (event loop, asyncio.Future) pairs of coroutines waiting for a new sample
+        self.subscribers = 0
+        self.future = None  # Future of the sampling coroutine
+
+    async def _run(self):
+        client = get_inverter_client(self.inverter_ip_address)
+        timeseries = get_timeseries_store()
+        status = get_status()
+        self.wakeup = asyncio.Event()
+        while True:
+            started = time.monotonic()
+            surplus = None
+            try:
+                runtime_data = await client.read_runtime_data()
+            except Exception as e:
+                logging.info(f'Telemetry sampling of {self.inverter_ip_address} failed: {e!r}')
+            else:
+                sample = TelemetrySample(time.time(), *(runtime_data.get(sensor) for sensor in SAMPLED_SENSORS))
+                self._append(sample)
+                if sample.ppv is not None and sample.house_consumption is not None:
+                    surplus = sample.ppv - sample.house_consumption
+                status.update('telemetry', **sample._asdict())
+                timeseries.append(sample.timestamp, **{sensor: getattr(sample, sensor) for sensor in SAMPLED_SENSORS})
+            if timeseries.should_flush():
+                try:
+                    await asyncio.to_thread(timeseries.flush)  # Batched write of the history
+                except sqlite3.Error as e:
+                    logging.info(f'Writing the telemetry history failed: {e!r}')
+            interval = self.scheduler.update(surplus)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(0., interval - (time.monotonic() - started)))
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    def wake(self):
+        """
+        Take the next sample right away and keep sampling at the fastest rate, e.g. after the settings changed.
+        Can be called from any thread.
+        """
+        self.scheduler.reset()
+        if self.wakeup is not None:
+            get_inverter_client(self.inverter_ip_address).loop.call_soon_threadsafe(self.wakeup.set)
+
+    def _append(self, sample):
+        with self.condition:
+            self.samples.append(sample)
+            for sensor, statistics in self.statistics.items():
+                statistics.push(getattr(sample, sensor))
+            self.seq += 1
+            self.condition.notify_all()
+            wake_waiters(self.waiters)
+            self.waiters = []
+
+    def subscribe(self):
+        """
+        Register a subscriber, the sampling starts with the first one.
+        """
+        with self.condition:
+            self.subscribers += 1
+            if self.future is None:
+                logging.info(f'Starting telemetry sampler for {self.inverter_ip_address}.')
+                client = get_inverter_client(self.inverter_ip_address)
+                self.future = asyncio.run_coroutine_threadsafe(self._run(), client.loop)
+
+    def unsubscribe(self):
+        """
+        Unregister a subscriber, the sampling stops with the last one.
+        """
+        with self.condition:
+            self.subscribers = max(0, self.subscribers - 1)
+            if self.subscribers == 0 and self.future is not None:
+                logging.info(f'Stopping telemetry sampler for {self.inverter_ip_address}.')
+                self.future.cancel()
+                self.future = None
+
+    def _snapshot(self):
+        return TelemetrySnapshot(self.seq, tuple(self.samples),
+                                 {sensor: statistics.summary() for sensor, statistics in self.statistics.items()})
+
+    def snapshot(self):
+        """
+        :return: TelemetrySnapshot of the current buffer or None if nothing was sampled yet
+        """
+        with self.condition:
+            if not self.samples:
+                return None
+            return self._snapshot()
+
+    def wait_for_snapshot(self, after_seq=0, timeout=None):
+        """
+        Block until a sample newer than `after_seq` is available.
+
+        :param after_seq: Sequence number of the last snapshot seen by the caller
+        :param timeout: Maximum time to wait in seconds, None waits forever
+        :return: TelemetrySnapshot or None on timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+            return self._snapshot()
+
+    async def next_snapshot(self, after_seq=0):
+        """
+        Asynchronous variant of `wait_for_snapshot`, waits without blocking the caller's event loop.
+
+        :param after_seq: Sequence number of the last snapshot seen by the caller
+        :return: TelemetrySnapshot
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.seq > after_seq:
+                    return self._snapshot()
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:  # Also when the waiting task is cancelled
+                with self.condition:
+                    discard_waiter(self.waiters, loop, waiter)
+
+
+def get_sampler(inverter_ip_address):
+    """
+    Return the shared telemetry sampler for the given inverter, creating it on first use.
+
+    :param inverter_ip_address: IP address of the inverter
+    :return: TelemetrySampler instance
+    """
+    with _samplers_lock:
+        sampler = _samplers.get(inverter_ip_address)
+        if sampler is None:
+            sampler = TelemetrySampler(inverter_ip_address)
+            _samplers[inverter_ip_address] = sampler
+        return sampler
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024
+# Author: Jan Profant <jan@konversation.ai>
+# All Rights Reserved
+
+import contextlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from . import setting_path
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+TIMESERIES_PATH = Path(__file__).resolve().parent.parent / 'telemetry.sqlite3'
+TIMESERIES_BATCH_SIZE = 100  # Number of buffered samples written in a single transaction
+TIMESERIES_FLUSH_SECONDS = 60  # Maximum age of a buffered sample before it is written
+TIMESERIES_COLUMNS = ('ppv', 'house_consumption', 'battery_soc', 'active_power', 'operation_mode', 'boiler', 'car')
+# Device states, taken from the latest record_state call - the operation mode code and the boiler and car power (W)
+STATE_COLUMNS = ('operation_mode', 'boiler', 'car')
+
+# Rollup levels - resolution in seconds and the resolution it is aggregated from, 0 stands for the raw samples
+ROLLUPS = ((60, 0), (900, 60), (86400, 900))
+# Seconds every resolution is kept, None keeps it forever
+RETENTION = {
+    0: 2 * 86400,
+    60: 30 * 86400,
+    900: 2 * 365 * 86400,
+    86400: None,
+}
+RETENTION_INTERVAL = 3600  # Seconds between two retention cleanups
+
+_timeseries_store = None
+_timeseries_store_lock = threading.Lock()
+
+
+class TimeSeriesStore:
+    """
+    SQLite (WAL) store of the inverter telemetry, device states and prices.
+
+    Samples are buffered in memory and written in batches. Complete buckets are rolled up from the raw samples to
+    1 minute, 15 minute and daily averages after every write and old data are removed according to RETENTION, so
+    the database size stays bounded.
+    """
+
+    def __init__(self, path=TIMESERIES_PATH, batch_size=TIMESERIES_BATCH_SIZE, flush_seconds=TIMESERIES_FLUSH_SECONDS):
+        """
+        :param path: Path to the SQLite database file
+        :param batch_size: Number of buffered samples triggering a write
+        :param flush_seconds: Maximum age of a buffered sample in seconds
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()  # Guards the buffer and the device state
+        self.write_lock = threading.Lock()  # Serializes the writes
+        self.buffer = []
+        self.buffered_at = None  # Time of the oldest buffered sample
+        self.state = dict.fromkeys(STATE_COLUMNS)
+        self.cleaned_at = 0.
+
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'CREATE TABLE IF NOT EXISTS telemetry (resolution INTEGER NOT NULL, '
+                               f'ts INTEGER NOT NULL, {", ".join(f"{c} REAL" for c in TIMESERIES_COLUMNS)}, '
+                               f'PRIMARY KEY (resolution, ts)) WITHOUT ROWID')
+            connection.execute('CREATE TABLE IF NOT EXISTS slot_prices (ts INTEGER PRIMARY KEY, '
+                               'resolution INTEGER NOT NULL, price REAL NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS rollups (resolution INTEGER PRIMARY KEY, '
+                               'rolled_until INTEGER NOT NULL)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Commits or rolls back the transaction and closes the connection, sqlite3 alone only does the former
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as connection, connection:
+            connection.execute('PRAGMA synchronous=NORMAL')  # Safe with WAL, avoids a fsync per transaction
+            yield connection
+
+    def record_state(self, **state):
+        """
+        Update the device state stored with the following samples, e.g. `record_state(boiler=2000)`.
+
+        :param state: Values of STATE_COLUMNS
+        """
+        with self.lock:
+            for column, value in state.items():
+                if column not in STATE_COLUMNS:
+                    raise ValueError(f'Unknown state {column}, use one of {STATE_COLUMNS}.')
+                self.state[column] = None if value is None else float(value)
+
+    def append(self, timestamp, **values):
+        """
+        Buffer a raw sample.
+
+        :param timestamp: UNIX time of the sample
+        :param values: Values of the telemetry columns, missing ones are stored as NULL
+        """
+        row = dict(self.state, **values)
+        with self.lock:
+            self.buffer.append((0, int(timestamp)) + tuple(row.get(column) for column in TIMESERIES_COLUMNS))
+            if self.buffered_at is None:
+                self.buffered_at = time.monotonic()
+
+    def should_flush(self):
+        with self.lock:
+            return len(self.buffer) >= self.batch_size or \
+                (self.buffered_at is not None and time.monotonic() - self.buffered_at > self.flush_seconds)
+
+    def flush(self):
+        """
+        Write the buffered samples, roll them up and apply the retention. Blocking, run it in a worker thread.
+        """
+        with self.lock:
+            rows, self.buffer, self.buffered_at = self.buffer, [], None
+        with self.write_lock, self._connect() as connection:
+            try:
+                if rows:
+                    connection.executemany(f'INSERT OR REPLACE INTO telemetry (resolution, ts, '
+                                           f'{", ".join(TIMESERIES_COLUMNS)}) VALUES '
+                                           f'({", ".join("?" * (len(TIMESERIES_COLUMNS) + 2))})', rows)
+            except sqlite3.Error:
+                with self.lock:  # Keep the samples for the next attempt
+                    self.buffer = rows + self.buffer
+                    self.buffered_at = self.buffered_at or time.monotonic()
+                raise
+            self._rollup(connection, since=min(row[1] for row in rows) if rows else None)
+            if time.monotonic() - self.cleaned_at > RETENTION_INTERVAL:
+                self._apply_retention(connection)
+                self.cleaned_at = time.monotonic()
+
+    def _rollup(self, connection, now=None, since=None):
+        """
+        Aggregate the complete buckets not rolled up yet for every rollup level.
+
+        :param since: UNIX time of the oldest sample just written, its buckets are aggregated again if they were
+                      rolled up before, e.g. for a sample appended right after the previous flush
+        """
+        now = int(time.time() if now is None else now)
+        rolled = dict(connection.execute('SELECT resolution, rolled_until FROM rollups').fetchall())
+        # Averages, e.g. the mean power of the boiler, the operation mode is a code and keeps the highest one
+        averages = ', '.join(f'MAX({column})' if column == 'operation_mode' else f'AVG({column})'
+                             for column in TIMESERIES_COLUMNS)
+        for resolution, source in ROLLUPS:
+            until = now // resolution * resolution  # Beginning of the current, incomplete bucket
+            start = rolled.get(resolution)
+            if start is None:
+                row = connection.execute('SELECT MIN(ts) FROM telemetry WHERE resolution = ?', (source,)).fetchone()
+                if row[0] is None:
+                    continue
+                start = row[0] // resolution * resolution
+            if since is not None:
+                start = min(start, since // resolution * resolution)
+            if start >= until:
+                continue
+            connection.execute(f'INSERT OR REPLACE INTO telemetry (resolution, ts, {", ".join(TIMESERIES_COLUMNS)}) '
+                               f'SELECT ?, ts / ? * ?, {averages} FROM telemetry '
+                               f'WHERE resolution = ? AND ts >= ? AND ts < ? GROUP BY ts / ?',
+                               (resolution, resolution, resolution, source, start, until, resolution))
+            connection.execute('INSERT OR REPLACE INTO rollups (resolution, rolled_until) VALUES (?, ?)',
+                               (resolution, until))
+
+    def _apply_retention(self, connection, now=None):
+        now = int(time.time() if now is None else now)
+        for resolution, keep in RETENTION.items():
+            if keep is not None:
+                connection.execute('DELETE FROM telemetry WHERE resolution = ? AND ts < ?', (resolution, now - keep))
+        keep = max(keep for keep in RETENTION.values() if keep is not None)
+        connection.execute('DELETE FROM slot_prices WHERE ts < ?', (now - keep,))
+
+    def put_prices(self, series):
+        """
+        Store the price of every slot of the series.
+
+        :param series: ote.PriceSeries
+        """
+        rows = [(int(series.slot_start(slot).timestamp()), series.resolution, float(series[slot]))
+                for slot in range(len(series))]
+        with self.write_lock, self._connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO slot_prices (ts, resolution, price) VALUES (?, ?, ?)', rows)
+
+    def resolution_for(self, start, now=None):
+        """
+        :return: The finest resolution still holding data from the start
+        """
+        now = time.time() if now is None else now
+        for resolution, keep in sorted(RETENTION.items()):
+            if keep is None or start >= now - keep:
+                return resolution
+
+    def query(self, start, end, resolution=None):
+        """
+        :param start: UNIX time of the beginning of the interval
+        :param end: UNIX time of the end of the interval (exclusive)
+        :param resolution: Resolution in seconds (0 for raw samples), the finest one available by default
+        :return: list of dicts with the timestamp `ts` and TIMESERIES_COLUMNS
+        """
+        if resolution is None:
+            resolution = self.resolution_for(start)
+        with self._connect() as connection:
+            rows = connection.execute(f'SELECT ts, {", ".join(TIMESERIES_COLUMNS)} FROM telemetry '
+                                      f'WHERE resolution = ? AND ts >= ? AND ts < ? ORDER BY ts',
+                                      (resolution, int(start), int(end))).fetchall()
+        return [dict(zip(('ts',) + TIMESERIES_COLUMNS, row)) for row in rows]
+
+    def prices(self, start, end):
+        """
+        :return: list of (slot start UNIX time, resolution in minutes, price) tuples in the interval
+        """
+        with self._connect() as connection:
+            return connection.execute('SELECT ts, resolution, price FROM slot_prices WHERE ts >= ? AND ts < ? '
+                                      'ORDER BY ts', (int(start), int(end))).fetchall()
+
+
+def get_timeseries_store():
+    """
+    Return the process-wide TimeSeriesStore, creating it on first use.
+    """
+    global _timeseries_store
+    with _timeseries_store_lock:
+        if _timeseries_store is None:
+            _timeseries_store = TimeSeriesStore(setting_path('TIMESERIES_PATH', TIMESERIES_PATH))
+        return _timeseries_store
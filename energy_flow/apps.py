@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save
 
 
 class EnergyFlowConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'energy_flow'
+
+    def ready(self):
+        from .models import GeneralSettings
+        from .settings_cache import settings_saved
+
+        # Keep the settings cache in sync with the database
+        post_save.connect(settings_saved, sender=GeneralSettings, dispatch_uid='general_settings_saved')
@@ -0,0 +1,84 @@
+import logging  # Module for logging
+import threading  # Module to handle threading
+import types  # Module providing MappingProxyType
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+
+class ConfigSnapshot:
+    """
+    Read-only view of the configuration at a single version.
+    """
+
+    def __init__(self, version, values):
+        """
+        :param version: Version of the configuration, incremented with every change
+        :param values: dict with GeneralSettings field names and values
+        """
+        self.version = version
+        self.values = types.MappingProxyType(dict(values))
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def diff(self, other):
+        """
+        :param other: Older ConfigSnapshot or None
+        :return: set of the keys whose values differ
+        """
+        if other is None:
+            return set(self.values)
+        return {key for key in self.values.keys() | other.values.keys()
+                if self.values.get(key) != other.values.get(key)}
+
+
+class LiveConfig:
+    """
+    Configuration shared with the running tasks. The tasks read a snapshot on every tick and apply the changes,
+    so new settings take effect without restarting them.
+    """
+
+    def __init__(self, values=None):
+        self.lock = threading.Lock()
+        self.current = ConfigSnapshot(0, values or {})
+
+    def update(self, values):
+        """
+        Replace the configuration, a new version is created only if any value changed.
+
+        :param values: dict with GeneralSettings field names and values
+        :return: set of the changed keys
+        """
+        with self.lock:
+            snapshot = ConfigSnapshot(self.current.version + 1, values)
+            changed = snapshot.diff(self.current)
+            if changed:
+                logging.info(f'Configuration changed (version {snapshot.version}): {sorted(changed)}')
+                self.current = snapshot
+            return changed
+
+    def snapshot(self):
+        """
+        :return: Current ConfigSnapshot
+        """
+        with self.lock:
+            return self.current
+
+
+_live_config = None
+_live_config_lock = threading.Lock()
+
+
+def get_live_config():
+    """
+    Return the process-wide LiveConfig, creating it on first use.
+    """
+    global _live_config
+    with _live_config_lock:
+        if _live_config is None:
+            _live_config = LiveConfig()
+        return _live_config
@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from components.ote import BACKFILL_WORKERS, OTE_CR_PAGE, OTE_TIMEZONE, backfill_prices
+
+
+def parse_day(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'{value!r} is not a date in format YYYY-MM-DD.')
+
+
+class Command(BaseCommand):
+    help = 'Download the OTE day-ahead prices of past days into the local price store, e.g. for the simulation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=parse_day, help='First day, YYYY-MM-DD.')
+        parser.add_argument('end', type=parse_day, nargs='?', help='Last day, YYYY-MM-DD, defaults to today.')
+        parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS, help='Number of concurrent downloads.')
+        parser.add_argument('--base-url', default=OTE_CR_PAGE,
+                            help='URL of the report page without the date, e.g. of a local stub server.')
+        parser.add_argument('--force', action='store_true', help='Download also the days which are already stored.')
+
+    def handle(self, *args, **options):
+        start = options['start']
+        end = options['end'] or datetime.datetime.now(OTE_TIMEZONE).date()
+        if end < start:
+            raise CommandError(f'The last day {end} is before the first day {start}.')
+        if options['workers'] < 1:
+            raise CommandError('At least one worker is required.')
+
+        days = [(start + datetime.timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        stored, failed = backfill_prices(days, options['workers'], options['base_url'], options['force'])
+        skipped = len(days) - len(stored) - len(failed)
+        self.stdout.write(f'Stored prices of {len(stored)} days, {skipped} days were already stored.')
+        for day, error in sorted(failed.items()):
+            self.stderr.write(f'{day}: {error}')
+        if failed:
+            raise CommandError(f'Prices of {len(failed)} days could not be downloaded.')
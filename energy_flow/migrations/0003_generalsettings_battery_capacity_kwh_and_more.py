@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2024-10-18 09:12
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_flow', '0002_alter_generalsettings_bojler_tapo_ip_address_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generalsettings',
+            name='BATTERY_CAPACITY_KWH',
+            field=models.FloatField(default=10.0, validators=[django.core.validators.MaxValueValidator(200), django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='generalsettings',
+            name='BATTERY_CHARGE_POWER_KW',
+            field=models.FloatField(default=5.0, validators=[django.core.validators.MaxValueValidator(50), django.core.validators.MinValueValidator(0.1)]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.16 on 2024-10-19 10:31
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_flow', '0003_generalsettings_battery_capacity_kwh_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generalsettings',
+            name='BATTERY_MODE',
+            field=models.CharField(choices=[('buy', 'Nákup'), ('sell', 'Predaj'), ('buy_sell', 'Nákup aj predaj')], default='buy', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='generalsettings',
+            name='BATTERY_RESERVE_LEVEL',
+            field=models.IntegerField(default=30, validators=[django.core.validators.MaxValueValidator(90), django.core.validators.MinValueValidator(10)]),
+        ),
+        migrations.AddField(
+            model_name='generalsettings',
+            name='SELL_THRESHOLD_EUR',
+            field=models.FloatField(default=150, validators=[django.core.validators.MaxValueValidator(1000), django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
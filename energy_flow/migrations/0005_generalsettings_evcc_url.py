@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2024-10-19 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_flow', '0004_generalsettings_battery_mode_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generalsettings',
+            name='EVCC_URL',
+            field=models.URLField(default='http://localhost:7070'),
+        ),
+    ]
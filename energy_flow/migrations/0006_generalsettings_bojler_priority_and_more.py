@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2024-10-20 09:47
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_flow', '0005_generalsettings_evcc_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generalsettings',
+            name='BOJLER_PRIORITY',
+            field=models.IntegerField(default=1, validators=[django.core.validators.MaxValueValidator(10), django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='generalsettings',
+            name='CAR_PRIORITY',
+            field=models.IntegerField(default=2, validators=[django.core.validators.MaxValueValidator(10), django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2024-10-27 10:12
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_flow', '0006_generalsettings_bojler_priority_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generalsettings',
+            name='PEAK_LIMITER_ENABLED',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='generalsettings',
+            name='GRID_IMPORT_LIMIT_W',
+            field=models.IntegerField(default=10000, validators=[django.core.validators.MaxValueValidator(50000), django.core.validators.MinValueValidator(1000)]),
+        ),
+    ]
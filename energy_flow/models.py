@@ -3,6 +3,12 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 
 
 class GeneralSettings(models.Model):
+    BATTERY_MODES = [
+        ('buy', 'Nákup'),
+        ('sell', 'Predaj'),
+        ('buy_sell', 'Nákup aj predaj'),
+    ]
+
     # general
     INVERTER_IP_ADDRESS = models.GenericIPAddressField(
         default='192.168.88.176')
@@ -23,6 +29,11 @@ class GeneralSettings(models.Model):
 
     # battery
     BATTERY_ENABLED = models.BooleanField(default=False)
+    BATTERY_MODE = models.CharField(
+        max_length=8,
+        choices=BATTERY_MODES,
+        default='buy'
+    )
     CHARGE_THRESHOLD_EUR = models.FloatField(
         default=20,
         validators=[
@@ -51,6 +62,34 @@ class GeneralSettings(models.Model):
             MinValueValidator(0)
         ]
     )
+    BATTERY_CAPACITY_KWH = models.FloatField(
+        default=10.0,
+        validators=[
+            MaxValueValidator(200),
+            MinValueValidator(1)
+        ]
+    )
+    SELL_THRESHOLD_EUR = models.FloatField(
+        default=150,
+        validators=[
+            MaxValueValidator(1000),
+            MinValueValidator(0)
+        ]
+    )
+    BATTERY_RESERVE_LEVEL = models.IntegerField(
+        default=30,
+        validators=[
+            MaxValueValidator(90),
+            MinValueValidator(10)
+        ]
+    )
+    BATTERY_CHARGE_POWER_KW = models.FloatField(
+        default=5.0,
+        validators=[
+            MaxValueValidator(50),
+            MinValueValidator(0.1)
+        ]
+    )
 
     # bojler
     BOJLER_ENABLED = models.BooleanField(default=True)
@@ -63,9 +102,18 @@ class GeneralSettings(models.Model):
             MinValueValidator(0)
         ]
     )
+    BOJLER_PRIORITY = models.IntegerField(
+        default=1,
+        validators=[
+            MaxValueValidator(10),
+            MinValueValidator(1)
+        ]
+    )
 
     # car
     CAR_ENABLED = models.BooleanField(default=True)
+    EVCC_URL = models.URLField(
+        default='http://localhost:7070')
     MAX_CURRENT_A = models.IntegerField(
         default=16,
         validators=[
@@ -80,3 +128,20 @@ class GeneralSettings(models.Model):
             MinValueValidator(6)
         ]
     )
+    CAR_PRIORITY = models.IntegerField(
+        default=2,
+        validators=[
+            MaxValueValidator(10),
+            MinValueValidator(1)
+        ]
+    )
+
+    # peak limiter
+    PEAK_LIMITER_ENABLED = models.BooleanField(default=False)
+    GRID_IMPORT_LIMIT_W = models.IntegerField(
+        default=10000,
+        validators=[
+            MaxValueValidator(50000),
+            MinValueValidator(1000)
+        ]
+    )
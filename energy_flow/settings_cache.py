@@ -0,0 +1,47 @@
+import logging  # Module for logging
+import threading  # Module to handle threading
+
+from django.forms import model_to_dict
+
+from .live_config import get_live_config
+from .models import GeneralSettings
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+
+_load_lock = threading.Lock()
+
+
+def get_settings():
+    """
+    Return the cached settings, loading the single GeneralSettings row (created with the defaults if missing)
+    only on first use. The cache is refreshed by the post_save signal, so reads never hit the database.
+
+    :return: energy_flow.live_config.ConfigSnapshot
+    """
+    config = get_live_config()
+    snapshot = config.snapshot()
+    if snapshot.version > 0:
+        return snapshot
+    with _load_lock:
+        if config.snapshot().version == 0:
+            settings = GeneralSettings.objects.first()
+            if not settings:
+                settings = GeneralSettings.objects.create()  # Updates the cache through the signal
+            config.update(model_to_dict(settings))
+        return config.snapshot()
+
+
+def get_settings_instance():
+    """
+    :return: Unsaved GeneralSettings instance with the cached values and the primary key of the stored row,
+             e.g. for a ModelForm; saving it updates the row
+    """
+    return GeneralSettings(**get_settings().values)
+
+
+def settings_saved(sender, instance, **kwargs):
+    """
+    post_save receiver publishing the saved settings to the cache and the running tasks.
+    """
+    get_live_config().update(model_to_dict(instance))
@@ -1,81 +1,166 @@
+import asyncio  # Library for running asynchronous operations
+import collections  # Module providing namedtuple
+import contextvars  # Module for task-local state
 import threading  # Module to handle threading
-import time  # Module for time-related functions
 import random  # Module for generating random numbers
 import logging  # Module for logging
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
+# Restart policy of a supervised task - how many times it is restarted after a failure and how long to wait in between
+RestartPolicy = collections.namedtuple('RestartPolicy', ('max_restarts', 'initial_backoff', 'max_backoff'))
+DEFAULT_RESTART_POLICY = RestartPolicy(max_restarts=10, initial_backoff=5, max_backoff=600)
 
-class TaskControl:
+# Wakeup event of the task currently running, used by sleep_routine
+current_wakeup = contextvars.ContextVar('current_wakeup', default=None)
+
+
+class TaskSupervisor:
     """
-    Class to control the execution of a background task (thread) that can be started and stopped.
+    Class running controller coroutines (battery, boiler, car) on a single event loop in a background thread.
+    Tasks are stopped by cancellation, restarted with exponential backoff when they fail and can be woken up
+    from their sleep routine at any time.
     """
 
-    def __init__(self, task_function, *args):
+    def __init__(self):
+        """
+        Initialize the supervisor and start its event loop thread.
         """
-        Initialize the TaskControl object.
+        self.loop = asyncio.new_event_loop()
+        self.tasks = {}  # Supervising asyncio.Task objects keyed by task name
+        self.wakeups = {}  # asyncio.Event objects keyed by task name
+        self.thread = threading.Thread(target=self._run_loop, daemon=True, name='task-supervisor')
+        self.thread.start()
 
-        :param task_function: The function to run in the background thread
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _run(self, coroutine, wait=True):
+        """
+        Run a coroutine on the supervisor loop and wait for its result, or only schedule it if `wait` is False.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return future.result() if wait else future
+
+    def start(self, task_name, task_function, *args, restart_policy=DEFAULT_RESTART_POLICY, wait=True):
+        """
+        Start the task, stopping its previous instance first if it is running.
+
+        :param task_name: Unique name of the task
+        :param task_function: Coroutine function running the task
         :param args: Arguments to pass to the task function
+        :param restart_policy: RestartPolicy applied when the task fails
+        :param wait: False returns right away without waiting for the previous instance to stop
         """
-        self.task_function = task_function
-        self.stop_event = threading.Event()  # Event to signal when to stop the task
-        self.thread = None  # Thread object
-        self.args = args  # Store the arguments to be passed to the task
+        return self._run(self._start(task_name, task_function, args, restart_policy), wait)
 
-    def start(self):
+    def stop(self, task_name, wait=True):
         """
-        Start the background task in a new thread if it's not already running.
+        Stop the task by cancelling it and wait until its cleanup is finished.
+
+        :param wait: False returns right away, the cleanup continues in the background
         """
-        if self.thread is None or not self.thread.is_alive():
-            # Log starting of the task with function name and arguments
-            logging.info(f"Starting task: {self.task_function.__name__} with args: {self.args}")
-            self.stop_event.clear()  # Reset the stop event
-            # Create and start a new thread running the task
-            self.thread = threading.Thread(target=self.run_task, daemon=True)
-            self.thread.start()
-        else:
-            # Log if the task is already running
-            logging.info(f"Task {self.task_function.__name__} is already running.")
-
-    def stop(self):
+        return self._run(self._stop(task_name), wait)
+
+    def wake(self, task_name):
         """
-        Stop the running task by setting the stop event and joining the thread.
+        Interrupt the sleep routine of the task so it runs its next iteration right away.
         """
-        if self.thread and self.thread.is_alive():
-            # Log stopping of the task
-            logging.info(f"Stopping task: {self.task_function.__name__}")
-            self.stop_event.set()  # Signal the stop event to terminate the task
-            self.thread.join()  # Wait for the thread to finish
-            self.thread = None  # Clear the thread reference
-        else:
-            # Log if the task is not running
-            logging.info(f"Task {self.task_function.__name__} is not running.")
-
-    def run_task(self):
+        wakeup = self.wakeups.get(task_name)
+        if wakeup is not None:
+            self.loop.call_soon_threadsafe(wakeup.set)
+
+    def is_running(self, task_name):
+        task = self.tasks.get(task_name)
+        return task is not None and not task.done()
+
+    async def _start(self, task_name, task_function, args, restart_policy):
+        if self.is_running(task_name):
+            logging.info(f"{task_name} is already running, stopping and relaunching again.")
+            await self._stop(task_name)
+        logging.info(f"Starting task: {task_function.__name__} with args: {args}")
+        self.wakeups[task_name] = asyncio.Event()
+        self.tasks[task_name] = self.loop.create_task(
+            self._supervise(task_name, task_function, args, restart_policy), name=task_name)
+
+    async def _stop(self, task_name):
+        task = self.tasks.pop(task_name, None)
+        self.wakeups.pop(task_name, None)
+        if task is None or task.done():
+            logging.info(f"Task {task_name} is not running.")
+            return
+        logging.info(f"Stopping task: {task_name}")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _supervise(self, task_name, task_function, args, restart_policy):
         """
-        Wrapper to execute the task function with the stop event and provided arguments.
+        Run the task function and restart it according to the restart policy when it fails.
         """
-        self.task_function(self.stop_event, *self.args)
+        current_wakeup.set(self.wakeups[task_name])
+        restarts, backoff = 0, restart_policy.initial_backoff
+        while True:
+            started = self.loop.time()
+            try:
+                await task_function(*args)
+                logging.info(f'Task {task_name} finished.')
+                return
+            except Exception:
+                logging.exception(f'Task {task_name} failed.')
+
+            if self.loop.time() - started > restart_policy.max_backoff:
+                # The task was running long enough to be considered healthy, start counting from scratch
+                restarts, backoff = 0, restart_policy.initial_backoff
+            if restarts >= restart_policy.max_restarts:
+                logging.info(f'Task {task_name} failed {restarts} times in a row, giving up.')
+                return
+            restarts += 1
+            logging.info(f'Restarting task {task_name} in {backoff} seconds ({restarts}/{restart_policy.max_restarts}).')
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, restart_policy.max_backoff)
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor():
+    """
+    Return the process-wide TaskSupervisor, creating it on first use.
+    """
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = TaskSupervisor()
+        return _supervisor
 
 
-def sleep_routine(stop_event):
+async def sleep_routine(sleep_for=None):
     """
-    A routine that simulates sleep for a random interval between 300 to 600 seconds (5 to 10 minutes).
-    It checks periodically if a stop event is set and terminates early if so.
+    A routine that sleeps for the given time, or for a random interval between 300 to 600 seconds (5 to 10 minutes).
+    The sleep ends early when the task is woken up through TaskSupervisor.wake; stopping the task cancels it.
 
-    :param stop_event: threading.Event object used to signal early termination
-    :return: False if stopped early, True if slept for the full duration
+    :param sleep_for: Seconds to sleep, e.g. from components.scheduler.AdaptiveScheduler, None for a random interval
+    :return: False if woken up early, True if slept for the full duration
     """
-    # Randomly determine the sleep duration between 5 and 10 minutes
-    sleep_for = random.randint(300, 600)
+    if sleep_for is None:
+        # Randomly determine the sleep duration between 5 and 10 minutes
+        sleep_for = random.randint(300, 600)
 
-    # Loop through the sleep duration, checking for early termination every second
-    for _ in range(sleep_for):
-        time.sleep(1)  # Sleep for 1 second increments to allow for stop checks
-        if stop_event.is_set():  # If stop_event is set, exit the loop
-            logging.info(f'Stop event detected inside sleep routine.')
-            return False  # Indicate early termination
+    wakeup = current_wakeup.get()
+    if wakeup is None:
+        await asyncio.sleep(sleep_for)
+        return True
 
-    return True  # Indicate successful completion of the sleep routine
\ No newline at end of file
+    try:
+        await asyncio.wait_for(wakeup.wait(), sleep_for)
+    except asyncio.TimeoutError:
+        return True  # Indicate successful completion of the sleep routine
+    wakeup.clear()
+    logging.info(f'Wakeup detected inside sleep routine.')
+    return False  # Indicate early wakeup
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from django.test import SimpleTestCase
+from goodwe import OperationMode
+
+from benchmarks.cases import fake_client
+from components.battery import BatteryController, battery_reserve_guard
+from components.goodwe_utils import ModeWriter
+from components.telemetry import TelemetrySample, TelemetrySampler
+
+
+class BatteryReserveGuardTests(SimpleTestCase):
+    """
+    The guard stopping the discharge, driven by samples appended to a sampler that is never started.
+    """
+
+    def setUp(self):
+        client = fake_client()
+        self.client = client.__enter__()
+        self.addCleanup(client.__exit__, None, None, None)
+        self.inverter = self.client.call(lambda inverter: asyncio.sleep(0, inverter))  # Connects the fake inverter
+        self.writer = ModeWriter(self.client, min_dwell_seconds=300)
+        self.sampler = TelemetrySampler('guard-test')
+        self.controller = BatteryController(charge_threshold_eur=0, battery_upper_level=90, max_charge_hours_key=3,
+                                            local_extreme_hours_window=2, battery_capacity_kwh=10,
+                                            battery_charge_power_kw=5, battery_mode='sell', sell_threshold_eur=100,
+                                            battery_reserve_level=30)
+
+    async def sample(self, battery_soc):
+        self.sampler._append(TelemetrySample(time.time(), 0, 500, battery_soc, -4500))
+        await asyncio.sleep(0.1)  # The guard follows the sample
+
+    async def test_stops_selling_at_reserve(self):
+        guard = asyncio.create_task(battery_reserve_guard(self.sampler, self.writer, self.controller))
+        try:
+            await self.writer.submit('battery', OperationMode.ECO_DISCHARGE, eco_mode_soc=30)
+            await self.sample(31)
+            await self.sample(None)
+            self.assertEqual(self.inverter.operation_mode, OperationMode.ECO_DISCHARGE)
+            await self.sample(30)  # Between two ticks of the battery task, within the dwell time
+            self.assertEqual(self.inverter.operation_mode, OperationMode.GENERAL)
+        finally:
+            guard.cancel()
+
+    async def test_ignores_other_modes(self):
+        guard = asyncio.create_task(battery_reserve_guard(self.sampler, self.writer, self.controller))
+        try:
+            await self.writer.submit('battery', OperationMode.ECO_CHARGE)
+            await self.sample(20)  # Charging from below the reserve
+            self.assertEqual(self.inverter.operation_mode, OperationMode.ECO_CHARGE)
+        finally:
+            guard.cancel()
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from components.status import StatusCache
+
+
+class DashboardStreamTests(SimpleTestCase):
+
+    def setUp(self):
+        self.status = StatusCache()
+        self.status.update('battery', level=50)
+        patcher = mock.patch('energy_flow.views.get_status', lambda: self.status)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('energy_flow.views.STREAM_HEARTBEAT_SECONDS', 0.1)
+    @mock.patch('energy_flow.views.STREAM_WSGI_SECONDS', 0.5)
+    def test_wsgi_stream_ends(self):
+        threading.Timer(0.05, self.status.update, ('boiler',), {'on': True}).start()
+        response = self.client.get(reverse('dashboard_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [chunk.decode() for chunk in response.streaming_content]  # Ends after STREAM_WSGI_SECONDS
+        self.assertTrue(events[0].startswith('retry: '))
+        self.assertIn('"battery": {"level": 50', events[0])
+        self.assertIn('"boiler": {"on": true', events[1])
+        self.assertIn(': heartbeat\n\n', events[2:])
+
+    async def test_asgi_stream_stays_open(self):
+        response = await self.async_client.get(reverse('dashboard_stream'))
+        events = aiter(response.streaming_content)
+        self.assertIn('"battery": {"level": 50', (await anext(events)).decode())
+        self.status.update('boiler', on=True)
+        self.assertIn('"boiler": {"on": true', (await anext(events)).decode())
+        await events.aclose()
+
+
+class StatusCacheTests(SimpleTestCase):
+
+    def test_closed_loop_is_skipped(self):
+        status = StatusCache()
+        loop = asyncio.new_event_loop()
+        status.waiters.append((loop, loop.create_future()))  # A client whose loop stopped while it was waiting
+        loop.close()
+        status.update('battery', level=50)  # Does not raise in the producer
+        self.assertEqual(status.waiters, [])
+
+    async def test_timed_out_waiter_is_removed(self):
+        status = StatusCache()
+        self.assertEqual(await status.wait(status.version, timeout=0.05), (0, {}))
+        self.assertEqual(status.waiters, [])
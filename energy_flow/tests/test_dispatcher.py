@@ -0,0 +1,111 @@
+from django.test import SimpleTestCase
+
+from components.car import ONE_AMP, SurplusTracker
+from components.dispatcher import SurplusDispatcher, SwitchedLoad
+
+
+class SurplusDispatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.dispatcher = SurplusDispatcher()
+        self.boiler = SwitchedLoad('boiler', 1, 2000)
+        self.heater = SwitchedLoad('heater', 2, 1500)
+        self.dispatcher.register(self.boiler)
+        self.dispatcher.register(self.heater)
+
+    def test_allocated_power_is_available_again(self):
+        self.assertEqual(self.dispatcher.dispatch(0, 2500, 300, 50), {'boiler': 2000, 'heater': 0})
+        # The house consumption now contains the running boiler
+        self.assertEqual(self.dispatcher.dispatch(60, 2500, 2300, 50), {'boiler': 2000, 'heater': 0})
+
+    def test_measured_power_replaces_allocation(self):
+        self.dispatcher.dispatch(0, 2500, 300, 50)
+        self.assertEqual(self.boiler.power, 2000)
+        # The water is hot, the boiler draws nothing although the plug is on, its allocation is not spare surplus
+        self.dispatcher.measure('boiler', 0)
+        self.assertEqual(self.dispatcher.dispatch(60, 2500, 300, 50), {'boiler': 2000, 'heater': 0})
+        self.dispatcher.measure('boiler', 2000)
+        self.assertEqual(self.dispatcher.dispatch(120, 2500, 2300, 50), {'boiler': 2000, 'heater': 0})
+
+    def test_unknown_measurement_falls_back_to_allocation(self):
+        self.dispatcher.dispatch(0, 2500, 300, 50)
+        self.dispatcher.measure('boiler', 0)
+        self.dispatcher.measure('boiler', None)
+        self.assertEqual(self.dispatcher.dispatch(60, 2500, 300, 50), {'boiler': 2000, 'heater': 1500})
+        self.dispatcher.measure('missing', 100)  # Loads that are not registered are ignored
+
+    def test_priority_order(self):
+        self.assertEqual(self.dispatcher.dispatch(0, 2800, 300, 50), {'boiler': 2000, 'heater': 0})
+        self.boiler.power, self.boiler.switched_at = 0, None
+        self.heater.priority = 0  # Served before the boiler now, the rest does not cover the boiler
+        self.assertEqual(self.dispatcher.dispatch(60, 2800, 300, 50), {'boiler': 0, 'heater': 1500})
+
+    def test_minimum_on_and_off_time(self):
+        boiler = SwitchedLoad('boiler', 1, 2000, min_on_seconds=600, min_off_seconds=300)
+        dispatcher = SurplusDispatcher()
+        dispatcher.register(boiler)
+        self.assertEqual(dispatcher.dispatch(0, 2500, 300, 50), {'boiler': 2000})
+        self.assertEqual(dispatcher.dispatch(60, 500, 2300, 50), {'boiler': 2000})  # Clouds, kept on
+        self.assertEqual(dispatcher.dispatch(600, 500, 2300, 50), {'boiler': 0})
+        self.assertEqual(dispatcher.dispatch(660, 2500, 300, 50), {'boiler': 0})  # Sun again, kept off
+        self.assertEqual(dispatcher.dispatch(900, 2500, 300, 50), {'boiler': 2000})
+
+    def test_battery_levels(self):
+        boiler = SwitchedLoad('boiler', 1, 2000, assist_battery_level=60, force_battery_level=85)
+        self.assertEqual(boiler.decide(0, 1200, 50), 0)
+        self.assertEqual(boiler.decide(0, 1200, 70), 2000)  # Half of the power may come from the battery
+        self.assertEqual(boiler.decide(0, 0, 90), 2000)  # The battery is almost full
+
+    def test_import_limit_sheds_lowest_priority_first(self):
+        boiler = SwitchedLoad('boiler', 1, 2000, min_on_seconds=600)
+        heater = SwitchedLoad('heater', 2, 1500, min_on_seconds=600)
+        dispatcher = SurplusDispatcher()
+        dispatcher.register(boiler)
+        dispatcher.register(heater)
+        dispatcher.dispatch(0, 5000, 300, 50)
+        self.assertEqual((boiler.power, heater.power), (2000, 1500))
+        dispatcher.set_import_limit(3000)
+        # Clouds and a kettle, the grid import is over the limit by 1000 W, regardless of the minimum on time
+        self.assertEqual(dispatcher.dispatch(60, 0, 5800, 50, grid_import=4000), {'boiler': 2000, 'heater': 0})
+        self.assertEqual(dispatcher.headroom, 500)
+        self.assertEqual(dispatcher.dispatch(120, 0, 4300, 50, grid_import=3500), {'boiler': 0, 'heater': 0})
+
+    def test_import_limit_blocks_switching_on(self):
+        self.dispatcher.set_import_limit(3000)
+        # The surplus covers both loads, but only 1900 W of the grid import limit is left with the margin
+        allocation = self.dispatcher.dispatch(0, 5000, 300, 50, grid_import=600)
+        self.assertEqual(allocation, {'boiler': 0, 'heater': 1500})
+
+
+class SurplusTrackerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.car = SurplusTracker(6, 16, start_delay=60, stop_delay=120, min_on_seconds=300, min_off_seconds=300)
+        self.dispatcher = SurplusDispatcher()
+        self.dispatcher.register(self.car)
+
+    def test_starts_after_delay_and_ramps_up(self):
+        surplus = 12.4 * ONE_AMP
+        self.assertEqual(self.dispatcher.dispatch(0, surplus + 300, 300, 90), {'car': 0})
+        # Starts with the minimum current, raised by RAMP_UP_A per step
+        self.assertEqual(self.dispatcher.dispatch(60, surplus + 300, 300, 90), {'car': 8 * ONE_AMP})
+        # The house consumption contains the charging power
+        self.assertEqual(self.dispatcher.dispatch(70, surplus + 300, 300 + 8 * ONE_AMP, 90), {'car': 10 * ONE_AMP})
+        self.assertEqual(self.dispatcher.dispatch(80, surplus + 300, 300 + 10 * ONE_AMP, 90), {'car': 11 * ONE_AMP})
+        # 12 A would need DEADBAND_A more
+        self.assertEqual(self.dispatcher.dispatch(90, surplus + 300, 300 + 11 * ONE_AMP, 90), {'car': 11 * ONE_AMP})
+
+    def test_waits_for_battery(self):
+        self.assertEqual(self.dispatcher.dispatch(0, 10000, 300, 70), {'car': 0})
+        self.assertEqual(self.dispatcher.dispatch(120, 10000, 300, 70), {'car': 0})
+
+    def test_stops_after_deficit(self):
+        self.dispatcher.dispatch(0, 10 * ONE_AMP, 0, 90)
+        self.dispatcher.dispatch(60, 10 * ONE_AMP, 0, 90)
+        self.assertTrue(self.car.enabled)
+        charging = self.car.power
+        self.dispatcher.dispatch(400, 0, charging, 90)  # Deficit, the current goes down by RAMP_DOWN_A
+        self.assertTrue(self.car.enabled)
+        self.dispatcher.dispatch(520, 0, self.car.power, 90)
+        self.assertFalse(self.car.enabled)
+        self.assertEqual(self.car.power, 0)
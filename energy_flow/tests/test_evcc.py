@@ -0,0 +1,59 @@
+import requests
+from django.test import SimpleTestCase
+
+from benchmarks import evcc_stub
+from components.evcc import EvccClient
+
+
+class EvccClientTests(SimpleTestCase):
+    """
+    EvccClient against the evcc stub server.
+    """
+
+    def setUp(self):
+        server = evcc_stub.serve()
+        self.url, self.evcc = server.__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+        self.client = EvccClient(self.url, timeout=5)
+        self.addCleanup(self.client.close)
+
+    def test_apply_sends_current_before_enabling(self):
+        self.assertTrue(self.client.apply(True, 10))
+        self.assertEqual(self.evcc.posts(), ['/api/loadpoints/1/maxcurrent/10', '/api/loadpoints/1/mode/now'])
+        self.assertEqual(self.evcc.loadpoints[0], {'mode': 'now', 'maxCurrent': 10, 'chargePower': 0})
+
+    def test_apply_sends_only_changes(self):
+        self.client.apply(True, 10)
+        self.assertFalse(self.client.apply(True, 10))
+        self.client.apply(True, 12)
+        self.client.apply(False)
+        self.assertEqual(self.evcc.posts()[2:], ['/api/loadpoints/1/maxcurrent/12', '/api/loadpoints/1/mode/off'])
+
+    def test_force_sends_unchanged_state(self):
+        self.client.apply(False)
+        self.evcc.loadpoints[0]['mode'] = 'pv'  # Changed in the evcc UI
+        self.assertTrue(self.client.apply(False, force=True))
+        self.assertEqual(self.evcc.posts(), ['/api/loadpoints/1/mode/off', '/api/loadpoints/1/mode/off'])
+        self.assertEqual(self.evcc.loadpoints[0]['mode'], 'off')
+
+    def test_error_drops_cached_state(self):
+        self.client.apply(True, 10)
+        self.evcc.fail = True
+        with self.assertRaises(requests.HTTPError):
+            self.client.apply(True, 12)
+        self.assertEqual((self.client.enabled, self.client.current), (None, None))
+        self.evcc.fail = False
+        self.client.apply(True, 12)
+        self.assertEqual(self.evcc.posts()[-2:], ['/api/loadpoints/1/maxcurrent/12', '/api/loadpoints/1/mode/now'])
+
+    def test_refresh_reads_loadpoint(self):
+        self.evcc.loadpoints[0].update(mode='minpv', maxCurrent=8)
+        self.assertEqual(self.client.refresh(), (True, 8))
+        self.evcc.loadpoints[0]['mode'] = 'off'
+        self.assertEqual(self.client.refresh(), (False, 8))
+        self.assertFalse(self.client.apply(False, 8))
+
+    def test_charge_power(self):
+        self.assertEqual(self.client.charge_power(), 0)
+        self.evcc.loadpoints[0]['chargePower'] = 4140
+        self.assertEqual(self.client.charge_power(), 4140)
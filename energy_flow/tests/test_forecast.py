@@ -0,0 +1,88 @@
+import datetime
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from components.forecast import ProfileForecaster
+from components.ote import OTE_TIMEZONE
+
+
+def local_time(day, hour, minute=0):
+    return datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=OTE_TIMEZONE).timestamp()
+
+
+def history(first_day, days, ppv=1000):
+    """
+    15 minute buckets with PV between 10:00 and 16:00 local time, house load 400 W on working days and 900 W on
+    weekends, and the car charging with 2 kW from 12:00 to 13:00 on working days.
+
+    :return: tuple (timestamps, ppv, house consumption, car)
+    """
+    timestamps, pv, house, car = [], [], [], []
+    for offset in range(days):
+        day = first_day + datetime.timedelta(days=offset)
+        for slot in range(96):
+            charging = 2000 if day.weekday() < 5 and 48 <= slot < 52 else 0
+            timestamps.append(local_time(day, slot // 4, slot % 4 * 15))
+            pv.append(ppv if 40 <= slot < 64 else 0)
+            house.append((400 if day.weekday() < 5 else 900) + charging)
+            car.append(charging)
+    return np.array(timestamps), np.array(pv, dtype=float), np.array(house, dtype=float), np.array(car, dtype=float)
+
+
+class ProfileForecasterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.first_day = datetime.date(2024, 6, 3)  # Monday
+        self.monday = datetime.date(2024, 6, 17)  # The day after two weeks of history
+        self.now = local_time(self.monday, 0)
+        self.forecaster = ProfileForecaster().fit(*history(self.first_day, 14), now=self.now)
+
+    def assertForecast(self, forecaster, moment, expected, slot_minutes=15):
+        ppv, load = forecaster.forecast([moment], slot_minutes)
+        np.testing.assert_allclose([ppv[0], load[0]], expected)
+
+    def test_profiles(self):
+        self.assertTrue(self.forecaster.ready)
+        self.assertForecast(self.forecaster, local_time(self.monday, 2), (0, 400))
+        # The car is not a part of the house load
+        self.assertForecast(self.forecaster, local_time(self.monday, 12), (1000, 400))
+        self.assertForecast(self.forecaster, local_time(datetime.date(2024, 6, 22), 12), (1000, 900))  # Saturday
+
+    def test_longer_slots(self):
+        self.assertForecast(self.forecaster, local_time(self.monday, 9, 45), (750, 400), slot_minutes=60)
+        net_load = self.forecaster.net_load_kwh([local_time(self.monday, 9, 45)], np.array([1.]))
+        self.assertAlmostEqual(net_load[0], -0.35)  # (400 W - 750 W) * 1 h
+
+    def test_recent_days_weigh_more(self):
+        timestamps, ppv, house, car = history(self.first_day, 14)
+        ppv[len(ppv) // 2:] *= 2  # The second week was twice as sunny
+        forecaster = ProfileForecaster().fit(timestamps, ppv, house, car, now=self.now)
+        ppv, _ = forecaster.forecast([local_time(self.monday, 12)], 15)
+        self.assertGreater(ppv[0], 1500)
+        self.assertLess(ppv[0], 2000)
+
+    def test_missing_values(self):
+        timestamps, ppv, house, car = history(self.first_day, 14)
+        ppv[48:96 * 10:96] = np.nan  # No PV reading at noon for the first 10 days
+        house[:96 * 11] = np.nan  # No house load for the first 11 days
+        forecaster = ProfileForecaster().fit(timestamps, ppv, house, car, now=self.now)
+        self.assertTrue(forecaster.ready)  # 3 days with both readings are enough
+        self.assertForecast(forecaster, local_time(self.monday, 12), (1000, 400))
+
+    def test_not_enough_history(self):
+        forecaster = ProfileForecaster(min_days=3).fit(*history(self.first_day, 2), now=self.now)
+        self.assertFalse(forecaster.ready)
+        self.assertIsNone(forecaster.forecast([self.now], 15))
+        self.assertIsNone(forecaster.net_load_kwh([self.now], np.array([1.])))
+
+    def test_fit_store_excludes_boiler_and_car(self):
+        timestamps, ppv, house, car = history(self.first_day, 14)
+        boiler = np.where((timestamps - timestamps[0]) % 86400 // 900 == 44, 1800., 0.)  # Boiler at 11:00 every day
+        rows = [{'ts': ts, 'ppv': pv, 'house_consumption': load + on, 'boiler': on or None, 'car': charging}
+                for ts, pv, load, on, charging in zip(timestamps, ppv, house, boiler, car)]
+        store = SimpleNamespace(query=lambda start, end, resolution: rows)
+        forecaster = ProfileForecaster().fit_store(store, now=self.now)
+        self.assertForecast(forecaster, local_time(self.monday, 11), (1000, 400))
+        self.assertForecast(forecaster, local_time(self.monday, 12), (1000, 400))
@@ -0,0 +1,83 @@
+import asyncio
+
+from django.test import SimpleTestCase
+from goodwe import OperationMode
+
+from benchmarks.cases import fake_client
+from components.goodwe_utils import ModeWriter
+
+
+class ModeWriterTests(SimpleTestCase):
+    """
+    ModeWriter writing to a fake inverter through a real InverterClient.
+    """
+
+    def setUp(self):
+        client = fake_client()
+        self.client = client.__enter__()
+        self.addCleanup(client.__exit__, None, None, None)
+        self.inverter = self.client.call(lambda inverter: asyncio.sleep(0, inverter))  # Connects the fake inverter
+        self.writes = []
+        set_operation_mode = self.inverter.set_operation_mode
+
+        async def record(operation_mode, *args):
+            self.writes.append((operation_mode,) + args)
+            await set_operation_mode(operation_mode, *args)
+        self.inverter.set_operation_mode = record
+
+    async def test_writes_only_changes(self):
+        writer = ModeWriter(self.client, min_dwell_seconds=0)
+        self.assertEqual(await writer.submit('battery', OperationMode.ECO_CHARGE, eco_mode_soc=80),
+                         OperationMode.ECO_CHARGE)
+        self.assertEqual(await writer.submit('battery', OperationMode.ECO_CHARGE, eco_mode_soc=80),
+                         OperationMode.ECO_CHARGE)
+        self.assertEqual(self.writes, [(OperationMode.ECO_CHARGE, 100, 80)])
+        await writer.submit('battery', OperationMode.ECO_CHARGE, eco_mode_soc=90)  # New eco parameters are written
+        self.assertEqual(self.writes[-1], (OperationMode.ECO_CHARGE, 100, 90))
+
+    async def test_dwell_time_postpones_change(self):
+        writer = ModeWriter(self.client, min_dwell_seconds=0.3)
+        await writer.submit('battery', OperationMode.ECO_CHARGE)
+        self.assertEqual(await writer.submit('battery', OperationMode.ECO_DISCHARGE), OperationMode.ECO_CHARGE)
+        self.assertEqual(self.inverter.operation_mode, OperationMode.ECO_CHARGE)
+        await asyncio.sleep(0.6)  # The postponed mode is written once the dwell time elapses
+        self.assertEqual(self.inverter.operation_mode, OperationMode.ECO_DISCHARGE)
+        self.assertEqual(writer.operation_mode, OperationMode.ECO_DISCHARGE)
+        self.assertEqual(len(self.writes), 2)
+
+    async def test_stop_is_not_postponed(self):
+        writer = ModeWriter(self.client, min_dwell_seconds=300)
+        await writer.submit('battery', OperationMode.ECO_DISCHARGE, eco_mode_soc=20)
+        # Leaving the active mode, e.g. at the battery reserve, does not wait for the dwell time
+        self.assertEqual(await writer.submit('battery', OperationMode.GENERAL), OperationMode.GENERAL)
+        self.assertEqual(self.inverter.operation_mode, OperationMode.GENERAL)
+        # Entering an active mode again does
+        self.assertEqual(await writer.submit('battery', OperationMode.ECO_CHARGE), OperationMode.GENERAL)
+        self.assertEqual([write[0] for write in self.writes], [OperationMode.ECO_DISCHARGE, OperationMode.GENERAL])
+
+    async def test_force_ignores_dwell_time(self):
+        writer = ModeWriter(self.client, min_dwell_seconds=300)
+        await writer.submit('battery', OperationMode.ECO_CHARGE)
+        self.assertEqual(await writer.submit('battery', OperationMode.GENERAL, force=True), OperationMode.GENERAL)
+        self.assertEqual(self.inverter.operation_mode, OperationMode.GENERAL)
+
+    async def test_lower_priority_number_wins(self):
+        writer = ModeWriter(self.client, min_dwell_seconds=0)
+        await writer.submit('battery', OperationMode.ECO_CHARGE, priority=10)
+        self.assertEqual(await writer.submit('peak_limiter', OperationMode.GENERAL, priority=0),
+                         OperationMode.GENERAL)
+        # The battery task keeps asking, the limiter still wins
+        self.assertEqual(await writer.submit('battery', OperationMode.ECO_DISCHARGE, priority=10),
+                         OperationMode.GENERAL)
+        self.assertEqual(await writer.release('peak_limiter'), OperationMode.ECO_DISCHARGE)
+        self.assertEqual(await writer.release('battery'), OperationMode.GENERAL)
+        self.assertEqual([write[0] for write in self.writes],
+                         [OperationMode.ECO_CHARGE, OperationMode.GENERAL, OperationMode.ECO_DISCHARGE,
+                          OperationMode.GENERAL])
+
+    async def test_reads_mode_changed_in_app(self):
+        writer = ModeWriter(self.client, min_dwell_seconds=0, verify_interval=0)
+        await writer.submit('battery', OperationMode.ECO_CHARGE)
+        self.inverter.operation_mode = OperationMode.GENERAL  # Changed in the GoodWe app
+        self.assertEqual(await writer.submit('battery', OperationMode.ECO_CHARGE), OperationMode.ECO_CHARGE)
+        self.assertEqual(len(self.writes), 2)
@@ -0,0 +1,178 @@
+import concurrent.futures
+import datetime
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from benchmarks import ote_stub
+from benchmarks.cases import FIXTURES, OTE_PAGES, PRICE_DAY
+from components import ote
+
+
+class PageSession:
+    """
+    Stands for requests.Session, answers every request with the page.
+    """
+
+    def __init__(self, page):
+        self.page = page
+
+    def get(self, url, timeout):
+        return SimpleNamespace(text=self.page, raise_for_status=lambda: None)
+
+
+class OtePricesTests(SimpleTestCase):
+
+    def page(self, resolution=60):
+        return (FIXTURES / OTE_PAGES[resolution]).read_text(encoding='utf-8')
+
+    def test_parse_prices(self):
+        labels, prices = ote.parse_prices(self.page())
+        self.assertEqual(labels[:24], [str(hour) for hour in range(1, 25)])
+        self.assertEqual(len(labels), 25)  # Followed by the summary row
+        self.assertTrue(all(isinstance(price, float) for price in prices))
+
+    def test_get_prices(self):
+        for resolution in (60, 15):
+            series = ote.get_prices(PRICE_DAY, [1] * 24, PageSession(self.page(resolution)))
+            self.assertEqual((series.resolution, len(series.prices)), (resolution, 24 * 60 // resolution))
+            self.assertEqual(list(series.prices), ote.parse_prices(self.page(resolution))[1][:len(series.prices)])
+
+    def test_missing_slot(self):
+        page = self.page()
+        start = page.index('<tr><th>5</th>')
+        page = page[:start] + page[page.index('<tr>', start + 1):]
+        with self.assertRaisesRegex(AssertionError, 'got 23 slots and 1 other rows'):
+            ote.get_prices(PRICE_DAY, session=PageSession(page))
+
+    def test_unexpected_labels(self):
+        page = self.page().replace('<tr><th>5</th>', '<tr><th>Celkem</th>', 1)
+        with self.assertRaisesRegex(AssertionError, 'got 4 slots and 21 other rows'):
+            ote.get_prices(PRICE_DAY, session=PageSession(page))
+
+    def test_interval_labels(self):
+        for resolution in (60, 15):
+            page = self.page(resolution)
+            for slot in range(24 * 60 // resolution, 0, -1):  # From the end, so slot 1 does not replace slot 10
+                start = datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=(slot - 1) * resolution)
+                end = start + datetime.timedelta(minutes=resolution)
+                page = page.replace(f'<tr><th>{slot}</th>', f'<tr><th>{start:%H:%M} - {end:%H:%M}</th>', 1)
+            series = ote.get_prices(PRICE_DAY, [1] * 24, PageSession(page))
+            self.assertEqual(list(series.prices), ote.parse_prices(self.page(resolution))[1][:24 * 60 // resolution])
+
+    def test_missing_price(self):
+        page = self.page()
+        start = page.index('<tr><th>5</th>')
+        page = page[:start] + '<tr><th>5</th><td colspan="5">-</td></tr>' + page[page.index('<tr>', start + 1):]
+        with self.assertRaisesRegex(AssertionError, 'Missing price of slot 5'):
+            ote.get_prices(PRICE_DAY, session=PageSession(page))
+
+    def test_http_error(self):
+        with ote_stub.serve() as base_url:
+            with self.assertRaises(requests.HTTPError):  # The stub answers 404 without a date
+                ote.get_prices(PRICE_DAY, base_url=base_url.replace('?date=', '?day='))
+
+    @mock.patch.dict(ote._prefetch_retry_at, clear=True)
+    def test_prefetch_backs_off(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(ote, '_price_store', ote.PriceStore(Path(directory) / 'prices.sqlite3')), \
+                mock.patch.object(ote, 'fetch_prices', side_effect=AssertionError('not published')) as fetch:
+            self.assertFalse(ote.prefetch_prices(PRICE_DAY, now=1000))
+            self.assertFalse(ote.prefetch_prices(PRICE_DAY, now=1000 + ote.PREFETCH_RETRY_SECONDS - 1))
+            self.assertEqual(fetch.call_count, 1)
+            self.assertFalse(ote.prefetch_prices(PRICE_DAY, now=1000 + ote.PREFETCH_RETRY_SECONDS))
+            self.assertEqual(fetch.call_count, 2)
+
+    def test_price_store_closes_connections(self):
+        connections, connect = [], sqlite3.connect
+
+        def tracked(*args, **kwargs):
+            connections.append(connect(*args, **kwargs))
+            return connections[-1]
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(sqlite3, 'connect', tracked):
+            store = ote.PriceStore(Path(directory) / 'prices.sqlite3')
+            store.put(ote.PriceSeries(PRICE_DAY, range(24)))
+            self.assertEqual(store.get(PRICE_DAY).prices.tolist(), list(range(24)))
+            self.assertIn(PRICE_DAY, store)
+        self.assertEqual(len(connections), 4)
+        for connection in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):  # Closed
+                connection.execute('SELECT 1')
+
+    @mock.patch.dict(ote._prefetch_retry_at, clear=True)
+    def test_concurrent_prefetch_downloads_once(self):
+        def fetch(day):
+            time.sleep(0.2)
+            raise requests.ConnectionError('offline')
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(ote, '_price_store', ote.PriceStore(Path(directory) / 'prices.sqlite3')), \
+                mock.patch.object(ote, 'fetch_prices', side_effect=fetch) as fetch_prices, \
+                concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(ote.prefetch_prices, [PRICE_DAY] * 4))
+        self.assertEqual(results, [False] * 4)
+        self.assertEqual(fetch_prices.call_count, 1)
+
+    @mock.patch.dict(ote._prefetch_retry_at, clear=True)
+    def test_current_prices_do_not_wait(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(ote, '_price_store', ote.PriceStore(Path(directory) / 'prices.sqlite3')), \
+                mock.patch.object(ote, 'fetch_prices', side_effect=requests.ConnectionError('offline')) as fetch, \
+                mock.patch.object(ote.time, 'sleep', side_effect=AssertionError('must not sleep')):
+            for _ in range(3):  # Retried only after OTE_RETRY_SECONDS
+                with self.assertRaises(ote.PricesUnavailableError):
+                    ote.get_current_prices(PRICE_DAY)
+            self.assertEqual(fetch.call_count, 1)
+
+    def test_prefetch_tomorrow_in_ote_time(self):
+        utc = datetime.timezone.utc
+        with mock.patch.object(ote, 'prefetch_prices', return_value=True) as prefetch:
+            self.assertFalse(ote.prefetch_tomorrow(datetime.datetime(2024, 10, 20, 11, 30, tzinfo=utc)))  # 13:30
+            self.assertFalse(prefetch.called)
+            self.assertTrue(ote.prefetch_tomorrow(datetime.datetime(2024, 10, 20, 12, 30, tzinfo=utc)))  # 14:30
+            prefetch.assert_called_once_with('2024-10-21')
+
+
+class OteDstTests(SimpleTestCase):
+    """
+    Prices of the days with the daylight saving time changes, 23 and 25 hours long.
+    """
+
+    def prices(self, day, weights=(1,) * 24):
+        page = (FIXTURES / f'ote_{day}_60min.html').read_text(encoding='utf-8')
+        return ote.get_prices(day, weights, PageSession(page))
+
+    def test_short_day(self):
+        series = self.prices('2024-03-31')  # The hourly slots are followed by two summary rows
+        self.assertEqual((len(series), series.resolution), (23, 60))
+        self.assertEqual([series.slot_start(slot).hour for slot in range(4)], [0, 1, 3, 4])
+        self.assertEqual(series.index_at(datetime.datetime(2024, 3, 31, 3, 30, tzinfo=ote.OTE_TIMEZONE)), 2)
+
+    def test_long_day(self):
+        series = self.prices('2024-10-27')
+        self.assertEqual((len(series), series.resolution), (25, 60))
+        self.assertEqual([series.slot_start(slot).hour for slot in range(5)], [0, 1, 2, 2, 3])
+        self.assertEqual(series.slot_start(24).hour, 23)
+
+    def test_weights_follow_local_hours(self):
+        weights = tuple(0.5 if hour == 2 else 1 for hour in range(24))
+        plain, weighted = self.prices('2024-10-27'), self.prices('2024-10-27', weights)
+        self.assertEqual(list(weighted.prices / plain.prices), [1, 1, 0.5, 0.5] + [1] * 21)
+
+    def test_long_day_interval_labels(self):
+        page = (FIXTURES / 'ote_2024-10-27_60min.html').read_text(encoding='utf-8')
+        for slot in range(25, 0, -1):  # The hour 02-03 is repeated
+            hour = slot - 1 if slot <= 3 else slot - 2
+            page = page.replace(f'<tr><th>{slot}</th>', f'<tr><th>{hour:02d}:00 - {hour + 1:02d}:00</th>', 1)
+        series = ote.get_prices('2024-10-27', [1] * 24, PageSession(page))
+        self.assertEqual(list(series.prices), list(self.prices('2024-10-27').prices))
+
+    def test_wrong_day_length(self):
+        page = (FIXTURES / 'ote_2024-10-27_60min.html').read_text(encoding='utf-8')
+        with self.assertRaisesRegex(AssertionError, 'got 25 slots'):
+            ote.get_prices(PRICE_DAY, session=PageSession(page))  # 25 slots on a regular day
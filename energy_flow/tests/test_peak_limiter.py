@@ -0,0 +1,100 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+from goodwe import OperationMode
+
+from components import peak_limiter
+from components.dispatcher import SurplusDispatcher
+from components.peak_limiter import BATTERY_RELEASE_DELAY_SECONDS, PEAK_LIMITER_MODE_PRIORITY, peak_limiter_task
+from components.status import StatusCache
+from components.telemetry import TelemetrySample, TelemetrySampler
+from energy_flow.live_config import LiveConfig
+
+
+class FakeSampler(TelemetrySampler):
+    """
+    Sampler without the inverter, the samples are appended by the test.
+    """
+
+    def subscribe(self):
+        pass
+
+    def unsubscribe(self):
+        pass
+
+
+class FakeModeWriter:
+    """
+    Stands for the ModeWriter with the battery task charging from the grid, records the requests.
+    """
+
+    def __init__(self):
+        self.operation_mode = OperationMode.ECO_CHARGE
+        self.requests = []
+
+    async def submit(self, source, operation_mode, priority=10, force=False, **kwargs):
+        self.requests.append(('submit', source, operation_mode, priority, force))
+        self.operation_mode = operation_mode
+        return operation_mode
+
+    async def release(self, source, force=True):
+        self.requests.append(('release', source, force))
+        self.operation_mode = OperationMode.ECO_CHARGE  # Back to the request of the battery task
+        return self.operation_mode
+
+
+class PeakLimiterTaskTests(SimpleTestCase):
+    """
+    Import limit of 10 kW with the battery charging from the grid with 5 kW.
+    """
+
+    def setUp(self):
+        self.sampler = FakeSampler('limiter-test')
+        self.mode_writer = FakeModeWriter()
+        self.config = LiveConfig({'INVERTER_IP_ADDRESS': 'limiter-test', 'GRID_IMPORT_LIMIT_W': 10000,
+                                  'BATTERY_CHARGE_POWER_KW': 5})
+        self.timestamp = 1729418400.
+        for target, value in (('get_sampler', lambda inverter_ip_address: self.sampler),
+                              ('get_mode_writer', lambda inverter_ip_address: self.mode_writer),
+                              ('get_dispatcher', lambda inverter_ip_address: SurplusDispatcher()),
+                              ('get_status', StatusCache)):
+            patcher = mock.patch.object(peak_limiter, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def grid_import(self, power, seconds=10):
+        self.timestamp += seconds
+        self.sampler._append(TelemetrySample(self.timestamp, 0, power, 50, -power))
+        await asyncio.sleep(0.01)  # The limiter follows the sample
+
+    async def test_battery_override_and_release(self):
+        task = asyncio.create_task(peak_limiter_task(self.config))
+        try:
+            await self.grid_import(9000)
+            self.assertEqual(self.mode_writer.requests, [])
+            await self.grid_import(12000)  # Over the limit while charging
+            self.assertEqual(self.mode_writer.requests,
+                             [('submit', 'peak_limiter', OperationMode.GENERAL, PEAK_LIMITER_MODE_PRIORITY, True)])
+            await self.grid_import(8000)  # Under the limit, but the charging would exceed it again
+            await self.grid_import(4000)  # The headroom covers the charging from now on
+            await self.grid_import(4000, BATTERY_RELEASE_DELAY_SECONDS - 1)
+            self.assertEqual(len(self.mode_writer.requests), 1)
+            await self.grid_import(4000, 1)
+            self.assertEqual(self.mode_writer.requests[1:], [('release', 'peak_limiter', False)])
+            await self.grid_import(12000)  # Stopped again on the next peak
+            self.assertEqual(len(self.mode_writer.requests), 3)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.assertEqual(self.mode_writer.requests[-1], ('release', 'peak_limiter', False))  # Released on the stop
+
+    async def test_other_modes_are_kept(self):
+        self.mode_writer.operation_mode = OperationMode.GENERAL  # Not charging from the grid
+        task = asyncio.create_task(peak_limiter_task(self.config))
+        try:
+            await self.grid_import(12000)
+            self.assertEqual(self.mode_writer.requests, [])
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
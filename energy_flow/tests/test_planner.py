@@ -0,0 +1,69 @@
+import datetime
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from components.planner import plan_charge_schedule
+
+
+class PlanChargeScheduleTests(SimpleTestCase):
+    """
+    Dynamic programming over the battery level, 10 kWh battery charged with 5 kW, i.e. 50% per hour.
+    """
+
+    def plan(self, prices, battery_level=50, upper_level=100, **kwargs):
+        return plan_charge_schedule(np.asarray(prices, dtype=float), np.ones(len(prices)), battery_level, 10, 5,
+                                    upper_level, **kwargs)
+
+    def test_charges_in_cheapest_slot(self):
+        plan = self.plan([100, 10, 100, 200], terminal_price=50)
+        self.assertEqual(plan.charge.tolist(), [False, True, False, False])
+        self.assertEqual(plan.levels.tolist(), [50, 50, 100, 100, 100])
+        self.assertAlmostEqual(plan.cost, 0.05)  # 5 kWh for 10 EUR/MWh
+
+    def test_idles_when_energy_is_worth_less_than_its_price(self):
+        plan = self.plan([100, 100, 100], terminal_price=50)
+        self.assertFalse(plan.charge.any())
+        self.assertEqual(plan.cost, 0)
+
+    def test_buys_cheap_energy_for_expensive_load(self):
+        plan = self.plan([10, 10, 300, 300], battery_level=20, upper_level=90, net_load_kwh=np.full(4, 2.),
+                         terminal_price=0)
+        self.assertEqual(plan.charge.tolist(), [True, True, False, False])
+        self.assertEqual(plan.levels.tolist(), [20, 50, 70, 50, 30])  # Charging stops at the upper level
+        self.assertAlmostEqual(plan.cost, 0.09)  # Nothing is bought for 300 EUR/MWh
+
+    def test_keeps_minimum_level(self):
+        plan = self.plan([100, 100], battery_level=30, net_load_kwh=np.full(2, 2.), terminal_price=0)
+        self.assertFalse(plan.charge.any())
+        self.assertEqual(plan.levels.tolist(), [30, 10, 10])  # The rest of the load is bought from the grid
+        self.assertAlmostEqual(plan.cost, 0.2)
+
+    def test_pv_surplus_charges_for_free(self):
+        plan = self.plan([100, 100, 100, 100], battery_level=20, upper_level=90, net_load_kwh=[-3, -3, 0, 0])
+        self.assertFalse(plan.charge.any())
+        self.assertEqual(plan.levels.tolist(), [20, 50, 80, 80, 80])
+        self.assertEqual(plan.cost, 0)
+
+    def test_sub_level_loads_add_up(self):
+        # 96 quarter hours with 0.05 kWh each, half of a battery level, 4.8 kWh in total
+        plan = self.plan(np.full(96, 100.), battery_level=80, net_load_kwh=np.full(96, 0.05), terminal_price=0)
+        self.assertFalse(plan.charge.any())
+        self.assertEqual(plan.levels[-1], 32)
+        self.assertTrue(np.all(np.diff(plan.levels) >= -1))  # Spread over the day, at most a level per slot
+        plan = self.plan(np.full(96, 100.), battery_level=20, net_load_kwh=np.full(96, -0.03), terminal_price=0)
+        self.assertEqual(plan.levels[-1], 49)  # 2.88 kWh of PV surplus, rounded to whole levels
+
+    def test_slot_times(self):
+        start = datetime.datetime(2024, 10, 20, tzinfo=datetime.timezone.utc).timestamp()
+        starts = start + np.arange(4) * 900
+        plan = plan_charge_schedule(np.array([10, 20, 30, 40.]), np.full(4, 0.25), 20, 10, 8, 90, terminal_price=100,
+                                    starts=starts)
+        self.assertEqual(plan.levels.tolist(), [20, 40, 60, 80, 90])  # 2 kWh per 15 minutes
+        self.assertEqual(plan.end, start + 3600)
+        moment = datetime.datetime.fromtimestamp(start + 450, datetime.timezone.utc)
+        self.assertEqual(plan.index_at(moment), 0)
+        self.assertEqual(plan.expected_level(moment), 30)
+        self.assertTrue(plan.drifted(moment, 40))
+        self.assertFalse(plan.drifted(moment, 33))
+        self.assertIsNone(plan.index_at(datetime.datetime.fromtimestamp(start + 3600, datetime.timezone.utc)))
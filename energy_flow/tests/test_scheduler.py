@@ -0,0 +1,50 @@
+from django.test import SimpleTestCase
+
+from components.scheduler import AdaptiveScheduler, BACKOFF_FACTOR, BOUNDARY_DELAY_SECONDS, seconds_to_boundary
+
+SLOT_START = 1729418400  # 2024-10-20 10:00 UTC, a slot boundary
+
+
+class AdaptiveSchedulerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.scheduler = AdaptiveScheduler('test', min_interval=10, max_interval=60, stable_change=1, busy_change=5,
+                                           slot_minutes=None)
+
+    def test_backs_off_with_stable_input(self):
+        intervals = [self.scheduler.update(50, SLOT_START) for _ in range(8)]
+        self.assertEqual(intervals[:3], [10, 10 * BACKOFF_FACTOR, 10 * BACKOFF_FACTOR ** 2])
+        self.assertEqual(intervals[-1], 60)
+
+    def test_fast_change_resets_rate(self):
+        for _ in range(8):
+            self.scheduler.update(50, SLOT_START)
+        self.assertEqual(self.scheduler.update(53, SLOT_START), 60)  # Between stable and busy, the rate is kept
+        self.assertEqual(self.scheduler.update(60, SLOT_START), 10)
+
+    def test_unknown_input_keeps_rate(self):
+        self.scheduler.update(50, SLOT_START)
+        interval = self.scheduler.update(50, SLOT_START)
+        self.assertEqual(self.scheduler.update(None, SLOT_START), interval)
+        self.assertEqual(self.scheduler.update(50, SLOT_START), interval * BACKOFF_FACTOR)  # Compared to the last value
+
+    def test_wakes_up_after_slot_boundary(self):
+        scheduler = AdaptiveScheduler('test', 10, 600, 1, 5, slot_minutes=15)
+        for _ in range(20):
+            scheduler.update(50, SLOT_START + 60)
+        self.assertEqual(scheduler.interval, 600)
+        self.assertEqual(scheduler.update(50, SLOT_START + 60), 600)
+        self.assertEqual(scheduler.update(50, SLOT_START + 600), 300 + BOUNDARY_DELAY_SECONDS)  # Never skips it
+        self.assertEqual(scheduler.update(50, SLOT_START + 870), 10)  # Fastest rate right before the boundary
+        self.assertEqual(scheduler.update(50, SLOT_START + 895), 5 + BOUNDARY_DELAY_SECONDS)
+
+    def test_reset(self):
+        for _ in range(8):
+            self.scheduler.update(50, SLOT_START)
+        self.scheduler.reset()
+        self.assertEqual(self.scheduler.update(50, SLOT_START), 10)
+
+    def test_seconds_to_boundary(self):
+        self.assertEqual(seconds_to_boundary(SLOT_START), 900)
+        self.assertEqual(seconds_to_boundary(SLOT_START + 899.5), 0.5)
+        self.assertEqual(seconds_to_boundary(SLOT_START + 1800, slot_minutes=60), 1800)
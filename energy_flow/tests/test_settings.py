@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.forms import model_to_dict
+from django.test import SimpleTestCase, TestCase
+
+from energy_flow import live_config, settings_cache, views
+from energy_flow.live_config import ConfigSnapshot, LiveConfig
+from energy_flow.models import GeneralSettings
+
+
+class FakeSupervisor:
+    """
+    Stands for the TaskSupervisor, records what was done with the tasks.
+    """
+
+    def __init__(self, running):
+        self.running = set(running)
+        self.started, self.stopped, self.woken = [], [], []
+
+    def start(self, task_name, task_function, *args, wait=True):
+        self.started.append(task_name)
+        self.running.add(task_name)
+
+    def stop(self, task_name, wait=True):
+        self.stopped.append(task_name)
+        self.running.discard(task_name)
+
+    def wake(self, task_name):
+        self.woken.append(task_name)
+
+    def is_running(self, task_name):
+        return task_name in self.running
+
+
+class ReconcileTasksTests(SimpleTestCase):
+    """
+    Which settings changes restart the tasks and which are applied by the running tasks.
+    """
+
+    def setUp(self):
+        self.values = dict(model_to_dict(GeneralSettings()), BATTERY_ENABLED=True, BOJLER_ENABLED=True,
+                           CAR_ENABLED=True, PEAK_LIMITER_ENABLED=False)
+        self.previous = ConfigSnapshot(1, self.values)
+        self.supervisor = FakeSupervisor(['battery_charging', 'boiler_task', 'car_charging'])
+        self.sampler = mock.Mock()
+        for target, value in (('get_supervisor', lambda: self.supervisor),
+                              ('get_sampler', lambda inverter_ip_address: self.sampler)):
+            patcher = mock.patch.object(views, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def reconcile(self, **changes):
+        views.reconcile_tasks(self.previous, ConfigSnapshot(2, dict(self.values, **changes)))
+
+    def test_live_setting_wakes_tasks(self):
+        self.reconcile(BOJLER_CONSUMPTION=self.values['BOJLER_CONSUMPTION'] + 500, BATTERY_UPPER_LEVEL=80)
+        self.assertEqual((self.supervisor.started, self.supervisor.stopped), ([], []))
+        self.assertEqual(self.supervisor.woken, ['battery_charging', 'boiler_task', 'car_charging'])
+        self.sampler.wake.assert_called_once_with()
+
+    def test_restart_setting_restarts_its_task(self):
+        self.reconcile(BOJLER_TAPO_IP_ADDRESS='192.168.1.250')
+        self.assertEqual(self.supervisor.started, ['boiler_task'])
+        self.assertEqual(self.supervisor.woken, ['battery_charging', 'car_charging'])
+        self.reconcile(INVERTER_IP_ADDRESS='192.168.1.251')  # Read by every task only at the start
+        self.assertEqual(self.supervisor.started, ['boiler_task', 'battery_charging', 'boiler_task', 'car_charging'])
+
+    def test_enable_flags(self):
+        self.reconcile(CAR_ENABLED=False, PEAK_LIMITER_ENABLED=True)
+        self.assertEqual(self.supervisor.stopped, ['car_charging'])
+        self.assertEqual(self.supervisor.started, ['peak_limiter'])
+
+    def test_unchanged_settings(self):
+        self.reconcile()
+        self.assertEqual((self.supervisor.started, self.supervisor.stopped, self.supervisor.woken), ([], [], []))
+        self.sampler.wake.assert_not_called()
+
+
+class SettingsCacheTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(live_config, '_live_config', LiveConfig())  # Empty cache of this test
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_save_refreshes_cache(self):
+        settings = settings_cache.get_settings()
+        self.assertEqual(GeneralSettings.objects.count(), 1)  # Created with the defaults on first use
+        with self.assertNumQueries(0):
+            self.assertEqual(settings_cache.get_settings().version, settings.version)
+
+        stored = GeneralSettings.objects.get()
+        stored.BOJLER_CONSUMPTION = settings['BOJLER_CONSUMPTION'] + 500
+        stored.save()  # The post_save signal refreshes the cache
+        with self.assertNumQueries(0):
+            refreshed = settings_cache.get_settings()
+        self.assertGreater(refreshed.version, settings.version)
+        self.assertEqual(refreshed['BOJLER_CONSUMPTION'], settings['BOJLER_CONSUMPTION'] + 500)
+        self.assertEqual(settings_cache.get_settings_instance().BOJLER_CONSUMPTION, stored.BOJLER_CONSUMPTION)
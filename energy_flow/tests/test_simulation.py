@@ -0,0 +1,43 @@
+import datetime
+
+import numpy as np
+from django.test import SimpleTestCase
+from goodwe import OperationMode
+
+from components.ote import PriceSeries, OTE_TIMEZONE
+from components.simulation import Simulation, SimulatedInverter
+
+SETTINGS = dict(BATTERY_ENABLED=True, BOJLER_ENABLED=False, CAR_ENABLED=False, CHARGE_THRESHOLD_EUR=0,
+                BATTERY_UPPER_LEVEL=90, CHARGE_HOURS=0, LOCAL_EXTREME_HOURS_WINDOW=4, BATTERY_CAPACITY_KWH=10,
+                BATTERY_CHARGE_POWER_KW=5, BATTERY_MODE='sell', SELL_THRESHOLD_EUR=200, BATTERY_RESERVE_LEVEL=30,
+                BOJLER_CONSUMPTION=2000, BOJLER_PRIORITY=1, CAR_PRIORITY=2, MIN_CURRENT_A=6, MAX_CURRENT_A=16)
+
+
+class SimulationTests(SimpleTestCase):
+    """
+    A day without PV and house load with a 3 hour price peak from 17:00, 10 kWh battery discharged with 5 kW.
+    """
+
+    def run_day(self, step_minutes):
+        day = '2024-10-20'
+        start = datetime.datetime(2024, 10, 20, tzinfo=OTE_TIMEZONE).timestamp()
+        timestamps = np.arange(start, start + 86400, step_minutes * 60.)
+        prices = {day: PriceSeries(day, [100] * 17 + [250, 300, 250] + [100] * 4)}
+        simulation = Simulation(timestamps, np.zeros(len(timestamps)), np.zeros(len(timestamps)), prices, SETTINGS,
+                                battery_level=80)
+        return simulation.run()
+
+    def test_selling_stops_at_reserve(self):
+        for step_minutes in (1, 5, 15):
+            report = self.run_day(step_minutes)
+            step_level = 5 * step_minutes / 60 / 10 * 100  # Battery level discharged in one step (%)
+            self.assertLessEqual(report['battery_level'], 30, step_minutes)
+            self.assertGreaterEqual(report['battery_level'], 30 - step_level, step_minutes)
+            self.assertEqual(report['battery_mode_switches'], 2, step_minutes)  # Into the discharge and out once
+            self.assertAlmostEqual(report['grid_export_kwh'], (80 - report['battery_level']) / 10, msg=step_minutes)
+
+    def test_discharge_ignores_eco_mode_soc(self):
+        inverter = SimulatedInverter(10, 5, battery_level=35, min_level=10)
+        inverter.set_operation_mode(OperationMode.ECO_DISCHARGE, eco_mode_soc=30)
+        inverter.step(1, 0, 0)
+        self.assertEqual(inverter.battery_level, 10)  # Only the depth of discharge stops it
@@ -0,0 +1,89 @@
+import sys
+import types
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from components import tapo_utils
+from components.tapo_utils import TAPO_INITIAL_BACKOFF, TAPO_MAX_BACKOFF, TapoError, TapoSession
+
+
+class FakeP110:
+    """
+    Stands for PyP100.PyP110.P110, every plug object fails the requests listed in `failures` first.
+    """
+    plugs = []  # Every created plug
+    failures = []  # Exceptions raised by the next requests, shared by all plugs
+
+    def __init__(self, ip_address, username, password):
+        self.ip_address = ip_address
+        self.logged_in = False
+        self.on = False
+        self.plugs.append(self)
+
+    def handshake(self):
+        pass
+
+    def login(self):
+        self.logged_in = True
+
+    def request(self):
+        assert self.logged_in
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def getDeviceInfo(self):
+        self.request()
+        return {'result': {'device_on': self.on}}
+
+    def getEnergyUsage(self):
+        self.request()
+        return {'current_power': 1850000}  # Older PyP100 versions return the raw response
+
+    def turnOn(self):
+        self.request()
+        self.on = True
+
+
+class TapoSessionTests(SimpleTestCase):
+
+    def setUp(self):
+        FakeP110.plugs, FakeP110.failures = [], []
+        module = types.ModuleType('PyP100')
+        module.PyP110 = types.SimpleNamespace(P110=FakeP110)
+        patcher = mock.patch.dict(sys.modules, {'PyP100': module})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tapo_utils.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = TapoSession('192.168.1.50', 'user', 'secret')
+
+    def test_session_is_reused(self):
+        self.assertFalse(self.session.get_state())
+        self.session.set_state(True)
+        self.assertTrue(self.session.get_state())
+        self.assertEqual(self.session.get_power(), 1850)
+        self.assertEqual(len(FakeP110.plugs), 1)  # A single handshake and login
+
+    def test_expired_session_logs_in_again(self):
+        session = TapoSession('192.168.1.50', 'user', 'secret', ttl=-1)
+        session.get_state()
+        session.get_state()
+        self.assertEqual(len(FakeP110.plugs), 2)
+
+    def test_relogin_after_error(self):
+        self.session.get_state()
+        FakeP110.failures = [RuntimeError('Error code: 9999, session expired')]
+        self.assertFalse(self.session.get_state())
+        self.assertEqual(len(FakeP110.plugs), 2)  # The failed session was replaced
+        self.sleep.assert_called_once_with(TAPO_INITIAL_BACKOFF)
+
+    @mock.patch.object(tapo_utils, 'TAPO_ATTEMPTS', 7)
+    def test_bounded_backoff(self):
+        FakeP110.failures = [ConnectionError('unreachable')] * 7
+        with self.assertRaises(TapoError):
+            self.session.get_state()
+        waits = [call.args[0] for call in self.sleep.call_args_list]
+        self.assertEqual(waits, [2, 4, 8, 16, TAPO_MAX_BACKOFF, TAPO_MAX_BACKOFF])
+        self.assertEqual(len(FakeP110.plugs), 7)  # Every attempt logs in again
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from django.test import SimpleTestCase
+
+from components.telemetry import STALE_SNAPSHOT_SECONDS, TelemetrySample, TelemetrySampler
+
+
+class TelemetrySnapshotTests(SimpleTestCase):
+
+    def setUp(self):
+        self.sampler = TelemetrySampler('snapshot-test')  # Never started, the samples are appended directly
+
+    def test_missing_readings(self):
+        self.sampler._append(TelemetrySample(time.time(), None, 500, None, 0))
+        snapshot = self.sampler.snapshot()
+        self.assertIsNone(snapshot.battery_soc)
+        self.assertIsNone(snapshot.surplus)
+
+    def test_stale_snapshot(self):
+        now = time.time()
+        self.sampler._append(TelemetrySample(now - STALE_SNAPSHOT_SECONDS - 1, 1000, 500, 50, 0))
+        self.assertTrue(self.sampler.snapshot().is_stale(now))
+        self.sampler._append(TelemetrySample(now, 1000, 500, 50, 0))
+        self.assertFalse(self.sampler.snapshot().is_stale(now))
+
+    async def test_cancelled_waiter_is_removed(self):
+        task = asyncio.create_task(self.sampler.next_snapshot())
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(self.sampler.waiters), 1)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(self.sampler.waiters, [])
+
+    def test_closed_loop_is_skipped(self):
+        loop = asyncio.new_event_loop()
+        self.sampler.waiters.append((loop, loop.create_future()))
+        loop.close()
+        self.sampler._append(TelemetrySample(time.time(), 1000, 500, 50, 0))  # Does not raise in the sampler
+        self.assertEqual(self.sampler.waiters, [])
@@ -0,0 +1,75 @@
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from components.timeseries import TimeSeriesStore
+
+
+class TimeSeriesRollupTests(SimpleTestCase):
+    """
+    Rollups of a day of raw samples, one every 10 seconds, with PV only between 10:00 and 14:00 UTC.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = TimeSeriesStore(Path(directory.name) / 'telemetry.sqlite3', batch_size=100000)
+        self.day = int(time.time()) // 86400 * 86400 - 86400  # Yesterday, complete and within the raw retention
+        for ts in range(self.day, self.day + 86400, 10):
+            if ts == self.day + 43200:
+                self.store.record_state(operation_mode=3)
+            elif ts == self.day:
+                self.store.record_state(operation_mode=1)
+            ppv = 1000 if 10 * 3600 <= ts - self.day < 14 * 3600 else 0
+            self.store.append(ts, ppv=ppv, house_consumption=500)
+        self.store.flush()
+
+    def test_rollup_levels(self):
+        for resolution, buckets in ((0, 8640), (60, 1440), (900, 96), (86400, 1)):
+            rows = self.store.query(self.day, self.day + 86400, resolution)
+            self.assertEqual(len(rows), buckets, resolution)
+        quarter = self.store.query(self.day, self.day + 86400, 900)
+        self.assertEqual([row['ppv'] for row in quarter[39:42]], [0, 1000, 1000])  # 9:45, 10:00, 10:15
+        daily, = self.store.query(self.day, self.day + 86400, 86400)
+        self.assertAlmostEqual(daily['ppv'], 1000 * 4 / 24)
+        self.assertEqual(daily['house_consumption'], 500)
+        self.assertEqual(daily['operation_mode'], 3)  # The highest mode code, not an average
+
+    def test_rollup_is_incremental(self):
+        minute_start = int(time.time()) // 60 * 60 - 120  # A complete minute today
+        self.store.append(minute_start + 30, ppv=2000, house_consumption=100)
+        self.store.flush()
+        self.assertEqual(len(self.store.query(self.day, self.day + 86400, 86400)), 1)
+        self.assertEqual(len(self.store.query(self.day, self.day + 86400, 60)), 1440)
+        minute, = self.store.query(minute_start, minute_start + 60, 60)
+        self.assertEqual((minute['ppv'], minute['operation_mode']), (2000, 3))
+
+    def test_default_resolution(self):
+        now = time.time()
+        self.assertEqual(self.store.resolution_for(now - 3600, now), 0)
+        self.assertEqual(self.store.resolution_for(now - 7 * 86400, now), 60)
+        self.assertEqual(self.store.resolution_for(now - 60 * 86400, now), 900)
+        self.assertEqual(self.store.resolution_for(now - 1000 * 86400, now), 86400)
+
+    def test_unknown_state(self):
+        with self.assertRaises(ValueError):
+            self.store.record_state(heat_pump=1)
+
+    def test_connections_are_closed(self):
+        connections, connect = [], sqlite3.connect
+
+        def tracked(*args, **kwargs):
+            connections.append(connect(*args, **kwargs))
+            return connections[-1]
+        with mock.patch.object(sqlite3, 'connect', tracked):
+            self.store.append(time.time(), ppv=1000)
+            self.store.flush()
+            self.store.query(self.day, self.day + 86400, 86400)
+        self.assertEqual(len(connections), 2)
+        for connection in connections:
+            with self.assertRaises(sqlite3.ProgrammingError):  # Closed
+                connection.execute('SELECT 1')
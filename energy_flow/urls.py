@@ -1,7 +1,10 @@
 from django.urls import path
-from .views import settings_view, success_view
+from .views import settings_view, success_view, dashboard_view, dashboard_stream, metrics_view
 
 urlpatterns = [
     path('', settings_view, name='settings'),
     path('success/', success_view, name='success'),
+    path('dashboard/', dashboard_view, name='dashboard'),
+    path('dashboard/stream/', dashboard_stream, name='dashboard_stream'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
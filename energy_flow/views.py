@@ -1,93 +1,153 @@
+import json
 import logging
+import time
 
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 
 from components.battery import battery_charging_task
 from components.boiler import boiler_task
 from components.car import car_charging_task
+from components.metrics import registry
+from components.peak_limiter import peak_limiter_task
+from components.status import get_status
+from components.telemetry import get_sampler
 from .forms import GeneralSettingsForm
-from .models import GeneralSettings
-from .task_control import TaskControl
+from .live_config import get_live_config
+from .settings_cache import get_settings, get_settings_instance
+from .task_control import get_supervisor
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 
-# Updated task controls dictionary
-task_controls = {
-    'battery_charging': None,
-    'boiler_task': None,
-    'car_charging': None
+STREAM_HEARTBEAT_SECONDS = 15  # Keeps the event stream open through proxies when nothing changes
+STREAM_WSGI_SECONDS = 300  # Maximum duration of an event stream served by a WSGI worker thread
+STREAM_RETRY_MS = 1000  # Delay before the browser reconnects to a closed event stream
+
+
+# Tasks controlled from the settings - task function, the enable flag and the settings requiring a restart
+TASKS = {
+    'battery_charging': (battery_charging_task, 'BATTERY_ENABLED', {'INVERTER_IP_ADDRESS'}),
+    'boiler_task': (boiler_task, 'BOJLER_ENABLED', {'INVERTER_IP_ADDRESS', 'BOJLER_TAPO_IP_ADDRESS'}),
+    'car_charging': (car_charging_task, 'CAR_ENABLED', {'INVERTER_IP_ADDRESS', 'EVCC_URL'}),
+    'peak_limiter': (peak_limiter_task, 'PEAK_LIMITER_ENABLED', {'INVERTER_IP_ADDRESS'}),
 }
 
+
 def start_task(task_name, task_function, *args):
-    if task_controls[task_name] is None or not task_controls[task_name].thread.is_alive():
-        task_control = TaskControl(task_function, *args)
-        task_controls[task_name] = task_control
-        task_control.start()
-    else:
-        logging.info(f"{task_name} is already running, stopping and relaunching again.")
-        stop_task(task_name)
-        task_control = TaskControl(task_function, *args)
-        task_controls[task_name] = task_control
-        task_control.start()
+    get_supervisor().start(task_name, task_function, *args, wait=False)
 
 def stop_task(task_name):
-    if task_controls[task_name]:
-        task_controls[task_name].stop()
-        task_controls[task_name] = None
+    get_supervisor().stop(task_name, wait=False)
+
+
+def reconcile_tasks(previous, settings):
+    """
+    Bring the tasks in line with the settings. Tasks are started or stopped only when their enable flag changed
+    and restarted only when a setting they cannot apply on the fly changed, the others pick up the new
+    configuration on their next tick.
+
+    :param previous: ConfigSnapshot before the change
+    :param settings: Current ConfigSnapshot
+    """
+    changed = settings.diff(previous)
+    supervisor = get_supervisor()
+    woken = False
+    for task_name, (task_function, enabled_field, restart_fields) in TASKS.items():
+        running = supervisor.is_running(task_name)
+        if settings[enabled_field] and (not running or changed & restart_fields):
+            start_task(task_name, task_function, get_live_config())
+        elif not settings[enabled_field] and running:
+            stop_task(task_name)
+        elif running and changed:
+            supervisor.wake(task_name)  # Apply the new settings without waiting for the sleep to end
+            woken = True
+    if woken:
+        # The boiler and car tasks follow the telemetry, a new sample makes them apply the settings right away
+        get_sampler(settings['INVERTER_IP_ADDRESS']).wake()
 
 
 def settings_view(request):
-    settings = GeneralSettings.objects.first()
-    if not settings:
-        settings = GeneralSettings.objects.create()
+    previous = get_settings()
 
     if request.method == 'POST':
-        general_form = GeneralSettingsForm(request.POST, instance=settings, prefix='general')
+        general_form = GeneralSettingsForm(request.POST, instance=get_settings_instance(), prefix='general')
 
         if general_form.is_valid():
-            general_form.save()
-
-            # Start or stop background tasks based on form values
-            if general_form.cleaned_data['BATTERY_ENABLED']:
-                start_task('battery_charging',
-                           battery_charging_task,
-                           general_form.cleaned_data['INVERTER_IP_ADDRESS'],
-                           general_form.cleaned_data['CHARGE_THRESHOLD_EUR'],
-                           general_form.cleaned_data['BATTERY_UPPER_LEVEL'],
-                           general_form.cleaned_data['CHARGE_HOURS'],
-                           general_form.cleaned_data['GRADIENT_THRESHOLD'],
-                           general_form.cleaned_data['LOCAL_EXTREME_HOURS_WINDOW']
-                           )
-            else:
-                stop_task('battery_charging')
-
-            if general_form.cleaned_data['BOJLER_ENABLED']:
-                start_task('boiler_task',
-                           boiler_task,
-                           general_form.cleaned_data['INVERTER_IP_ADDRESS'],
-                           general_form.cleaned_data['BOJLER_TAPO_IP_ADDRESS'],
-                           general_form.cleaned_data['BOJLER_CONSUMPTION'])
-            else:
-                stop_task('boiler_task')
-
-            if general_form.cleaned_data['CAR_ENABLED']:
-                start_task('car_charging',
-                           car_charging_task,
-                           general_form.cleaned_data['INVERTER_IP_ADDRESS'],
-                           general_form.cleaned_data['MAX_CURRENT_A'],
-                           general_form.cleaned_data['MIN_CURRENT_A'])
-            else:
-                stop_task('car_charging')
+            general_form.save()  # The settings cache is updated by the post_save signal
+
+            # Start, stop or reconfigure background tasks based on form values
+            reconcile_tasks(previous, get_settings())
 
             return redirect('success')
 
     else:
-        general_form = GeneralSettingsForm(instance=settings, prefix='general')
+        general_form = GeneralSettingsForm(instance=get_settings_instance(), prefix='general')
 
     return render(request, 'energy_flow/settings.html', {
         'general_form': general_form
     })
 
 def success_view(request):
-    return render(request, 'energy_flow/success.html')
\ No newline at end of file
+    return render(request, 'energy_flow/success.html')
+
+
+def dashboard_view(request):
+    return render(request, 'energy_flow/dashboard.html')
+
+
+def _event(sections):
+    return f'data: {json.dumps(sections)}\n\n'
+
+
+async def _stream_events():
+    status = get_status()
+    version, sections = status.get()
+    yield f'retry: {STREAM_RETRY_MS}\n' + _event(sections)
+    while True:
+        new_version, sections = await status.wait(version, STREAM_HEARTBEAT_SECONDS)
+        if new_version == version:
+            yield ': heartbeat\n\n'
+            continue
+        version = new_version
+        yield _event(sections)
+
+
+def _stream_events_blocking(duration):
+    status = get_status()
+    version, sections = status.get()
+    yield f'retry: {STREAM_RETRY_MS}\n' + _event(sections)
+    deadline = time.monotonic() + duration
+    while (remaining := deadline - time.monotonic()) > 0:
+        new_version, sections = status.wait_blocking(version, min(STREAM_HEARTBEAT_SECONDS, remaining))
+        if new_version == version:
+            yield ': heartbeat\n\n'
+            continue
+        version = new_version
+        yield _event(sections)
+
+
+def dashboard_stream(request):
+    """
+    Server-Sent Events with the latest state of the controllers, read from the in-memory status cache.
+
+    Under ASGI the stream is served asynchronously and stays open without occupying a worker thread. Under WSGI,
+    e.g. `manage.py runserver`, every open stream blocks a worker thread, so it is closed after
+    STREAM_WSGI_SECONDS and the browser reconnects.
+    """
+    if isinstance(request, ASGIRequest):
+        events = _stream_events()
+    else:
+        events = _stream_events_blocking(STREAM_WSGI_SECONDS)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable buffering in nginx
+    return response
+
+
+def metrics_view(request):
+    """
+    Metrics of the device I/O and the control loops in the Prometheus text format.
+    """
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
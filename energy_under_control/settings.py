@@ -122,3 +122,7 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Databases written by the components, outside of the Django DB
+PRICE_STORE_PATH = BASE_DIR / 'ote_prices.sqlite3'  # Downloaded OTE prices
+TIMESERIES_PATH = BASE_DIR / 'telemetry.sqlite3'  # Recorded inverter telemetry and device states